@@ -0,0 +1,102 @@
+import argparse
+import logging
+import pathlib
+import time
+import config.config as cnf
+from config.configure_log import configure_log
+import ingestion.write_behind as write_behind
+import ingestion.master_store as master_store
+from ingestion.append_batch import AppendBatch
+from pipeline import prefetch
+from scheduler import sort_batch
+from transformation.process_files import process_file, flush_batch, shutdown_erasure_executor
+
+# ids of these datasets are kept for the whole run, as transactions are checked against them,
+# ids of other datasets only until they're appended to the master files
+KEPT_IDS = ['customers', 'products']
+
+def get_partitions(input_root:str, start:str=None, end:str=None) -> list:
+    """Finds date directories with input files, eg 2020/01/02
+    Args:
+        input_root(str): path to the source data
+        start(str): first date directory to process, eg 2020/01/01, all if None
+        end(str): last date directory to process, eg 2020/12/31, all if None
+    Returns:
+        list of (date directory, paths of its files in the order they're processed), oldest first
+    """
+    input_root = pathlib.Path(input_root)
+    partitions = {}
+    for path in input_root.rglob('*'):
+        if path.is_file() and '.json' in path.suffixes:
+            partition = path.parent.relative_to(input_root).as_posix()
+            partitions.setdefault(partition, []).append(str(path))
+
+    return [(partition, sort_batch(paths)) for partition, paths in sorted(partitions.items())
+            if (start is None or partition >= start) and (end is None or partition <= end)]
+
+def flush(batch:AppendBatch, known_ids:dict):
+    """Appends master and quarantine files with rows collected in the batch
+    Args:
+        batch(AppendBatch): collected rows
+        known_ids(dict): ids saved per dataset, ids that are now
+            in the id index are removed, except KEPT_IDS
+    """
+    # files are left out of the batch if their outputs couldn't be written
+    write_behind.flush()
+    flush_batch(batch)
+    for file_name in list(known_ids):
+        if file_name not in KEPT_IDS:
+            del known_ids[file_name]
+
+def backfill(partitions:list, batch_rows:int) -> int:
+    """Processes files of all partitions in one process. Ids saved from all files
+    are kept in memory and master and quarantine files are appended
+    once batch_rows rows are collected, instead of after each file
+    Args:
+        partitions(list): (date directory, paths of its files) from get_partitions
+        batch_rows(int): number of rows collected before master and quarantine files are appended
+    Returns:
+        number of processed files
+    """
+    known_ids = {}
+    batch = AppendBatch(batch_rows)
+    file_count = 0
+    try:
+        for partition, paths in partitions:
+            logging.info(f"Backfilling {len(paths)} files from {partition}.")
+            if cnf.pipeline_enabled:
+                files = prefetch(paths, cnf.pipeline_buffer_size)
+            else:
+                files = ((path, None) for path in paths)
+
+            for path, chunks in files:
+                process_file(path, known_ids=known_ids, chunks=chunks, batch=batch)
+                file_count += 1
+                if batch.is_full():
+                    flush(batch, known_ids)
+            print('Processed:', partition)
+    finally:
+        # rows of the last files, and transformed files still being written
+        flush(batch, known_ids)
+        write_behind.flush()
+        shutdown_erasure_executor()
+        master_store.wait_for_compactions()
+    return file_count
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Processes all files in input_root, oldest date first. '
+                                                 'Stop monitor.py while it runs')
+    parser.add_argument('--start', help='first date directory to process, eg 2020/01/01')
+    parser.add_argument('--end', help='last date directory to process, eg 2020/12/31')
+    parser.add_argument('--batch-rows', type=int, default=cnf.backfill_batch_rows,
+                        help='number of rows collected before master and quarantine files are appended')
+    args = parser.parse_args()
+
+    configure_log(cnf.log_file_path)
+
+    partitions = get_partitions(cnf.input_root, args.start, args.end)
+    print('Backfilling', sum(len(paths) for _, paths in partitions), 'files from', len(partitions), 'date directories')
+    start_time = time.perf_counter()
+    file_count = backfill(partitions, args.batch_rows)
+    print(f'{file_count} files processed in {time.perf_counter() - start_time:.1f}s')
@@ -0,0 +1,217 @@
+import argparse
+import datetime
+import gzip
+import json
+import pathlib
+import random
+
+def write_json_gz(path:str, rows:list):
+    """Writes rows as json lines to json.gz file
+    Args:
+        path(str): path of the file
+        rows(list): list of dicts
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wt', encoding='UTF-8') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+
+def add_noise(rnd:random.Random, rows:list, not_empty_cols:list,
+              na_ratio:float, duplicate_ratio:float) -> list:
+    """Empties required fields in some rows and repeats some rows
+    Args:
+        rnd(random.Random): random generator
+        rows(list): list of dicts
+        not_empty_cols(list): fields that have to be populated
+        na_ratio(float): share of rows with an empty required field
+        duplicate_ratio(float): share of rows repeated with the same id
+    Returns:
+        list of dicts with noise
+    """
+    for row in rows:
+        if rnd.random() < na_ratio:
+            row[rnd.choice(not_empty_cols)] = rnd.choice([None, ''])
+    duplicates = [dict(rnd.choice(rows)) for _ in range(int(len(rows) * duplicate_ratio))] if rows else []
+    return rows + duplicates
+
+def generate_customers(rnd:random.Random, start_id:int, row_count:int,
+                       na_ratio:float=0.0, duplicate_ratio:float=0.0) -> list:
+    """Generates customers
+    Args:
+        rnd(random.Random): random generator
+        start_id(int): first customer id
+        row_count(int): number of customers
+        na_ratio(float): share of rows with an empty required field
+        duplicate_ratio(float): share of rows repeated with the same id
+    Returns:
+        list of dicts
+    """
+    rows = []
+    for customer_id in range(start_id, start_id + row_count):
+        rows.append({
+            'id': customer_id,
+            'first_name': rnd.choice(['Anna', 'John', 'Maria', 'Peter', 'Eva', 'Tom']),
+            'last_name': rnd.choice(['Smith', 'Novak', 'Brown', 'Wilson', 'Taylor']) + str(customer_id % 97),
+            'email': f'customer{customer_id}@example.com',
+            'phone_number': f'+44 7{rnd.randrange(10**8, 10**9)}',
+            'address': f'{rnd.randrange(1, 300)} High Street, Town {customer_id % 50}',
+        })
+    return add_noise(rnd, rows, ['id', 'first_name', 'last_name', 'email'], na_ratio, duplicate_ratio)
+
+def generate_products(rnd:random.Random, start_sku:int, row_count:int,
+                      na_ratio:float=0.0, duplicate_ratio:float=0.0,
+                      non_positive_ratio:float=0.0) -> list:
+    """Generates products
+    Args:
+        rnd(random.Random): random generator
+        start_sku(int): first sku number
+        row_count(int): number of products
+        na_ratio(float): share of rows with an empty required field
+        duplicate_ratio(float): share of rows repeated with the same sku
+        non_positive_ratio(float): share of rows with price or popularity not greater than 0
+    Returns:
+        list of dicts
+    """
+    rows = []
+    for sku in range(start_sku, start_sku + row_count):
+        rows.append({
+            'sku': sku,
+            'name': f'product {sku}',
+            'price': round(rnd.uniform(0.5, 200), 2),
+            'category': rnd.choice(['food', 'home', 'garden', 'toys', 'books']),
+            'popularity': round(rnd.uniform(0.01, 1), 3),
+        })
+        if rnd.random() < non_positive_ratio:
+            rows[-1][rnd.choice(['price', 'popularity'])] = -rnd.choice([0, 1])
+    return add_noise(rnd, rows, ['sku', 'name', 'price', 'category', 'popularity'], na_ratio, duplicate_ratio)
+
+def generate_transactions(rnd:random.Random, start_id:int, row_count:int,
+                          customer_ids:list, skus:list, date:datetime.date,
+                          na_ratio:float=0.0, duplicate_ratio:float=0.0,
+                          bad_cost_ratio:float=0.0, unknown_ratio:float=0.0,
+                          max_products:int=5) -> list:
+    """Generates transactions with nested purchases
+    Args:
+        rnd(random.Random): random generator
+        start_id(int): number of the first transaction
+        row_count(int): number of transactions
+        customer_ids(list): existing customer ids
+        skus(list): existing sku numbers
+        date(datetime.date): date of the transactions
+        na_ratio(float): share of rows with an empty transaction id
+        duplicate_ratio(float): share of rows repeated with the same id
+        bad_cost_ratio(float): share of rows where total cost doesn't match products
+        unknown_ratio(float): share of rows with unknown customer or sku
+        max_products(int): max number of products in one transaction
+    Returns:
+        list of dicts
+    """
+    rows = []
+    for number in range(start_id, start_id + row_count):
+        products = []
+        for _ in range(rnd.randint(1, max_products)):
+            quantity = rnd.randint(1, 5)
+            price = round(rnd.uniform(0.5, 200), 2)
+            products.append({'sku': rnd.choice(skus), 'quantity': quantity,
+                             'price': f'{price:.2f}', 'total': f'{quantity * price:.2f}'})
+        total_cost = round(sum(float(product['total']) for product in products), 2)
+        if rnd.random() < bad_cost_ratio:
+            total_cost += rnd.choice([-1, 1]) * rnd.randint(1, 50)
+        customer_id = rnd.choice(customer_ids)
+        if rnd.random() < unknown_ratio:
+            if rnd.random() < 0.5:
+                customer_id = -number
+            else:
+                products[0]['sku'] = -number
+        rows.append({
+            'transaction_id': f'{date:%Y%m%d}-{number}',
+            'transaction_time': f'{date:%Y-%m-%d}T{rnd.randrange(24):02d}:{rnd.randrange(60):02d}:00',
+            'customer_id': customer_id,
+            'delivery_address': {'address': f'{rnd.randrange(1, 300)} High Street',
+                                 'postcode': f'AB{rnd.randrange(1, 99)} {rnd.randrange(1, 9)}CD'},
+            'purchases': {'products': products, 'total_cost': f'{total_cost:.2f}'},
+        })
+    return add_noise(rnd, rows, ['transaction_id'], na_ratio, duplicate_ratio)
+
+def generate_erasure_requests(rnd:random.Random, customers:list, row_count:int) -> list:
+    """Generates erasure requests with id only, email only, or both
+    Args:
+        rnd(random.Random): random generator
+        customers(list): customers to pick requests from
+        row_count(int): number of requests
+    Returns:
+        list of dicts
+    """
+    rows = []
+    for customer in rnd.sample(customers, min(row_count, len(customers))):
+        kind = rnd.choice(['id', 'email', 'both'])
+        rows.append({
+            'customer-id': customer['id'] if kind != 'email' else None,
+            'email': customer['email'] if kind != 'id' else None,
+        })
+    return rows
+
+def generate_tree(root:str, days:int=1, row_count:int=1000, seed:int=0,
+                  start_date:datetime.date=datetime.date(2024, 1, 1),
+                  na_ratio:float=0.01, duplicate_ratio:float=0.01,
+                  non_positive_ratio:float=0.01, bad_cost_ratio:float=0.01,
+                  unknown_ratio:float=0.01, erasure_count:int=10) -> list:
+    """Generates input tree root/YYYY/MM/DD/ with customers, products,
+    transactions and erasure-requests files for each day.
+    The same seed always gives the same data
+    Args:
+        root(str): input root directory
+        days(int): number of days
+        row_count(int): number of rows in each file
+        seed(int): seed of the random generator
+        start_date(datetime.date): date of the first day
+        na_ratio(float): share of rows with an empty required field
+        duplicate_ratio(float): share of rows repeated with the same id
+        non_positive_ratio(float): share of products with price or popularity not greater than 0
+        bad_cost_ratio(float): share of transactions with wrong total cost
+        unknown_ratio(float): share of transactions with unknown customer or sku
+        erasure_count(int): number of erasure requests each day
+    Returns:
+        list of generated file paths, in the order they should be processed
+    """
+    rnd = random.Random(seed)
+    root = pathlib.Path(root)
+    paths = []
+    for day in range(days):
+        date = start_date + datetime.timedelta(days=day)
+        day_path = root / f'{date:%Y}' / f'{date:%m}' / f'{date:%d}'
+        customers = generate_customers(rnd, day * row_count, row_count, na_ratio, duplicate_ratio)
+        products = generate_products(rnd, 100000 + day * row_count, row_count, na_ratio, duplicate_ratio, non_positive_ratio)
+        customer_ids = [row['id'] for row in customers if row['id'] not in [None, '']]
+        skus = [row['sku'] for row in products if row['sku'] not in [None, '']]
+        transactions = generate_transactions(rnd, day * row_count, row_count, customer_ids, skus, date,
+                                             na_ratio, duplicate_ratio, bad_cost_ratio, unknown_ratio)
+        erasure_requests = generate_erasure_requests(rnd, customers, erasure_count)
+        for name, rows in [('customers', customers), ('products', products),
+                           ('transactions', transactions), ('erasure-requests', erasure_requests)]:
+            path = day_path / f'{name}.json.gz'
+            write_json_gz(path, rows)
+            paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Generates synthetic input files')
+    parser.add_argument('root', help='input root directory')
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--na-ratio', type=float, default=0.01)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.01)
+    parser.add_argument('--non-positive-ratio', type=float, default=0.01)
+    parser.add_argument('--bad-cost-ratio', type=float, default=0.01)
+    parser.add_argument('--unknown-ratio', type=float, default=0.01)
+    parser.add_argument('--erasure-requests', type=int, default=10)
+    args = parser.parse_args()
+
+    paths = generate_tree(args.root, args.days, args.rows, args.seed,
+                          na_ratio=args.na_ratio, duplicate_ratio=args.duplicate_ratio,
+                          non_positive_ratio=args.non_positive_ratio, bad_cost_ratio=args.bad_cost_ratio, unknown_ratio=args.unknown_ratio,
+                          erasure_count=args.erasure_requests)
+    print(f'{len(paths)} files generated in {args.root}')
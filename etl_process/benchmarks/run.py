@@ -0,0 +1,210 @@
+import argparse
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import random
+import shutil
+import tempfile
+import time
+import pandas as pd
+import config.config as cnf
+import transformation.transformations as t
+import transformation.rules as rules
+import transformation.process_files as pf
+import ingestion.master_store as master_store
+import ingestion.id_index as id_index
+from ingestion.read_write import read_gzip_json, write_data
+from benchmarks import generator
+
+def configure_paths(work_dir:pathlib.Path):
+    """Points all paths in config to a temporary directory
+    Args:
+        work_dir(pathlib.Path): temporary directory
+    """
+    cnf.input_root = str(work_dir / 'input')
+    cnf.output_root = str(work_dir / 'output')
+    cnf.log_file_path = str(work_dir / 'log' / 'process_files.log')
+    cnf.map_paths = {name: str(work_dir / 'maps' / f'{name}_map.json.gz') for name in cnf.map_paths}
+    cnf.quarantine_paths = {name: str(work_dir / 'quarantine' / f'{name}.json.gz') for name in cnf.quarantine_paths}
+    cnf.processed_manifest_path = str(work_dir / 'maps' / 'processed_files.sqlite')
+
+def build_masters(rnd:random.Random, master_rows:int, file_rows:int):
+    """Creates transformed customers files and master files with master_rows ids
+    Args:
+        rnd(random.Random): random generator
+        master_rows(int): number of ids in each master file
+        file_rows(int): number of customers in each transformed file
+    """
+    start_date = datetime.date(2020, 1, 1)
+    for number, start in enumerate(range(0, master_rows, file_rows)):
+        row_count = min(file_rows, master_rows - start)
+        date = start_date + datetime.timedelta(days=number)
+        output_path = pathlib.Path(cnf.output_root, f'{date:%Y}', f'{date:%m}', f'{date:%d}', 'customers.json.gz')
+
+        customers = pd.DataFrame(generator.generate_customers(rnd, start, row_count))
+        write_data(output_path, customers)
+        master_store.append(cnf.map_paths['customers'],
+                            t.source_location_map(customers, cnf.map_columns['customers'], str(output_path)))
+
+        products = pd.DataFrame({'sku': range(100000 + start, 100000 + start + row_count)})
+        master_store.append(cnf.map_paths['products'], t.source_location_map(products, source=''))
+
+        transactions = pd.DataFrame({'transaction_id': [f'old-{i}' for i in range(start, start + row_count)]})
+        master_store.append(cnf.map_paths['transactions'], t.source_location_map(transactions, source=''))
+
+    for file_name in cnf.map_paths:
+        id_index.build_index(cnf.map_paths[file_name], cnf.unique_col[file_name])
+
+def build_input(rnd:random.Random, master_rows:int, input_rows:int, args) -> dict:
+    """Creates files that arrive, part of the ids already exist in the master files
+    Args:
+        rnd(random.Random): random generator
+        master_rows(int): number of ids in each master file
+        input_rows(int): number of rows in each arriving file
+        args(argparse.Namespace): generator settings
+    Returns:
+        dict with paths of the arriving files
+    """
+    day_path = pathlib.Path(cnf.input_root, '2024', '01', '01')
+    start = max(master_rows - int(input_rows * args.duplicate_ratio), 0)
+
+    customers = generator.generate_customers(rnd, start, input_rows, args.na_ratio, args.duplicate_ratio)
+    products = generator.generate_products(rnd, 100000 + start, input_rows, args.na_ratio, args.duplicate_ratio)
+    customer_ids = list(range(max(master_rows - input_rows, 0), master_rows)) or [0]
+    skus = list(range(100000 + max(master_rows - input_rows, 0), 100000 + master_rows)) or [100000]
+    transactions = generator.generate_transactions(rnd, 0, input_rows, customer_ids, skus, datetime.date(2024, 1, 1),
+                                                   args.na_ratio, args.duplicate_ratio,
+                                                   args.bad_cost_ratio, args.unknown_ratio)
+    erasure_requests = generator.generate_erasure_requests(
+        rnd, generator.generate_customers(random.Random(0), 0, master_rows), args.erasure_requests)
+
+    paths = {}
+    for name, rows in [('customers', customers), ('products', products),
+                       ('transactions', transactions), ('erasure-requests', erasure_requests)]:
+        paths[name] = day_path / f'{name}.json.gz'
+        generator.write_json_gz(paths[name], rows)
+    return paths
+
+def measure(func, repeats:int) -> float:
+    """Runs function several times
+    Args:
+        func(function): function to measure, called without arguments
+        repeats(int): number of runs
+    Returns:
+        shortest time of a run in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run_stages(master_rows:int, args) -> list:
+    """Measures each stage against master files with master_rows ids
+    Args:
+        master_rows(int): number of ids in each master file
+        args(argparse.Namespace): benchmark settings
+    Returns:
+        list of results, one dict per stage
+    """
+    rnd = random.Random(args.seed)
+    build_masters(rnd, master_rows, args.file_rows)
+    paths = build_input(rnd, master_rows, args.rows, args)
+
+    customers = read_gzip_json(paths['customers'])
+    transactions = read_gzip_json(paths['transactions'])
+    # skus of products that arrived the same day, shared by the scheduler
+    known_skus = set(read_gzip_json(paths['products'])['sku'].dropna().tolist())
+    not_empty = cnf.not_empty_cols['customers']
+    customers_clean, _ = t.remove_rows_with_na(customers.copy(), not_empty)
+
+    stages = {
+        'read_customers': (len(customers), lambda: read_gzip_json(paths['customers'])),
+        'read_transactions': (len(transactions), lambda: read_gzip_json(paths['transactions'])),
+        'remove_rows_with_na': (len(customers),
+            lambda: t.remove_rows_with_na(customers.copy(), not_empty)),
+        'remove_id_dups': (len(customers_clean),
+            lambda: t.remove_id_dups(customers_clean.copy(), cnf.map_paths['customers'], cnf.unique_col['customers'])),
+        'total_cost_check': (len(transactions),
+            lambda: t.total_cost_check(transactions.copy())),
+        'id_exists_check': (len(transactions),
+            lambda: t.id_exists_check(transactions.copy(), 'sku', 'products', known_ids=known_skus)),
+        'apply_rules': (len(transactions),
+            lambda: rules.apply_rules('transactions', str(paths['transactions']), transactions, {'products': known_skus})),
+    }
+
+    results = []
+    for stage, (input_rows, func) in stages.items():
+        # first run warms up caches and indexes
+        func()
+        results.append({'stage': stage, 'master_rows': master_rows, 'input_rows': input_rows,
+                        'seconds': measure(func, args.repeats)})
+    # ids reserved by apply_rules aren't saved
+    id_index.release_ids(cnf.map_paths['transactions'], cnf.unique_col['transactions'],
+                         id_index.get_owner(str(paths['transactions'])))
+
+    # erasure changes the data, so it's measured once
+    output_path = pathlib.Path(cnf.output_root, '2024', '01', '01', 'erasure-requests.json.gz')
+    results.append({'stage': 'erasure', 'master_rows': master_rows, 'input_rows': args.erasure_requests,
+                    'seconds': measure(lambda: pf.erasure(str(paths['erasure-requests']), str(output_path)), 1)})
+    return results
+
+def compare(results:list, baseline_path:str):
+    """Prints change of each stage against previous results
+    Args:
+        results(list): results of this run
+        baseline_path(str): path to results of a previous run
+    """
+    with open(baseline_path, 'rt') as f:
+        baseline = json.load(f)
+    old = {(r['stage'], r['master_rows']): r['seconds'] for r in baseline['results']}
+    for r in results:
+        key = (r['stage'], r['master_rows'])
+        if key in old and old[key] > 0:
+            print(f"{r['stage']:<22}{r['master_rows']:>12}{old[key]:>12.4f}{r['seconds']:>12.4f}{r['seconds'] / old[key]:>10.2f}x")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Measures each processing stage on synthetic data')
+    parser.add_argument('--master-sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='number of ids in the master files')
+    parser.add_argument('--rows', type=int, default=10000, help='number of rows in each arriving file')
+    parser.add_argument('--file-rows', type=int, default=50000, help='number of customers in each transformed file')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--na-ratio', type=float, default=0.01)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    parser.add_argument('--bad-cost-ratio', type=float, default=0.01)
+    parser.add_argument('--unknown-ratio', type=float, default=0.01)
+    parser.add_argument('--erasure-requests', type=int, default=100)
+    parser.add_argument('--output', default='benchmark_results.json', help='where to save the results')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    # only errors are shown, eg warnings about missed erasure requests are expected
+    logging.basicConfig(level=logging.ERROR)
+
+    results = []
+    for master_rows in args.master_sizes:
+        work_dir = pathlib.Path(tempfile.mkdtemp(prefix='etl_benchmark_'))
+        try:
+            configure_paths(work_dir)
+            for result in run_stages(master_rows, args):
+                print(f"{result['stage']:<22}{result['master_rows']:>12}{result['seconds']:>12.4f}s")
+                results.append(result)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'wt') as f:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'pandas': pd.__version__,
+                   'settings': vars(args),
+                   'results': results}, f, indent=2)
+    print('Results saved to', args.output)
+
+    if args.compare:
+        compare(results, args.compare)
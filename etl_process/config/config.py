@@ -1,51 +1,224 @@
-# source data will land in this path
-input_root = 'C:\\Users\\...\\test-data'
-
-# transformed data will be saved here
-output_root = 'C:\\Users\\...\\transformed'
-
-# path to the log file
-log_file_path = 'C:\\Users\\...\\log\\process_files.log'
-
-# paths to master files containing all unique ids
-map_paths = {
-    'customers': 'C:\\Users\\...\\maps\\customers_map.json.gz',
-    'products': 'C:\\Users\\...\\maps\\products_map.json.gz',
-    'transactions': 'C:\\Users\\...\\maps\\transactions_map.json.gz'
-}
-
-# paths to quarantined rows
-quarantine_paths = {
-    'customers': 'C:\\Users\\...\\quarantine\\customers.json.gz',
-    'products': 'C:\\Users\\...\\quarantine\\products.json.gz',
-    'transactions': 'C:\\Users\\...\\quarantine\\transactions.json.gz'
-}
-
-# columns that should be anonymised
-anonymisation = ['first_name', 'last_name', 'email', 'phone_number', 'address']
-
-# columns that should be saved in the master file
-map_columns = {
-    'customers': ['id', 'email'],
-    'products': ['sku'],
-    'transactions': ['transaction_id']
-}
-
-# columns that have to be populated
-not_empty_cols = {
-    'customers': ['id', 'first_name', 'last_name', 'email'],
-    'products': ['sku', 'name', 'price', 'category', 'popularity'],
-    'transactions': ['transaction_id']
-}
-
-# columns that have to be unique within the whole data
-unique_col = {
-    'customers': 'id',
-    'products': 'sku',
-    'transactions': 'transaction_id'
-}
-
-# columns that have to be greater than 0
-positive_col = {
-    'products': ['price', 'popularity'],
-}
\ No newline at end of file
+# source data will land in this path
+input_root = 'C:\\Users\\...\\test-data'
+
+# transformed data will be saved here
+output_root = 'C:\\Users\\...\\transformed'
+
+# path to the log file
+log_file_path = 'C:\\Users\\...\\log\\process_files.log'
+
+# paths to master files containing all unique ids
+map_paths = {
+    'customers': 'C:\\Users\\...\\maps\\customers_map.json.gz',
+    'products': 'C:\\Users\\...\\maps\\products_map.json.gz',
+    'transactions': 'C:\\Users\\...\\maps\\transactions_map.json.gz'
+}
+
+# paths to quarantined rows, rows are saved in partitions by the date they arrived,
+# eg quarantine/customers/2020/01/02/customers.json.gz, each with index.json of reasons, customer ids and emails
+quarantine_paths = {
+    'customers': 'C:\\Users\\...\\quarantine\\customers.json.gz',
+    'products': 'C:\\Users\\...\\quarantine\\products.json.gz',
+    'transactions': 'C:\\Users\\...\\quarantine\\transactions.json.gz'
+}
+
+# columns that should be anonymised
+anonymisation = ['first_name', 'last_name', 'email', 'phone_number', 'address']
+
+# erasure hashes transformed files in parallel, 'threads' - in a pool of threads,
+# 'processes' - in a pool of processes, uses all cores for large batches of requests
+erasure_pool = 'threads'
+
+# max number of threads or processes hashing transformed files
+erasure_workers = 4
+
+# columns that should be saved in the master file
+map_columns = {
+    'customers': ['id', 'email'],
+    'products': ['sku'],
+    'transactions': ['transaction_id']
+}
+
+# columns that have to be populated
+not_empty_cols = {
+    'customers': ['id', 'first_name', 'last_name', 'email'],
+    'products': ['sku', 'name', 'price', 'category', 'popularity'],
+    'transactions': ['transaction_id']
+}
+
+# columns that have to be unique within the whole data
+unique_col = {
+    'customers': 'id',
+    'products': 'sku',
+    'transactions': 'transaction_id'
+}
+
+# columns that have to be greater than 0
+positive_col = {
+    'products': ['price', 'popularity'],
+}
+
+# columns with ids that have to exist in the master file of another dataset,
+# columns that aren't in the file are looked up in products of purchases, eg sku
+reference_cols = {
+    'transactions': {'sku': 'products', 'customer_id': 'customers'},
+}
+
+# datasets where total_cost of purchases has to match the sum of totals of its products
+total_cost_check = ['transactions']
+
+# save transactions also as flat line items, one row per product bought (transaction_id, customer_id,
+# sku, quantity, total, date), next to the transformed file, eg transformed/2020/01/02/transactions_items.json.gz
+line_items_enabled = False
+
+# library parsing json lines of json.gz files, 'orjson' (faster, needs orjson),
+# 'json' (standard library), 'auto' - orjson if it's installed, json otherwise,
+# 'pandas' - pandas.read_json, infers types of all columns and ignores schemas
+json_parser = 'auto'
+
+# types of columns in files of each dataset, also used for its output and quarantine files,
+# 'dtypes' - pandas types of columns, other columns keep types of the json values,
+# 'category' - columns with few distinct values, saved as pandas categories,
+# 'raw' - nested columns that aren't transformed, kept as json text and written back as they arrived
+schemas = {
+    'customers': {
+        'dtypes': {'id': 'Int64', 'first_name': 'object', 'last_name': 'object', 'email': 'object',
+                   'phone_number': 'object', 'address': 'object'},
+    },
+    'products': {
+        'dtypes': {'sku': 'Int64', 'name': 'object', 'price': 'float64', 'popularity': 'float64'},
+        'category': ['category'],
+    },
+    'transactions': {
+        'dtypes': {'transaction_id': 'object', 'transaction_time': 'object', 'customer_id': 'Int64'},
+        'raw': ['delivery_address'],
+    },
+    'transactions_items': {
+        'dtypes': {'transaction_id': 'object', 'customer_id': 'Int64', 'sku': 'Int64', 'quantity': 'Int64',
+                   'total': 'float64', 'date': 'object'},
+    },
+    'erasure-requests': {
+        'dtypes': {'customer-id': 'Int64', 'email': 'object'},
+    },
+}
+
+# format of the output, master and quarantine files, 'json.gz' or 'parquet',
+# parquet needs pyarrow, reads only needed columns and keeps types,
+# files saved in one format are not read when the other one is set
+storage_format = 'json.gz'
+
+# gzip compression level (1 fastest - 9 smallest) of json.gz files for each dataset,
+# 'default' is used for files of other datasets
+compression_level = {
+    'default': 6,
+    'customers': 6,
+    'products': 6,
+    'transactions': 4
+}
+
+# number of threads compressing and decompressing json.gz files
+compression_threads = 4
+
+# json.gz files are split into blocks of about this many bytes,
+# compressed in parallel and saved as separate gzip members
+compression_block_size = 4 * 1024 * 1024
+
+# max number of rows in one parquet row group
+parquet_row_group_size = 100000
+
+# master files are saved as segments of up to this many rows,
+# segments smaller than half of it are merged by compaction
+master_segment_rows = 1000000
+
+# compaction starts in the background when a master file
+# has this many small segments
+compaction_min_segments = 20
+
+# seconds segments replaced by compaction or erasure are kept before they're deleted,
+# so readers that started before can finish, erased data stays in them until then
+segment_retention_seconds = 300
+
+# number of rows read and processed at a time, None to process whole files at once,
+# set it when files are too large to fit in memory
+chunk_size = None
+
+# how monitor.py processes arriving files,
+# 'workers' - files are queued and processed by resident worker threads,
+# 'processes' - files of each date are processed in a pool of worker processes, uses all cores,
+# 'subprocess' - main.py is run in a new process for every file
+monitor_mode = 'workers'
+
+# number of worker threads or processes processing files
+worker_count = 4
+
+# max number of batches of files waiting in the queue, when it's full the next batches
+# wait in the scheduler until a worker takes one, urgent batches (priority 0) are queued anyway
+queue_size = 100
+
+# priority of files of each dataset in the queue, lower is processed first, batches with the same
+# priority in the order they came, 0 - urgent, never waits behind other files, eg erasure requests;
+# customers are processed before erasure requests of the same date, so they come before bulk files,
+# 'default' is used for other datasets
+file_priority = {
+    'default': 2,
+    'erasure-requests': 0,
+    'customers': 1,
+}
+
+# seconds the size of an arriving file has to stay the same before it's processed
+settle_seconds = 0.5
+
+# record wall time, rows, bytes and peak memory of each stage of processing a file,
+# records are written as json lines to metrics_log_path,
+# totals in prometheus text format to metrics_path
+metrics_enabled = False
+metrics_log_path = 'C:\\Users\\...\\log\\metrics.jsonl'
+metrics_path = 'C:\\Users\\...\\metrics\\etl_metrics.prom'
+
+# profile memory of each stage of processing a file: peak resident memory, python allocations
+# (tracemalloc) and memory of dataframes, a json report of each file is saved in profile_dir,
+# it slows processing down, stages running in other threads at the same time are included
+profiling_enabled = False
+profile_dir = 'C:\\Users\\...\\log\\profiles'
+
+# number of call sites that allocated most memory listed for each stage and file, 0 to skip them
+profile_top_allocations = 10
+
+# overlap reading, transforming and writing in workers mode, the next file of a batch
+# is read and decompressed, and transformed files are compressed and written
+# in background threads while the current file is transformed
+pipeline_enabled = True
+
+# max number of chunks (whole files when chunk_size is None) read ahead,
+# and max number of transformed files waiting to be written
+pipeline_buffer_size = 2
+
+# seconds after which ids reserved by a worker that didn't save them
+# (eg its process was killed) can be used by other files again
+reservation_timeout = 3600
+
+# false positive rate of the bloom filter kept next to the master file of each dataset,
+# ids that aren't in the filter are new and aren't looked up in the id index,
+# lower rates take more memory, None for datasets without a filter,
+# 'default' is used for other datasets
+bloom_false_positive_rate = {
+    'default': 0.01,
+    'customers': 0.01,
+    'products': 0.01,
+    'transactions': 0.01
+}
+
+# number of ids a new bloom filter is sized for, a filter with more ids
+# is created again from the id index, twice as large as needed
+bloom_min_capacity = 1000000
+
+# number of rows backfill.py collects before master and quarantine files are appended
+backfill_batch_rows = 1000000
+
+# manifest of processed files (path, size, modification time, hash and written files),
+# files that are in it are skipped, eg when monitor.py is restarted, None to process all files
+processed_manifest_path = 'C:\\Users\\...\\maps\\processed_files.sqlite'
+
+# process files again when their content changed since they were processed,
+# rows with ids saved by the previous run are removed as duplicates
+reprocess_changed_files = False
@@ -1,8 +1,25 @@
-import logging
-import pathlib
-
-def configure_log(log_path):
-    log_file = pathlib.Path(log_path)
-    log_file.parent.mkdir(parents=True, exist_ok=True)
-    logging.basicConfig(filename=log_file, level=logging.INFO,
-                        format='%(asctime)s:%(levelname)s:%(message)s')
\ No newline at end of file
+import logging
+import pathlib
+import config.config as cnf
+
+def configure_log(log_path):
+    log_file = pathlib.Path(log_path)
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(filename=log_file, level=logging.INFO,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+
+def get_settings() -> dict:
+    """Returns values of config.py, eg to apply them in a spawned process
+    Returns:
+        dict {name: value}
+    """
+    return {name: value for name, value in vars(cnf).items() if not name.startswith('_')}
+
+def configure_process(settings:dict):
+    """Initializes a spawned process, applies config of the main process
+    (it may have been changed after config.py was imported) and configures the log
+    Args:
+        settings(dict): values of config.py, from get_settings
+    """
+    vars(cnf).update(settings)
+    configure_log(cnf.log_file_path)
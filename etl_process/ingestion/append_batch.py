@@ -0,0 +1,83 @@
+import pandas as pd
+import ingestion.quarantine_store as quarantine_store
+
+class AppendBatch:
+    """Collects rows appended to master and quarantine files by many files,
+    so they're saved together as one append of each file, eg by backfill.
+    Ids of the collected rows aren't in the id index until the batch is flushed,
+    so they have to be kept in known ids meanwhile
+    """
+    def __init__(self, max_rows:int):
+        """
+        Args:
+            max_rows(int): number of collected rows after which the batch is full
+        """
+        self.max_rows = max_rows
+        # (file name, quarantine, partition): [(input path, data), ...],
+        # quarantined rows of different dates are saved in different partitions
+        self.appends = {}
+        self.rows = 0
+        # (input path, outputs) of files whose rows are collected
+        self.processed = []
+        # files whose outputs couldn't be saved, their rows are left out,
+        # set by the writer thread
+        self.failed = set()
+
+    def add(self, file_name:str, input_path:str, data:pd.DataFrame, quarantine:bool=False):
+        """Adds rows that should be appended to the master or quarantine file
+        Args:
+            file_name(str): file name that arrived, eg customers
+            input_path(str): path of the file the rows are from
+            data(pd.DataFrame): rows to append, with source_location
+            quarantine(bool): if appending quarantine file (True) or master file (False)
+        """
+        partition = quarantine_store.get_partition(input_path) if quarantine else None
+        self.appends.setdefault((file_name, quarantine, partition), []).append((input_path, data))
+        self.rows += len(data)
+
+    def add_processed(self, input_path:str, outputs:list):
+        """Adds file that is recorded as processed when the batch is flushed
+        Args:
+            input_path(str): path of the file
+            outputs(list): paths of the files written while processing it
+        """
+        self.processed.append((input_path, outputs))
+
+    def fail(self, input_path:str):
+        """Leaves out rows of a file whose outputs couldn't be saved,
+        so it can be processed again
+        Args:
+            input_path(str): path of the file
+        """
+        self.failed.add(input_path)
+
+    def is_full(self) -> bool:
+        return self.rows >= self.max_rows
+
+    def take(self) -> list:
+        """Returns collected rows and empties the batch. Quarantine rows come first,
+        if appending stops halfway, files processed again duplicate
+        quarantined rows instead of losing rows rejected as duplicates
+        Returns:
+            list of (file name, quarantine, first input path, rows of all files)
+        """
+        appends = []
+        for (file_name, quarantine, _), parts in sorted(self.appends.items(), key=lambda item: not item[0][1]):
+            parts = [(input_path, data) for input_path, data in parts if input_path not in self.failed]
+            if not parts:
+                continue
+            data = pd.concat([data for _, data in parts], ignore_index=True)
+            appends.append((file_name, quarantine, parts[0][0], data))
+        self.appends = {}
+        self.rows = 0
+        return appends
+
+    def take_processed(self) -> list:
+        """Returns files added with add_processed and forgets them
+        Returns:
+            list of (input path, outputs)
+        """
+        processed = [(input_path, outputs) for input_path, outputs in self.processed if input_path not in self.failed]
+        self.processed = []
+        self.failed = set()
+        return processed
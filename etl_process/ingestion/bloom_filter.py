@@ -0,0 +1,296 @@
+import json
+import logging
+import math
+import os
+import pathlib
+import threading
+import numpy as np
+import pandas as pd
+import config.config as cnf
+
+# bytes at the start of the filter file with its settings as json, bits follow
+HEADER_SIZE = 4096
+
+# number of ids hashed at a time, each id takes 8 bytes for each of its bits
+BATCH_SIZE = 100000
+
+# filters opened by this process, path to the master file: BloomFilter
+filters = {}
+filters_lock = threading.Lock()
+
+def get_filter_path(map_path:str, version:int) -> pathlib.Path:
+    """Returns path to a version of the bloom filter kept next to the master file,
+    eg maps/customers_map.json.gz -> maps/customers_map.3.bloom.
+    Each new filter gets its own file, so a file mapped by other processes
+    is never replaced (that fails on Windows)
+    Args:
+        map_path(str): path to the master file
+        version(int): version of the filter
+    Returns:
+        path to the filter file
+    """
+    map_path = pathlib.Path(map_path)
+    return map_path.with_name(f"{map_path.name.split('.')[0]}.{version}.bloom")
+
+def get_versions(map_path:str) -> list:
+    """Returns versions of the bloom filter saved next to the master file
+    Args:
+        map_path(str): path to the master file
+    Returns:
+        sorted list of versions, the last one is in use
+    """
+    map_path = pathlib.Path(map_path)
+    name = map_path.name.split('.')[0]
+    versions = []
+    for path in map_path.parent.glob(f'{name}.*.bloom'):
+        version = path.name[len(name) + 1:-len('.bloom')]
+        if version.isdigit():
+            versions.append(int(version))
+    return sorted(versions)
+
+def remove_old(map_path:str):
+    """Deletes versions of the filter older than the one in use,
+    a file still mapped by another process on Windows can't be deleted,
+    it's deleted when the next filter is created
+    Args:
+        map_path(str): path to the master file
+    """
+    map_path = pathlib.Path(map_path)
+    # filter saved before the files had versions
+    paths = [map_path.with_name(map_path.name.split('.')[0] + '.bloom')]
+    paths += [get_filter_path(map_path, version) for version in get_versions(map_path)[:-1]]
+    for path in paths:
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            logging.info(f"Old bloom filter {path} wasn't deleted yet: {e}")
+
+def get_rate(map_path:str) -> float:
+    """Returns false positive rate of the filter, based on the dataset
+    in the name of the master file (eg customers_map.json.gz)
+    Args:
+        map_path(str): path to the master file
+    Returns:
+        false positive rate, None if the dataset has no filter
+    """
+    dataset = pathlib.Path(map_path).name.split('.')[0].split('_')[0]
+    return cnf.bloom_false_positive_rate.get(dataset, cnf.bloom_false_positive_rate.get('default'))
+
+def get_size(capacity:int, rate:float) -> tuple:
+    """Returns number of bits and hash functions of a filter
+    that holds capacity ids with the given false positive rate
+    Args:
+        capacity(int): number of ids
+        rate(float): false positive rate, eg 0.01
+    Returns:
+        (bits, hashes)
+    """
+    bits = math.ceil(-capacity * math.log(rate) / math.log(2) ** 2)
+    # whole bytes
+    bits = max(8, bits + (-bits) % 8)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+def is_integer(value) -> bool:
+    """Checks if id is a whole number, eg 12 or 12.0
+    Args:
+        value: id
+    Returns:
+        True if the id is hashed as a number
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return False
+    if isinstance(value, (int, np.integer)):
+        return True
+    return isinstance(value, (float, np.floating)) and float(value).is_integer()
+
+def hash_values(values:list) -> np.ndarray:
+    """Hashes ids to 64 bits, the same id gets the same hash in every
+    process and whether it came as int, float or Int64 (12 and 12.0),
+    other ids are hashed as text
+    Args:
+        values(list): ids, without missing values
+    Returns:
+        array of uint64 hashes
+    """
+    values = pd.Series(values)
+    if values.dtype.kind in 'iu':
+        return pd.util.hash_array(values.to_numpy('int64'))
+    hashes = np.empty(len(values), dtype='uint64')
+    numbers = values.map(is_integer).to_numpy(bool)
+    if numbers.any():
+        hashes[numbers] = pd.util.hash_array(values[numbers].astype('int64').to_numpy())
+    if not numbers.all():
+        hashes[~numbers] = pd.util.hash_array(values[~numbers].astype(str).to_numpy(object))
+    return hashes
+
+def get_positions(hashes:np.ndarray, bits:int, count:int) -> np.ndarray:
+    """Returns positions of the bits of each id, from two hashes
+    derived from the 64 bit hash (double hashing)
+    Args:
+        hashes(np.ndarray): uint64 hashes of ids
+        bits(int): size of the filter
+        count(int): number of bits of each id
+    Returns:
+        array of positions, one row per id
+    """
+    first = hashes[:, None]
+    second = ((hashes >> np.uint64(33)) ^ (hashes * np.uint64(0x9E3779B97F4A7C15)))[:, None] | np.uint64(1)
+    # uint64 overflows wrap around
+    return (first + np.arange(count, dtype='uint64') * second) % np.uint64(bits)
+
+class BloomFilter:
+    """Bloom filter of the ids of a master file, saved in a file and
+    memory mapped, so ids added by one process are seen by others.
+    Ids that the filter doesn't contain are new for sure,
+    the others may exist and are looked up in the id index
+    """
+    def __init__(self, path:pathlib.Path):
+        """
+        Args:
+            path(pathlib.Path): path to the filter file
+        """
+        self.path = pathlib.Path(path)
+        self.file_id = get_file_id(self.path)
+        self.data = np.memmap(self.path, dtype='uint8', mode='r+')
+        self.read_header()
+        self.bits = self.data[HEADER_SIZE:]
+
+    @property
+    def capacity(self) -> int:
+        return self.header['capacity']
+
+    @property
+    def rate(self) -> float:
+        return self.header['false_positive_rate']
+
+    def read_header(self) -> dict:
+        """Reads settings saved in the file, count and stamp are changed
+        by any process that adds ids, the file has to be locked meanwhile
+        Returns:
+            dict with settings
+        """
+        self.header = json.loads(bytes(self.data[:HEADER_SIZE]))
+        return self.header
+
+    def write_header(self, **values):
+        """Updates settings saved in the file, eg count and stamp
+        Args:
+            values: settings to change
+        """
+        self.header.update(values)
+        self.data[:HEADER_SIZE] = np.frombuffer(json.dumps(self.header).encode().ljust(HEADER_SIZE), dtype='uint8')
+
+    def might_contain(self, values:list) -> np.ndarray:
+        """Checks ids against the filter
+        Args:
+            values(list): ids, without missing values
+        Returns:
+            boolean array, False for ids that are new for sure
+        """
+        found = np.zeros(len(values), dtype=bool)
+        for start in range(0, len(values), BATCH_SIZE):
+            positions = get_positions(hash_values(values[start:start + BATCH_SIZE]),
+                                      self.header['bits'], self.header['hashes'])
+            values_bits = self.bits[positions >> np.uint64(3)]
+            found[start:start + BATCH_SIZE] = ((values_bits >> (positions & np.uint64(7)).astype('uint8')) & 1).all(axis=1)
+        return found
+
+    def add(self, values:list):
+        """Adds ids to the filter, ids that were added before are counted again,
+        so the filter grows a bit earlier than needed
+        Args:
+            values(list): ids, without missing values
+        """
+        for start in range(0, len(values), BATCH_SIZE):
+            positions = get_positions(hash_values(values[start:start + BATCH_SIZE]),
+                                      self.header['bits'], self.header['hashes']).ravel()
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                             np.left_shift(1, positions & np.uint64(7)).astype('uint8'))
+        self.write_header(count=self.read_header()['count'] + len(values))
+
+    def flush(self):
+        """Writes changed bits to the file, other processes see them
+        before that, as they map the same file"""
+        self.data.flush()
+
+def get_file_id(path:pathlib.Path) -> tuple:
+    """Returns id of the file, it changes when the file is replaced
+    Args:
+        path(pathlib.Path): path to the file
+    Returns:
+        (device, inode), None if the file doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+def get_filter(map_path:str) -> BloomFilter:
+    """Returns filter of the master file, the newest version
+    is opened if another process created it (eg when it grew)
+    Args:
+        map_path(str): path to the master file
+    Returns:
+        BloomFilter, None if it doesn't exist or the dataset has no filter
+    """
+    if get_rate(map_path) is None:
+        return None
+    key = pathlib.Path(map_path)
+    for _ in range(2):
+        versions = get_versions(map_path)
+        path = get_filter_path(map_path, versions[-1]) if versions else None
+        file_id = get_file_id(path) if path is not None else None
+        with filters_lock:
+            bloom = filters.get(key)
+            if bloom is not None and (bloom.path != path or bloom.file_id != file_id):
+                # the old file is closed when no thread uses it anymore
+                del filters[key]
+                bloom = None
+            if bloom is not None or file_id is None:
+                return bloom
+            try:
+                bloom = filters[key] = BloomFilter(path)
+                return bloom
+            except FileNotFoundError:
+                # deleted since it was listed, a newer version exists
+                continue
+    return None
+
+def create(map_path:str, batches, capacity:int, stamp:str) -> BloomFilter:
+    """Creates filter of the master file as its next version, processes
+    that still use the old one open the new one with their next lookup.
+    The master file has to be locked meanwhile, so versions aren't created twice
+    Args:
+        map_path(str): path to the master file
+        batches(generator): lists of ids
+        capacity(int): number of ids the filter is sized for
+        stamp(str): stamp of the master file the ids came from
+    Returns:
+        BloomFilter
+    """
+    rate = get_rate(map_path)
+    versions = get_versions(map_path)
+    path = get_filter_path(map_path, versions[-1] + 1 if versions else 1)
+    bits, hashes = get_size(capacity, rate)
+    header = {'capacity': capacity, 'false_positive_rate': rate, 'bits': bits,
+              'hashes': hashes, 'count': 0, 'stamp': None}
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode().ljust(HEADER_SIZE))
+        f.truncate(HEADER_SIZE + bits // 8)
+    bloom = BloomFilter(tmp_path)
+    for batch in batches:
+        bloom.add(batch)
+    bloom.write_header(stamp=stamp)
+    bloom.flush()
+    del bloom
+
+    # nothing maps the new file yet, so it can be renamed
+    os.replace(tmp_path, path)
+    with filters_lock:
+        bloom = filters[pathlib.Path(map_path)] = BloomFilter(path)
+    remove_old(map_path)
+    logging.info(f"Bloom filter {path} created for {capacity} ids.")
+    return bloom
@@ -0,0 +1,124 @@
+import pathlib
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # windows, only exclusive locks are available
+    fcntl = None
+    import msvcrt
+
+# reentrant locks of this process, one per lock file
+locks = {}
+locks_lock = threading.Lock()
+
+def get_lock_path(path:str) -> pathlib.Path:
+    """Returns path of the lock file kept next to a file or directory,
+    eg maps/customers_map -> maps/customers_map.lock
+    Args:
+        path(str): path to the locked file or directory
+    Returns:
+        path to the lock file
+    """
+    path = pathlib.Path(path)
+    return path.with_name(path.name + '.lock')
+
+class FileLock:
+    """Lock held on a lock file, works between threads and processes.
+    Shared locks can be held by many at the same time, exclusive by one only.
+    It's tied to the open file, not the thread, so it can be released
+    by other thread than the one that acquired it
+    """
+    def __init__(self, path:str, shared:bool=False):
+        """
+        Args:
+            path(str): path to the lock file
+            shared(bool): shared (True) or exclusive (False) lock
+        """
+        self.path = pathlib.Path(path)
+        self.shared = shared
+        self.file = None
+
+    def acquire(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+            else:
+                # first byte of the file is locked, msvcrt gives up after 10 seconds so it's retried
+                while True:
+                    try:
+                        self.file.seek(0)
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+        except BaseException:
+            self.file.close()
+            self.file = None
+            raise
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+class ReentrantFileLock:
+    """Exclusive lock between processes that the same thread can acquire
+    again while holding it, eg master file lock taken by append and by
+    functions it calls. The lock file is locked by the outermost acquire only
+    """
+    def __init__(self, path:str):
+        """
+        Args:
+            path(str): path to the lock file
+        """
+        self.thread_lock = threading.RLock()
+        self.file_lock = FileLock(path)
+        self.depth = 0
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.file_lock.acquire()
+            except BaseException:
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            self.file_lock.release()
+        self.thread_lock.release()
+        return False
+
+def get_lock(path:str) -> ReentrantFileLock:
+    """Returns reentrant lock of a file or directory, shared by all threads
+    of the process, creates it if needed
+    Args:
+        path(str): path to the locked file or directory
+    Returns:
+        lock held on the lock file next to it
+    """
+    lock_path = get_lock_path(path).resolve()
+    with locks_lock:
+        if str(lock_path) not in locks:
+            locks[str(lock_path)] = ReentrantFileLock(lock_path)
+        return locks[str(lock_path)]
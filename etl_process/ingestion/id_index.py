@@ -0,0 +1,306 @@
+import os
+import pathlib
+import sqlite3
+import contextlib
+import threading
+import time
+import config.config as cnf
+import ingestion.master_store as master_store
+import ingestion.bloom_filter as bloom_filter
+
+# number of ids sent to sqlite in one statement
+BATCH_SIZE = 10000
+
+def get_index_path(map_path:str) -> pathlib.Path:
+    """Returns path to the id index kept next to the master file,
+    eg maps/customers_map.json.gz -> maps/customers_map.idx.sqlite
+    Args:
+        map_path(str): path to the master file
+    Returns:
+        path to the index file
+    """
+    map_path = pathlib.Path(map_path)
+    return map_path.with_name(map_path.name.split('.')[0] + '.idx.sqlite')
+
+def batches(values:list, size:int=BATCH_SIZE):
+    """Splits list into smaller lists
+    Args:
+        values(list): values to split
+        size(int): max length of each list
+    Returns:
+        generator with lists
+    """
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+@contextlib.contextmanager
+def connect(map_path:str, col_name:str):
+    """Opens index of the master file, creates or rebuilds it
+    if it's missing or out of sync with the master file
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+    Returns:
+        sqlite connection
+    """
+    index_path = get_index_path(map_path)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(index_path, timeout=60)
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS ids (value PRIMARY KEY) WITHOUT ROWID')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS reserved (value PRIMARY KEY, owner TEXT, created REAL) WITHOUT ROWID')
+        # master file can't be appended while it's compared with the index
+        with master_store.get_lock(master_store.get_store_path(map_path)):
+            row = conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+            if row is None or row[0] != master_store.get_stamp(map_path):
+                rebuild(conn, map_path, col_name)
+            else:
+                sync_filter(conn, map_path)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def set_stamp(conn:sqlite3.Connection, map_path:str):
+    """Saves stamp of the master file in the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        map_path(str): path to the master file
+    """
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (master_store.get_stamp(map_path),))
+
+def get_stamp(conn:sqlite3.Connection) -> str:
+    """Returns stamp of the master file saved in the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+    Returns:
+        stamp, None if the index is new
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+    return row[0] if row else None
+
+def read_ids(conn:sqlite3.Connection):
+    """Reads all ids from the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+    Returns:
+        generator with lists of ids
+    """
+    cursor = conn.execute('SELECT value FROM ids')
+    for rows in iter(lambda: cursor.fetchmany(BATCH_SIZE), []):
+        yield [row[0] for row in rows]
+
+def create_filter(conn:sqlite3.Connection, map_path:str):
+    """Creates bloom filter of the master file from ids in the index,
+    sized for twice as many ids as there are now, so it can grow
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        map_path(str): path to the master file
+    """
+    if bloom_filter.get_rate(map_path) is None:
+        return
+    count = conn.execute('SELECT count(*) FROM ids').fetchone()[0]
+    bloom_filter.create(map_path, read_ids(conn), max(cnf.bloom_min_capacity, 2 * count), get_stamp(conn))
+
+def sync_filter(conn:sqlite3.Connection, map_path:str):
+    """Creates bloom filter again if it's missing, out of sync with the index
+    (eg the process was killed while saving ids) or false_positive_rate changed
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        map_path(str): path to the master file
+    """
+    rate = bloom_filter.get_rate(map_path)
+    if rate is None:
+        return
+    bloom = bloom_filter.get_filter(map_path)
+    if bloom is None or bloom.read_header()['stamp'] != get_stamp(conn) or bloom.rate != rate:
+        create_filter(conn, map_path)
+
+def update_filter(conn:sqlite3.Connection, map_path:str, ids:list):
+    """Adds ids saved in the master file to the bloom filter,
+    the filter is created twice as large when it's full
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        map_path(str): path to the master file
+        ids(list): ids added to the master file
+    """
+    bloom = bloom_filter.get_filter(map_path)
+    if bloom is None:
+        return
+    if ids:
+        bloom.add(ids)
+    if bloom.read_header()['count'] > bloom.capacity:
+        create_filter(conn, map_path)
+    else:
+        bloom.write_header(stamp=get_stamp(conn))
+        bloom.flush()
+
+def might_exist(map_path:str, ids:list) -> list:
+    """Checks ids against the bloom filter of the master file,
+    only ids that may exist have to be looked up in the index
+    Args:
+        map_path(str): path to the master file
+        ids(list): ids to check
+    Returns:
+        list of booleans, False for ids that don't exist for sure,
+        all True if the dataset has no filter
+    """
+    bloom = bloom_filter.get_filter(map_path)
+    if bloom is None:
+        return [True] * len(ids)
+    return bloom.might_contain(ids).tolist()
+
+def insert_ids(conn:sqlite3.Connection, ids:list):
+    """Inserts ids into the index, ids that already exist are skipped
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        ids(list): ids to insert
+    """
+    for batch in batches(ids):
+        conn.executemany('INSERT OR IGNORE INTO ids VALUES (?)', ((i,) for i in batch))
+
+def rebuild(conn:sqlite3.Connection, map_path:str, col_name:str):
+    """Loads all ids from the master file into the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+    """
+    conn.execute('DELETE FROM ids')
+    if master_store.exists(map_path):
+        map_df = master_store.read(map_path, columns=[col_name])
+        if col_name in map_df.columns:
+            insert_ids(conn, map_df[col_name].dropna().tolist())
+    set_stamp(conn, map_path)
+    conn.commit()
+    create_filter(conn, map_path)
+
+def build_index(map_path:str, col_name:str):
+    """Recreates the index from the master file
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+    """
+    with connect(map_path, col_name) as conn:
+        # compaction can't remove segments while they're read
+        with master_store.get_lock(master_store.get_store_path(map_path)):
+            rebuild(conn, map_path, col_name)
+
+def build_filter(map_path:str, col_name:str):
+    """Recreates the bloom filter from the index, eg after
+    bloom_min_capacity changed
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+    """
+    with connect(map_path, col_name) as conn:
+        with master_store.get_lock(master_store.get_store_path(map_path)):
+            create_filter(conn, map_path)
+
+@contextlib.contextmanager
+def keep_in_sync(map_path:str, col_name:str, ids:list=None, owner:str=None):
+    """Keeps the index in sync while the master file is being written,
+    the index is checked before the write and stamped after it,
+    so writing the master file doesn't trigger a rebuild.
+    The master file is locked meanwhile, also for other processes
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+        ids(list): ids that are being added to the master file
+        owner(str): reservations of this owner are removed, as the ids are saved
+    """
+    with master_store.get_lock(master_store.get_store_path(map_path)), connect(map_path, col_name) as conn:
+        yield
+        if ids:
+            insert_ids(conn, ids)
+        if owner is not None:
+            conn.execute('DELETE FROM reserved WHERE owner = ?', (owner,))
+        set_stamp(conn, map_path)
+        # bits are set before the ids are committed, so a worker that sees
+        # the ids unreserved sees them in the filter as well
+        update_filter(conn, map_path, ids)
+
+def get_owner(input_path:str) -> str:
+    """Returns owner of id reservations made while processing a file,
+    unique for the process and thread
+    Args:
+        input_path(str): path of the file that is processed
+    Returns:
+        owner name
+    """
+    return f'{os.getpid()}:{threading.get_ident()}:{input_path}'
+
+def reserve_ids(map_path:str, col_name:str, ids:list, owner:str) -> set:
+    """Reserves ids that don't exist in the master file and aren't
+    reserved by anyone else, so two workers can't both accept the same id.
+    Reservations are removed when the ids are saved in the master file
+    (keep_in_sync), released (release_ids), or after reservation_timeout
+    seconds, eg when the process was killed
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+        ids(list): ids to reserve, without duplicates
+        owner(str): who reserves the ids, from get_owner
+    Returns:
+        set of ids reserved by this call, ids the owner reserved before
+        (eg in an earlier chunk of the file) aren't included, they're duplicates
+    """
+    reserved = set()
+    if not ids:
+        return reserved
+    with connect(map_path, col_name) as conn:
+        # sqlite allows one writer at a time, the whole reservation is one transaction
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM reserved WHERE created < ?', (time.time() - cnf.reservation_timeout,))
+        # ids not in the filter are new, only the others are looked up
+        conn.execute('CREATE TEMP TABLE lookup (value, maybe)')
+        for batch in batches(list(zip(ids, might_exist(map_path, ids)))):
+            conn.executemany('INSERT INTO lookup VALUES (?, ?)', batch)
+        # reserved ids are taken, by another worker or by the owner, eg in an earlier chunk of the file
+        conn.execute('DELETE FROM lookup WHERE value IN (SELECT value FROM reserved)')
+        conn.execute('INSERT OR IGNORE INTO reserved SELECT value, ?, ? FROM lookup '
+                     'WHERE NOT maybe OR value NOT IN (SELECT value FROM ids)', (owner, time.time()))
+        rows = conn.execute('SELECT reserved.value FROM lookup JOIN reserved ON reserved.value = lookup.value '
+                            'WHERE reserved.owner = ?', (owner,))
+        reserved.update(row[0] for row in rows)
+    return reserved
+
+def release_ids(map_path:str, col_name:str, owner:str, ids:list=None):
+    """Removes reservations that weren't saved, eg rows removed
+    by later checks or a file that failed
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+        owner(str): who reserved the ids, from get_owner
+        ids(list): only these ids are released, all ids of the owner if None
+    """
+    with connect(map_path, col_name) as conn:
+        if ids is None:
+            conn.execute('DELETE FROM reserved WHERE owner = ?', (owner,))
+        else:
+            conn.executemany('DELETE FROM reserved WHERE owner = ? AND value = ?', [(owner, i) for i in ids])
+
+def existing_ids(map_path:str, col_name:str, ids:list) -> set:
+    """Returns ids that already exist in the master file
+    Args:
+        map_path(str): path to the master file
+        col_name(str): name of the column containing unique id
+        ids(list): ids to look up
+    Returns:
+        set of ids found in the master file
+    """
+    found = set()
+    if not ids:
+        return found
+    with connect(map_path, col_name) as conn:
+        # ids not in the filter don't exist
+        ids = [i for i, maybe in zip(ids, might_exist(map_path, ids)) if maybe]
+        if not ids:
+            return found
+        conn.execute('CREATE TEMP TABLE lookup (value)')
+        for batch in batches(ids):
+            conn.executemany('INSERT INTO lookup VALUES (?)', ((i,) for i in batch))
+        rows = conn.execute('SELECT ids.value FROM lookup JOIN ids ON ids.value = lookup.value')
+        found.update(row[0] for row in rows)
+    return found
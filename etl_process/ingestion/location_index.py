@@ -0,0 +1,168 @@
+import pathlib
+import sqlite3
+import contextlib
+import pandas as pd
+import config.config as cnf
+import ingestion.master_store as master_store
+import ingestion.quarantine_store as quarantine_store
+from ingestion.quarantine_store import hash_email
+from ingestion.id_index import batches
+
+# only customers are looked up by erasure requests
+DATASET = 'customers'
+
+def get_index_path() -> pathlib.Path:
+    """Returns path to the location index kept next to the customers master file,
+    eg maps/customers_map.json.gz -> maps/customers_map.loc.sqlite
+    Returns:
+        path to the index file
+    """
+    map_path = pathlib.Path(cnf.map_paths[DATASET])
+    return map_path.with_name(map_path.name.split('.')[0] + '.loc.sqlite')
+
+@contextlib.contextmanager
+def locked():
+    """Locks customers master and quarantine files, always in this order,
+    while they're changed together with the index
+    """
+    with master_store.get_lock(master_store.get_store_path(cnf.map_paths[DATASET])), quarantine_store.get_lock(DATASET):
+        yield
+
+@contextlib.contextmanager
+def connect():
+    """Opens the location index, creates or rebuilds it
+    if it's missing or out of sync with the master file
+    Returns:
+        sqlite connection
+    """
+    index_path = get_index_path()
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(index_path, timeout=60)
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS locations (customer_id, email_hash TEXT, '
+                     'source_location TEXT, quarantine INTEGER)')
+        conn.execute('CREATE INDEX IF NOT EXISTS locations_id ON locations (customer_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS locations_email ON locations (email_hash)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        with locked():
+            row = conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+            if row is None or row[0] != master_store.get_stamp(cnf.map_paths[DATASET]):
+                rebuild(conn)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def set_stamp(conn:sqlite3.Connection):
+    """Saves stamp of the master file in the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+    """
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (master_store.get_stamp(cnf.map_paths[DATASET]),))
+
+def insert_locations(conn:sqlite3.Connection, data:pd.DataFrame, quarantine:bool):
+    """Adds customers and files they're saved in to the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+        data(pd.DataFrame): rows with id, email and source_location
+        quarantine(bool): if rows are from the quarantine file
+    """
+    if data.empty or 'source_location' not in data.columns:
+        return
+    ids = data['id'].tolist() if 'id' in data.columns else [None] * len(data)
+    emails = data['email'].map(hash_email).tolist() if 'email' in data.columns else [None] * len(data)
+    rows = [(None if pd.isna(i) else i, email, location, int(quarantine))
+            for i, email, location in zip(ids, emails, data['source_location'].tolist())]
+    for batch in batches(rows):
+        conn.executemany('INSERT INTO locations VALUES (?, ?, ?, ?)', batch)
+
+def rebuild(conn:sqlite3.Connection):
+    """Loads customers from the master and quarantine files into the index
+    Args:
+        conn(sqlite3.Connection): connection to the index
+    """
+    conn.execute('DELETE FROM locations')
+    map_path = cnf.map_paths[DATASET]
+    if master_store.exists(map_path):
+        insert_locations(conn, master_store.read(map_path), quarantine=False)
+    insert_locations(conn, quarantine_store.read(DATASET, columns=['id', 'email', 'source_location']), quarantine=True)
+    set_stamp(conn)
+    conn.commit()
+
+def build_index():
+    """Recreates the index from the master and quarantine files"""
+    with locked(), connect() as conn:
+        rebuild(conn)
+
+@contextlib.contextmanager
+def keep_in_sync(file_name:str, data:pd.DataFrame, quarantine:bool=False):
+    """Adds customers to the index while they're appended
+    to the master or quarantine file, does nothing for other datasets.
+    Both files are locked meanwhile
+    Args:
+        file_name(str): file name that arrived, eg customers
+        data(pd.DataFrame): rows with id, email and source_location that are appended
+        quarantine(bool): if appending quarantine file (True) or master file (False)
+    """
+    if file_name != DATASET:
+        yield
+        return
+    with locked(), connect() as conn:
+        yield
+        insert_locations(conn, data, quarantine)
+        set_stamp(conn)
+
+def find(ids:list, emails:list, pairs:list) -> dict:
+    """Looks up files with rows of the given customers
+    Args:
+        ids(list): customer ids
+        emails(list): emails
+        pairs(list): (customer id, email), both have to match the same row
+    Returns:
+        dict with (value, source_location, quarantine) for each matching row,
+        {'id': [(cust_id1, location1, False), ...], 'email': [(email1, location1, True), ...]}
+        where rows matched by pairs are under 'id'
+    """
+    found = {'id': [], 'email': []}
+    with connect() as conn:
+        ids = [i for i in ids if pd.notna(i)]
+        for batch in batches(ids, 500):
+            found['id'].extend(conn.execute(
+                f"SELECT customer_id, source_location, quarantine FROM locations "
+                f"WHERE customer_id IN ({','.join('?' * len(batch))})", batch).fetchall())
+
+        for customer_id, email in pairs:
+            found['id'].extend(conn.execute(
+                'SELECT customer_id, source_location, quarantine FROM locations '
+                'WHERE customer_id = ? AND email_hash = ?', (customer_id, hash_email(email))).fetchall())
+
+        # emails are looked up by their hash, results keep the email from the request
+        hashes = {hash_email(email): email for email in emails if hash_email(email) is not None}
+        for batch in batches(list(hashes), 500):
+            rows = conn.execute(
+                f"SELECT email_hash, source_location, quarantine FROM locations "
+                f"WHERE email_hash IN ({','.join('?' * len(batch))})", batch).fetchall()
+            found['email'].extend((hashes[email_hash], location, bool(q)) for email_hash, location, q in rows)
+    found['id'] = [(customer_id, location, bool(q)) for customer_id, location, q in found['id']]
+    return found
+
+@contextlib.contextmanager
+def hashing(ids:list, emails:list):
+    """Keeps the index in sync while erasure hashes emails of the given
+    customers in the master and quarantine files, both files are locked meanwhile
+    Args:
+        ids(list): customer ids that are hashed
+        emails(list): emails that are hashed
+    """
+    with locked(), connect() as conn:
+        yield
+        conn.create_function('hash_email', 1, hash_email)
+        conn.execute('CREATE TEMP TABLE hashed_ids (value)')
+        conn.execute('CREATE TEMP TABLE hashed_emails (value)')
+        conn.executemany('INSERT INTO hashed_ids VALUES (?)', ((i,) for i in ids if pd.notna(i)))
+        conn.executemany('INSERT INTO hashed_emails VALUES (?)', ((hash_email(e),) for e in emails))
+        # email column now contains hash of the email, so its key is hash of that
+        conn.execute('UPDATE locations SET email_hash = hash_email(email_hash) '
+                     'WHERE email_hash IS NOT NULL AND (customer_id IN (SELECT value FROM hashed_ids) '
+                     'OR email_hash IN (SELECT value FROM hashed_emails))')
+        set_stamp(conn)
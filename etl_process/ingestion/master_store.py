@@ -0,0 +1,378 @@
+import pathlib
+import json
+import os
+import threading
+import time
+import logging
+import pandas as pd
+import config.config as cnf
+from ingestion.read_write import read_file, read_files, write_file, get_storage_path, get_parts
+import ingestion.file_lock as file_lock
+from ingestion.file_lock import ReentrantFileLock
+
+# running background compactions, one per master file
+compactions = {}
+compactions_lock = threading.Lock()
+
+# column of master rows with the transformed file they came from
+SOURCE_COLUMN = 'source_location'
+
+def get_store_path(map_path:str) -> pathlib.Path:
+    """Returns directory with segments of the master file,
+    eg maps/customers_map.json.gz -> maps/customers_map
+    Args:
+        map_path(str): path to the master file from config
+    Returns:
+        path to the directory
+    """
+    map_path = pathlib.Path(map_path)
+    return map_path.with_name(map_path.name.split('.')[0])
+
+def get_lock(store_path:pathlib.Path) -> ReentrantFileLock:
+    """Returns lock for the master file, it works between threads and processes
+    Args:
+        store_path(pathlib.Path): directory with segments
+    Returns:
+        lock
+    """
+    return file_lock.get_lock(store_path)
+
+def read_manifest(store_path:pathlib.Path) -> dict:
+    """Reads list of segments of the master file
+    Args:
+        store_path(pathlib.Path): directory with segments
+    Returns:
+        manifest, {'appends': 3, 'next': 4, 'segments': [{'name': ..., 'rows': ...}, ...],
+        'removed': [{'name': ..., 'time': ...}, ...]}
+    """
+    manifest_path = store_path / 'manifest.json'
+    if not manifest_path.is_file():
+        return {'appends': 0, 'next': 0, 'segments': [], 'removed': []}
+    with open(manifest_path, 'rt') as f:
+        manifest = json.load(f)
+    manifest.setdefault('removed', [])
+    return manifest
+
+def write_manifest(store_path:pathlib.Path, manifest:dict):
+    """Saves list of segments, the old manifest is replaced in one step
+    so readers see either the old or the new list of segments
+    Args:
+        store_path(pathlib.Path): directory with segments
+        manifest(dict): manifest to save
+    """
+    manifest_path = store_path / 'manifest.json'
+    tmp_path = store_path / 'manifest.json.tmp'
+    with open(tmp_path, 'wt') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def new_segment_path(store_path:pathlib.Path, manifest:dict) -> pathlib.Path:
+    """Returns path for a new segment, in the storage format set in config
+    Args:
+        store_path(pathlib.Path): directory with segments
+        manifest(dict): manifest, its counter is increased
+    Returns:
+        path to the new segment
+    """
+    extension = '.parquet' if cnf.storage_format == 'parquet' else '.json.gz'
+    manifest['next'] += 1
+    return store_path / f"seg-{manifest['next']:08d}{extension}"
+
+def remove_segments(manifest:dict, names:list):
+    """Takes segments replaced by compaction or erasure out of the list of segments.
+    Their files are deleted by delete_removed after segment_retention_seconds,
+    so readers that got the list of segments before can still read them
+    Args:
+        manifest(dict): manifest of the master file
+        names(list): names of the replaced segments
+    """
+    manifest['segments'] = [segment for segment in manifest['segments'] if segment['name'] not in names]
+    manifest['removed'].extend({'name': name, 'time': time.time()} for name in names)
+
+def get_sources(data:pd.DataFrame) -> list:
+    """Returns transformed files the rows came from, they're saved with
+    the segment in the manifest, so erasure only reads segments with
+    rows from the files the requested customers were found in
+    Args:
+        data(pd.DataFrame): rows of a segment
+    Returns:
+        sorted list of locations, None if the rows don't have them
+    """
+    if SOURCE_COLUMN not in data.columns:
+        return None
+    return sorted(str(source) for source in data[SOURCE_COLUMN].dropna().unique())
+
+def merge_sources(segments:list) -> list:
+    """Returns transformed files of segments merged into one
+    Args:
+        segments(list): segments from the manifest
+    Returns:
+        sorted list of locations, None if any segment doesn't have them
+    """
+    if any(segment.get('sources') is None for segment in segments):
+        return None
+    return sorted(set().union(*(segment['sources'] for segment in segments)))
+
+def delete_removed(store_path:pathlib.Path, manifest:dict) -> bool:
+    """Deletes files of segments removed more than segment_retention_seconds ago,
+    the store has to be locked
+    Args:
+        store_path(pathlib.Path): directory with segments
+        manifest(dict): manifest of the master file, deleted segments are taken out of it
+    Returns:
+        True if the manifest changed and has to be saved
+    """
+    expired = [segment for segment in manifest['removed'] if time.time() - segment['time'] >= cnf.segment_retention_seconds]
+    for segment in expired:
+        segment_path = store_path / segment['name']
+        if segment_path.exists():
+            segment_path.unlink()
+    manifest['removed'] = [segment for segment in manifest['removed'] if segment not in expired]
+    return bool(expired)
+
+def migrate(map_path:str, store_path:pathlib.Path):
+    """Moves master file saved as a single file (or parquet dataset)
+    into the segment directory
+    Args:
+        map_path(str): path to the master file from config
+        store_path(pathlib.Path): directory with segments
+    """
+    legacy_path = get_storage_path(map_path)
+    if legacy_path.is_file():
+        legacy_files = [legacy_path]
+    else:
+        legacy_files = get_parts(legacy_path)
+    if not legacy_files or (store_path / 'manifest.json').is_file():
+        return
+
+    store_path.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(store_path)
+    for legacy_file in legacy_files:
+        rows = len(read_file(legacy_file))
+        segment_path = new_segment_path(store_path, manifest)
+        os.replace(legacy_file, segment_path)
+        manifest['segments'].append({'name': segment_path.name, 'rows': rows})
+        manifest['appends'] += 1
+    write_manifest(store_path, manifest)
+    logging.info(f"{legacy_path} moved to segments in {store_path}.")
+
+def get_segments(map_path:str) -> list:
+    """Returns paths of all segments of the master file, oldest first
+    Args:
+        map_path(str): path to the master file from config
+    Returns:
+        list of paths
+    """
+    store_path = get_store_path(map_path)
+    with get_lock(store_path):
+        migrate(map_path, store_path)
+        manifest = read_manifest(store_path)
+    return [store_path / segment['name'] for segment in manifest['segments']]
+
+def exists(map_path:str) -> bool:
+    """Checks if the master file has any data
+    Args:
+        map_path(str): path to the master file from config
+    Returns:
+        True if there is at least one segment
+    """
+    return bool(get_segments(map_path))
+
+def get_stamp(map_path:str) -> str:
+    """Returns number of appends and rows of the master file.
+    It changes when rows are appended, but not when segments
+    are compacted or rewritten by erasure
+    Args:
+        map_path(str): path to the master file from config
+    Returns:
+        stamp of the master file, empty string if it doesn't exist
+    """
+    store_path = get_store_path(map_path)
+    with get_lock(store_path):
+        migrate(map_path, store_path)
+        manifest = read_manifest(store_path)
+    if not manifest['segments']:
+        return ''
+    return f"{manifest['appends']}:{sum(segment['rows'] for segment in manifest['segments'])}"
+
+def read(map_path:str, columns:list=None, filters:list=None) -> pd.DataFrame:
+    """Loads all segments of the master file. Segments are read without the lock,
+    replaced segments are kept for segment_retention_seconds, if reading
+    took longer, the new list of segments is read again
+    Args:
+        map_path(str): path to the master file from config
+        columns(list): columns to read, all if None
+        filters(list): list of (column, operator, value), eg [('id', 'in', ids)]
+    Returns:
+        Pandas dataframe with data from all segments
+    """
+    try:
+        return read_files(get_segments(map_path), columns, filters)
+    except FileNotFoundError:
+        return read_files(get_segments(map_path), columns, filters)
+
+def append(map_path:str, data:pd.DataFrame):
+    """Appends the master file by saving data as a new segment,
+    starts compaction if there are too many small segments
+    Args:
+        map_path(str): path to the master file from config
+        data(pd.DataFrame): data to append
+    """
+    store_path = get_store_path(map_path)
+    with get_lock(store_path):
+        migrate(map_path, store_path)
+        store_path.mkdir(parents=True, exist_ok=True)
+        manifest = read_manifest(store_path)
+        segment_path = new_segment_path(store_path, manifest)
+        write_file(segment_path, data)
+        manifest['segments'].append({'name': segment_path.name, 'rows': len(data), 'sources': get_sources(data)})
+        manifest['appends'] += 1
+        delete_removed(store_path, manifest)
+        write_manifest(store_path, manifest)
+
+    if len(get_small_segments(manifest)) >= cnf.compaction_min_segments:
+        compact_in_background(map_path)
+
+def rewrite(map_path:str, func, sources:list=None) -> int:
+    """Rewrites only segments changed by the function, eg by erasure.
+    Each changed segment is saved as a new file and swapped in the manifest,
+    the old file is deleted after segment_retention_seconds
+    Args:
+        map_path(str): path to the master file from config
+        func(function): takes dataframe with a segment, returns
+            the updated dataframe and True if anything changed
+        sources(list): transformed files the changed rows came from (eg found
+            in the location index), only segments with rows from them are read,
+            all segments if None
+    Returns:
+        number of rewritten segments
+    """
+    store_path = get_store_path(map_path)
+    sources = None if sources is None else {str(source) for source in sources}
+    rewritten = 0
+    with get_lock(store_path):
+        migrate(map_path, store_path)
+        manifest = read_manifest(store_path)
+        old_names = []
+        for segment in manifest['segments']:
+            # segments saved before their sources were kept are always read
+            segment_sources = segment.get('sources')
+            if sources is not None and segment_sources is not None and sources.isdisjoint(segment_sources):
+                continue
+            df, changed = func(read_file(store_path / segment['name']))
+            if not changed:
+                continue
+            new_path = new_segment_path(store_path, manifest)
+            write_file(new_path, df)
+            old_names.append(segment['name'])
+            segment['name'] = new_path.name
+            rewritten += 1
+        manifest['removed'].extend({'name': name, 'time': time.time()} for name in old_names)
+        if delete_removed(store_path, manifest) or rewritten:
+            write_manifest(store_path, manifest)
+    return rewritten
+
+def get_small_segments(manifest:dict) -> list:
+    """Returns segments smaller than half of max segment size
+    Args:
+        manifest(dict): manifest of the master file
+    Returns:
+        list of segments from the manifest
+    """
+    return [segment for segment in manifest['segments'] if segment['rows'] < cnf.master_segment_rows // 2]
+
+def compact(map_path:str) -> int:
+    """Merges small segments into segments of up to master_segment_rows rows.
+    Merged segments are read and written without holding the lock,
+    the manifest is only updated if the merged segments weren't changed
+    in the meantime (eg by erasure). Replaced segments aren't deleted right away,
+    readers and compaction may still read them, see remove_segments
+    Args:
+        map_path(str): path to the master file from config
+    Returns:
+        number of segments that were merged
+    """
+    store_path = get_store_path(map_path)
+    with get_lock(store_path):
+        manifest = read_manifest(store_path)
+        if delete_removed(store_path, manifest):
+            write_manifest(store_path, manifest)
+    small = get_small_segments(manifest)
+    if len(small) < 2:
+        return 0
+
+    # group small segments so each group fits in one segment
+    groups = [[]]
+    rows = 0
+    for segment in small:
+        if groups[-1] and rows + segment['rows'] > cnf.master_segment_rows:
+            groups.append([])
+            rows = 0
+        groups[-1].append(segment)
+        rows += segment['rows']
+    groups = [group for group in groups if len(group) > 1]
+
+    merged = []
+    for group in groups:
+        df = read_files([store_path / segment['name'] for segment in group])
+        # reserve name of the new segment, so appends don't use it
+        with get_lock(store_path):
+            manifest = read_manifest(store_path)
+            new_path = new_segment_path(store_path, manifest)
+            write_manifest(store_path, manifest)
+        write_file(new_path, df)
+        merged.append((group, new_path, len(df)))
+
+    compacted = 0
+    with get_lock(store_path):
+        manifest = read_manifest(store_path)
+        for group, new_path, rows in merged:
+            group_names = [segment['name'] for segment in group]
+            names = [segment['name'] for segment in manifest['segments']]
+            if not all(name in names for name in group_names):
+                # segments were rewritten while merging, eg by erasure
+                new_path.unlink()
+                continue
+            # merged segment takes place of the first segment of the group
+            position = names.index(group_names[0])
+            remove_segments(manifest, group_names)
+            manifest['segments'].insert(position, {'name': new_path.name, 'rows': rows,
+                                                   'sources': merge_sources(group)})
+            compacted += len(group_names)
+        if compacted:
+            write_manifest(store_path, manifest)
+
+    if compacted:
+        logging.info(f"{compacted} segments compacted in {store_path}.")
+    return compacted
+
+def compact_in_background(map_path:str):
+    """Starts compaction in a separate thread, unless one is already running
+    Args:
+        map_path(str): path to the master file from config
+    """
+    store_path = str(get_store_path(map_path).resolve())
+    with compactions_lock:
+        thread = compactions.get(store_path)
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=compact_safely, args=(map_path,), name=f'compaction-{store_path}')
+        compactions[store_path] = thread
+        thread.start()
+
+def wait_for_compactions():
+    """Waits until background compactions finish, eg before the process ends"""
+    with compactions_lock:
+        threads = list(compactions.values())
+    for thread in threads:
+        thread.join()
+
+def compact_safely(map_path:str):
+    """Runs compaction and logs errors, used in background thread
+    Args:
+        map_path(str): path to the master file from config
+    """
+    try:
+        compact(map_path)
+    except Exception as e:
+        logging.error(f"Error while compacting {map_path}: {e}")
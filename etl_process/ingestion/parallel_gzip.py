@@ -0,0 +1,137 @@
+import gzip
+import struct
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config.config as cnf
+
+# gzip extra field with compressed size of the member, 'E' 'L' + 4 bytes,
+# lets the reader find members without decompressing them (same idea as BGZF)
+EXTRA_ID = b'EL'
+HEADER = struct.Struct('<BBBBIBBHBBHI')
+TRAILER = struct.Struct('<II')
+
+# thread pool shared by all reads and writes, zlib releases the GIL
+executor = None
+executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns thread pool used for compression, creates it on first use
+    Returns:
+        thread pool
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=cnf.compression_threads, thread_name_prefix='gzip')
+        return executor
+
+def split_blocks(data:bytes, block_size:int) -> list:
+    """Splits data into blocks of about block_size bytes,
+    blocks end at the end of a line
+    Args:
+        data(bytes): json lines
+        block_size(int): min size of a block
+    Returns:
+        list of blocks
+    """
+    blocks = []
+    start = 0
+    while start < len(data):
+        end = data.find(b'\n', start + block_size)
+        end = len(data) if end == -1 else end + 1
+        blocks.append(data[start:end])
+        start = end
+    return blocks
+
+def compress_block(block:bytes, level:int) -> bytes:
+    """Compresses a block into a complete gzip member,
+    with its compressed size saved in the extra field
+    Args:
+        block(bytes): data to compress
+        level(int): compression level 1-9
+    Returns:
+        gzip member
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(block) + compressor.flush()
+    member_size = HEADER.size + len(deflated) + TRAILER.size
+    # id1, id2, deflate, FEXTRA flag, mtime, xfl, os unknown, xlen, subfield id, subfield length, member size
+    header = HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 255, 8, EXTRA_ID[0], EXTRA_ID[1], 4, member_size)
+    trailer = TRAILER.pack(zlib.crc32(block), len(block) & 0xffffffff)
+    return header + deflated + trailer
+
+def compress(data:bytes, level:int) -> bytes:
+    """Compresses data into gzip format, blocks are compressed
+    in parallel and saved as separate gzip members,
+    readable by any gzip reader
+    Args:
+        data(bytes): json lines
+        level(int): compression level 1-9
+    Returns:
+        gzip data
+    """
+    blocks = split_blocks(data, cnf.compression_block_size)
+    if len(blocks) <= 1:
+        return compress_block(data, level)
+    members = get_executor().map(compress_block, blocks, [level] * len(blocks))
+    return b''.join(members)
+
+def get_members(raw:bytes) -> list:
+    """Finds gzip members written by compress_block
+    Args:
+        raw(bytes): gzip data
+    Returns:
+        list of (start, end) of each member, None if any member
+        wasn't written by compress_block
+    """
+    members = []
+    start = 0
+    while start < len(raw):
+        if len(raw) - start < HEADER.size:
+            return None
+        fields = HEADER.unpack_from(raw, start)
+        if fields[:4] != (0x1f, 0x8b, 8, 4) or fields[7] != 8 or bytes(fields[8:10]) != EXTRA_ID:
+            return None
+        end = start + fields[11]
+        members.append((start, end))
+        start = end
+    return members
+
+def decompress_member(member:bytes) -> bytes:
+    """Decompresses one gzip member
+    Args:
+        member(bytes): gzip member
+    Returns:
+        decompressed data
+    """
+    return zlib.decompress(member, wbits=16 + zlib.MAX_WBITS)
+
+def decompress(raw:bytes) -> bytes:
+    """Decompresses gzip data, members written by compress
+    are decompressed in parallel, other files in one thread
+    Args:
+        raw(bytes): gzip data
+    Returns:
+        decompressed data
+    """
+    members = get_members(raw)
+    if members is None or len(members) <= 1:
+        return gzip.decompress(raw)
+    view = memoryview(raw)
+    blocks = get_executor().map(decompress_member, [view[start:end] for start, end in members])
+    return b''.join(blocks)
+
+def get_compression_level(path) -> int:
+    """Returns compression level for a file, based on the dataset name
+    in the file or directory name (eg customers.json.gz, customers_map/seg-00000001.json.gz)
+    Args:
+        path(pathlib.Path): path to the file
+    Returns:
+        compression level 1-9
+    """
+    for name in [path.name, path.parent.name]:
+        dataset = name.split('.')[0].split('_')[0]
+        if dataset in cnf.compression_level:
+            return cnf.compression_level[dataset]
+    return cnf.compression_level['default']
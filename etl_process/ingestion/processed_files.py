@@ -0,0 +1,120 @@
+import contextlib
+import hashlib
+import json
+import logging
+import pathlib
+import sqlite3
+import time
+import config.config as cnf
+
+# number of bytes read at a time while the file is hashed
+HASH_BLOCK_SIZE = 1024 * 1024
+
+@contextlib.contextmanager
+def connect():
+    """Opens manifest of processed files, creates it if it's missing
+    Returns:
+        sqlite connection
+    """
+    manifest_path = pathlib.Path(cnf.processed_manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(manifest_path, timeout=60)
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS processed (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                     'hash TEXT, outputs TEXT, processed REAL)')
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_key(input_path:str) -> str:
+    """Returns key of the file in the manifest
+    Args:
+        input_path(str): path of the file
+    Returns:
+        absolute path
+    """
+    return str(pathlib.Path(input_path).resolve())
+
+def hash_file(input_path:str) -> str:
+    """Returns hash of the file content, blake2b is faster than sha256
+    Args:
+        input_path(str): path of the file
+    Returns:
+        hex representation of the hash
+    """
+    hash_object = hashlib.blake2b(digest_size=16)
+    with open(input_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            hash_object.update(block)
+    return hash_object.hexdigest()
+
+def get_status(input_path:str) -> str:
+    """Checks if the file was already processed. Size and modification time
+    are compared first, the file is hashed only if they changed,
+    eg to tell a touched file from a changed one
+    Args:
+        input_path(str): path of the file
+    Returns:
+        'new' - not processed yet (or manifest isn't used),
+        'processed' - processed with the same content,
+        'changed' - processed, but the content changed since
+    """
+    if cnf.processed_manifest_path is None:
+        return 'new'
+    stat = pathlib.Path(input_path).stat()
+    with connect() as conn:
+        row = conn.execute('SELECT size, mtime, hash FROM processed WHERE path = ?', (get_key(input_path),)).fetchone()
+        if row is None:
+            return 'new'
+        size, mtime, file_hash = row
+        if stat.st_size == size and stat.st_mtime_ns == mtime:
+            return 'processed'
+        if stat.st_size == size and hash_file(input_path) == file_hash:
+            # only touched, next time it's skipped without hashing
+            conn.execute('UPDATE processed SET mtime = ? WHERE path = ?', (stat.st_mtime_ns, get_key(input_path)))
+            return 'processed'
+    return 'changed'
+
+def should_skip(status:str) -> bool:
+    """Decides if a file isn't processed, based on its status. Files processed
+    before are skipped, changed files only if reprocess_changed_files isn't set
+    Args:
+        status(str): status of the file, from get_status
+    Returns:
+        True if the file shouldn't be processed
+    """
+    return status == 'processed' or (status == 'changed' and not cnf.reprocess_changed_files)
+
+def record(input_path:str, outputs:list):
+    """Saves processed file in the manifest
+    Args:
+        input_path(str): path of the file
+        outputs(list): paths of the files written while processing it
+    """
+    if cnf.processed_manifest_path is None:
+        return
+    # eg writing the transformed file failed, so it's processed again next time
+    missing = [str(output) for output in outputs if not pathlib.Path(output).exists()]
+    if missing:
+        logging.warning(f"{input_path} isn't recorded as processed, {missing} weren't written.")
+        return
+    stat = pathlib.Path(input_path).stat()
+    file_hash = hash_file(input_path)
+    with connect() as conn:
+        conn.execute('INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)',
+                     (get_key(input_path), stat.st_size, stat.st_mtime_ns, file_hash,
+                      json.dumps([str(output) for output in outputs]), time.time()))
+
+def get_outputs(input_path:str) -> list:
+    """Returns files written while processing the file
+    Args:
+        input_path(str): path of the file
+    Returns:
+        list of paths, None if the file wasn't processed
+    """
+    if cnf.processed_manifest_path is None:
+        return None
+    with connect() as conn:
+        row = conn.execute('SELECT outputs FROM processed WHERE path = ?', (get_key(input_path),)).fetchone()
+    return None if row is None else json.loads(row[0])
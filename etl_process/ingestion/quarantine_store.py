@@ -0,0 +1,282 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import pandas as pd
+import config.config as cnf
+import ingestion.file_lock as file_lock
+from ingestion.file_lock import ReentrantFileLock
+from ingestion.read_write import read_data, read_files, append_data, data_exists, get_storage_path, get_parts
+
+# column with the reason why the row was quarantined
+REASON_COLUMN = 'quarantine_reason'
+
+# reasons why rows are quarantined
+MISSING_FIELDS = 'missing_fields'
+DUPLICATE_ID = 'duplicate_id'
+NON_POSITIVE_VALUE = 'non_positive_value'
+COST_MISMATCH = 'cost_mismatch'
+UNKNOWN_REFERENCE = 'unknown_reference'
+REASONS = [MISSING_FIELDS, DUPLICATE_ID, NON_POSITIVE_VALUE, COST_MISMATCH, UNKNOWN_REFERENCE]
+
+# columns with customer ids saved in the partition index, per dataset
+CUSTOMER_ID_COLUMNS = {'customers': 'id', 'transactions': 'customer_id'}
+
+INDEX_NAME = 'index.json'
+
+def hash_email(email) -> str:
+    """Returns key of an email in the indexes, emails aren't saved in plain text
+    Args:
+        email(str): email address
+    Returns:
+        hex representation of the hash, None if email is empty
+    """
+    if not isinstance(email, str) or email == '':
+        return None
+    return hashlib.sha256(email.encode()).hexdigest()
+
+def get_store_path(file_name:str) -> pathlib.Path:
+    """Returns directory with partitions of the quarantine file,
+    eg quarantine/customers.json.gz -> quarantine/customers
+    Args:
+        file_name(str): dataset, eg customers
+    Returns:
+        path to the directory
+    """
+    quarantine_path = pathlib.Path(cnf.quarantine_paths[file_name])
+    return quarantine_path.with_name(quarantine_path.name.split('.')[0])
+
+def get_lock(file_name:str) -> ReentrantFileLock:
+    """Returns lock for all partitions of the quarantine file,
+    it works between threads and processes
+    Args:
+        file_name(str): dataset, eg customers
+    Returns:
+        lock
+    """
+    return file_lock.get_lock(get_store_path(file_name))
+
+def get_partition(path:str, root:str=None) -> str:
+    """Returns partition of a file, its date directory, eg 2020/01/02.
+    Files outside of the root directory belong to the partition of today
+    Args:
+        path(str): path of the file, eg input/2020/01/02/customers.json.gz
+        root(str): directory with date directories, input_root if None
+    Returns:
+        partition
+    """
+    try:
+        partition = pathlib.Path(path).resolve().parent.relative_to(pathlib.Path(root or cnf.input_root).resolve())
+    except ValueError:
+        partition = pathlib.Path('.')
+    if partition == pathlib.Path('.'):
+        return f'{datetime.date.today():%Y/%m/%d}'
+    return partition.as_posix()
+
+def get_partition_path(file_name:str, partition:str) -> pathlib.Path:
+    """Returns path with quarantined rows of one partition,
+    eg quarantine/customers/2020/01/02/customers.json.gz
+    Args:
+        file_name(str): dataset, eg customers
+        partition(str): date directory, eg 2020/01/02
+    Returns:
+        path in the storage format set in config
+    """
+    return get_storage_path(get_store_path(file_name) / partition / pathlib.Path(cnf.quarantine_paths[file_name]).name)
+
+def read_index(file_name:str, partition:str) -> dict:
+    """Reads index of a partition
+    Args:
+        file_name(str): dataset, eg customers
+        partition(str): date directory, eg 2020/01/02
+    Returns:
+        index, {'rows': 3, 'reasons': {'missing_fields': 3}, 'ids': [1, 2], 'emails': [hash1, ...]}
+    """
+    index_path = get_store_path(file_name) / partition / INDEX_NAME
+    if not index_path.is_file():
+        return {'rows': 0, 'reasons': {}, 'ids': [], 'emails': []}
+    with open(index_path, 'rt') as f:
+        return json.load(f)
+
+def write_index(file_name:str, partition:str, index:dict):
+    """Saves index of a partition, the old index is replaced in one step
+    Args:
+        file_name(str): dataset, eg customers
+        partition(str): date directory, eg 2020/01/02
+        index(dict): index to save
+    """
+    index_path = get_store_path(file_name) / partition / INDEX_NAME
+    tmp_path = index_path.with_name(INDEX_NAME + '.tmp')
+    with open(tmp_path, 'wt') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+def update_index(file_name:str, index:dict, data:pd.DataFrame) -> dict:
+    """Adds rows to the index of a partition, counts rows of each reason
+    and keeps customer ids and hashed emails
+    Args:
+        file_name(str): dataset, eg customers
+        index(dict): index of the partition
+        data(pd.DataFrame): quarantined rows
+    Returns:
+        updated index
+    """
+    index['rows'] += len(data)
+    if REASON_COLUMN in data.columns:
+        reasons = data[REASON_COLUMN].fillna('unknown').value_counts()
+        for reason, count in reasons.items():
+            index['reasons'][reason] = index['reasons'].get(reason, 0) + int(count)
+    elif len(data):
+        index['reasons']['unknown'] = index['reasons'].get('unknown', 0) + len(data)
+
+    col_name = CUSTOMER_ID_COLUMNS.get(file_name)
+    if col_name in data.columns:
+        ids = set(index['ids']) | {int(i) if isinstance(i, float) else i for i in data[col_name].dropna().tolist()}
+        index['ids'] = sorted(ids, key=str)
+    if 'email' in data.columns:
+        emails = set(index['emails']) | {hash_email(email) for email in data['email'].tolist()}
+        index['emails'] = sorted(email for email in emails if email is not None)
+    return index
+
+def migrate(file_name:str):
+    """Moves quarantine file saved as a single file (or parquet dataset)
+    into partitions, by the date directory of the output file of each row
+    Args:
+        file_name(str): dataset, eg customers
+    """
+    legacy_path = get_storage_path(cnf.quarantine_paths[file_name])
+    if not data_exists(legacy_path):
+        return
+
+    df = read_data(legacy_path)
+    if 'source_location' in df.columns:
+        locations = df['source_location'].fillna('').astype(str)
+    else:
+        locations = pd.Series('', index=df.index)
+    partitions = locations.map(lambda location: get_partition(location, cnf.output_root))
+    for partition, rows in df.groupby(partitions, sort=True):
+        write_rows(file_name, partition, rows)
+
+    if legacy_path.is_file():
+        legacy_path.unlink()
+    for part in get_parts(legacy_path):
+        part.unlink()
+    logging.info(f"{legacy_path} moved to partitions in {get_store_path(file_name)}.")
+
+def write_rows(file_name:str, partition:str, data:pd.DataFrame):
+    """Appends rows to a partition and its index, the lock has to be held.
+    Index is saved first, so it never misses customers of saved rows
+    Args:
+        file_name(str): dataset, eg customers
+        partition(str): date directory, eg 2020/01/02
+        data(pd.DataFrame): quarantined rows
+    """
+    (get_store_path(file_name) / partition).mkdir(parents=True, exist_ok=True)
+    write_index(file_name, partition, update_index(file_name, read_index(file_name, partition), data))
+    append_data(get_partition_path(file_name, partition), data)
+
+def append(file_name:str, partition:str, data:pd.DataFrame):
+    """Appends quarantined rows to the partition of their arrival date
+    Args:
+        file_name(str): dataset, eg customers
+        partition(str): date directory, eg 2020/01/02
+        data(pd.DataFrame): quarantined rows with reason column
+    """
+    with get_lock(file_name):
+        migrate(file_name)
+        write_rows(file_name, partition, data)
+
+def get_partitions(file_name:str, start:str=None, end:str=None) -> list:
+    """Returns partitions of the quarantine file, oldest first
+    Args:
+        file_name(str): dataset, eg customers
+        start(str): first partition, eg 2020/01/01, all if None
+        end(str): last partition, eg 2020/12/31, all if None
+    Returns:
+        list of date directories, eg ['2020/01/01', '2020/01/02']
+    """
+    store_path = get_store_path(file_name)
+    with get_lock(file_name):
+        migrate(file_name)
+        partitions = sorted(path.parent.relative_to(store_path).as_posix() for path in store_path.rglob(INDEX_NAME))
+    return [partition for partition in partitions
+            if (start is None or partition >= start) and (end is None or partition <= end)]
+
+def read(file_name:str, partitions:list=None, reasons:list=None, columns:list=None) -> pd.DataFrame:
+    """Loads quarantined rows of the given partitions
+    Args:
+        file_name(str): dataset, eg customers
+        partitions(list): date directories, all if None
+        reasons(list): reason codes of rows to keep, all if None
+        columns(list): columns to read, all if None
+    Returns:
+        Pandas dataframe with quarantined rows
+    """
+    if partitions is None:
+        partitions = get_partitions(file_name)
+    paths = []
+    for partition in partitions:
+        path = get_partition_path(file_name, partition)
+        paths.extend(get_parts(path) if cnf.storage_format == 'parquet' else [path] if path.is_file() else [])
+    filters = [(REASON_COLUMN, 'in', reasons)] if reasons is not None else None
+    return read_files(paths, columns, filters)
+
+def find_partitions(file_name:str, ids:list, emails:list, partitions:list=None) -> list:
+    """Looks up partitions with rows of the given customers in the partition indexes,
+    the rows themselves aren't read
+    Args:
+        file_name(str): dataset, eg customers
+        ids(list): customer ids
+        emails(list): emails
+        partitions(list): date directories to look in, all if None
+    Returns:
+        list of date directories
+    """
+    ids = {i for i in ids if pd.notna(i)}
+    hashes = {hash_email(email) for email in emails} - {None}
+    found = []
+    for partition in partitions if partitions is not None else get_partitions(file_name):
+        index = read_index(file_name, partition)
+        if ids.intersection(index['ids']) or hashes.intersection(index['emails']):
+            found.append(partition)
+    return found
+
+def rewrite(file_name:str, ids:list, emails:list, func) -> list:
+    """Rewrites only partitions with rows of the given customers, eg by erasure,
+    indexes of the rewritten partitions are recreated from their rows
+    Args:
+        file_name(str): dataset, eg customers
+        ids(list): customer ids
+        emails(list): emails
+        func(function): takes path of a partition and rewrites it
+    Returns:
+        paths of the rewritten partitions
+    """
+    rewritten = []
+    with get_lock(file_name):
+        for partition in find_partitions(file_name, ids, emails):
+            path = get_partition_path(file_name, partition)
+            func(path)
+            rebuild_index(file_name, partition)
+            rewritten.append(path)
+    return rewritten
+
+def rebuild_index(file_name:str, partition:str):
+    """Recreates index of a partition from its rows
+    Args:
+        file_name(str): dataset, eg customers
+        partition(str): date directory, eg 2020/01/02
+    """
+    index = {'rows': 0, 'reasons': {}, 'ids': [], 'emails': []}
+    with get_lock(file_name):
+        write_index(file_name, partition, update_index(file_name, index, read(file_name, [partition])))
+
+def build_indexes(file_name:str):
+    """Recreates indexes of all partitions of the quarantine file
+    Args:
+        file_name(str): dataset, eg customers
+    """
+    for partition in get_partitions(file_name):
+        rebuild_index(file_name, partition)
@@ -1,48 +1,532 @@
-import pathlib
-import gzip
-import pandas as pd
-
-def read_gzip_json(file_path:str) -> pd.DataFrame:
-    """Opens data in json.gz or .json format,
-    and loads it to pandas dataframe
-    Args:
-        file_path(str): path to the file
-    Returns:
-        Pandas dataframe with data from the file
-    """
-
-    file_path = pathlib.Path(file_path)
-
-    if '.gz' in file_path.suffixes:
-        with gzip.open(file_path, 'rt', encoding='UTF-8') as zipfile:
-            return pd.read_json(zipfile, lines=True)
-    else:
-        with open(file_path, 'rt', encoding="UTF-8") as file:
-            return pd.read_json(file, lines=True)
-
-def write_gzip_json(output_path, data):
-    """Writes data to json.gz file
-    Args:
-        output_path(str): path where to save the file
-        data(pd.DataFrame): pandas dataframe with data to save
-    """
-    output_path = pathlib.Path(output_path)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    if '.gz' in output_path.suffixes:
-        with gzip.open(output_path, 'wt') as f:
-            data.to_json(f, orient='records', lines=True, index=False)
-    else:
-        with open(output_path, 'wt') as f:
-            data.to_json(f, orient='records', lines=True, index=False)
-
-def append_gzip_json(output_path, data):
-    """Appends json.gz file
-    Args:
-        output_path(str): path where to save the file
-        data(pd.DataFrame): pandas dataframe with data to append
-    """
-    output_path = pathlib.Path(output_path)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    with gzip.open(output_path, 'a') as f:
-        data.to_json(f, orient='records', lines=True, index=False)
\ No newline at end of file
+import pathlib
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+import pandas as pd
+import config.config as cnf
+import ingestion.parallel_gzip as parallel_gzip
+
+# stands for json text of raw columns while a dataframe is converted to json
+RAW_PLACEHOLDER = '\x01raw\x01'
+
+def get_parser() -> str:
+    """Returns name of the library parsing json lines, set by json_parser in config
+    Returns:
+        'orjson', 'json' or 'pandas'
+    """
+    if cnf.json_parser != 'auto':
+        return cnf.json_parser
+    try:
+        import orjson
+        return 'orjson'
+    except ImportError:
+        return 'json'
+
+def get_schema(path:str) -> dict:
+    """Returns schema of the dataset the file belongs to,
+    eg transformed/2020/01/02/customers.json.gz -> schema of customers
+    Args:
+        path(str): path to the file
+    Returns:
+        dict with dtypes, category and raw columns, empty if dataset has no schema
+    """
+    return cnf.schemas.get(pathlib.Path(path).name.split('.')[0], {})
+
+def apply_schema(df:pd.DataFrame, schema:dict) -> pd.DataFrame:
+    """Converts columns to types from the schema,
+    columns that can't be converted keep their types
+    Args:
+        df(pd.DataFrame): parsed data
+        schema(dict): schema of the dataset
+    Returns:
+        dataframe with converted columns
+    """
+    dtypes = dict(schema.get('dtypes', {}))
+    dtypes.update({col: 'category' for col in schema.get('category', [])})
+    for col, dtype in dtypes.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        try:
+            df[col] = df[col].astype(dtype)
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Column {col} couldn't be converted to {dtype}: {e}")
+    return df
+
+def parse_lines(lines:list, schema:dict, start:int=0) -> pd.DataFrame:
+    """Parses json lines into a dataframe, types of columns
+    are taken from json values and the schema, they aren't inferred
+    Args:
+        lines(list): json lines, as bytes or str
+        schema(dict): schema of the dataset
+        start(int): index of the first row
+    Returns:
+        Pandas dataframe with one row per line
+    """
+    if get_parser() == 'orjson':
+        import orjson
+        loads, dumps = orjson.loads, lambda value: orjson.dumps(value).decode('UTF-8')
+    else:
+        loads, dumps = json.loads, json.JSONEncoder(separators=(',', ':')).encode
+
+    records = [loads(line) for line in lines if line.strip()]
+
+    # raw columns are kept as json text, so they aren't loaded as python objects
+    raw_columns = schema.get('raw', [])
+    if raw_columns:
+        for record in records:
+            for col in raw_columns:
+                if record.get(col) is not None:
+                    record[col] = dumps(record[col])
+
+    df = pd.DataFrame(records, index=pd.RangeIndex(start, start + len(records)))
+    return apply_schema(df, schema)
+
+def read_gzip_json(file_path:str) -> pd.DataFrame:
+    """Opens data in json.gz or .json format,
+    and loads it to pandas dataframe
+    Args:
+        file_path(str): path to the file
+    Returns:
+        Pandas dataframe with data from the file
+    """
+
+    file_path = pathlib.Path(file_path)
+
+    if '.gz' in file_path.suffixes:
+        with open(file_path, 'rb') as zipfile:
+            data = parallel_gzip.decompress(zipfile.read())
+    else:
+        with open(file_path, 'rb') as file:
+            data = file.read()
+
+    if get_parser() == 'pandas':
+        return pd.read_json(io.StringIO(data.decode('UTF-8')), lines=True)
+    return parse_lines(data.splitlines(), get_schema(file_path))
+
+def read_gzip_json_chunks(file_path:str, chunk_size:int):
+    """Opens data in json.gz or .json format,
+    and loads it to pandas dataframes, chunk_size rows at a time
+    Args:
+        file_path(str): path to the file
+        chunk_size(int): number of rows in each dataframe, None to load whole file at once
+    Returns:
+        generator with pandas dataframes with data from the file
+    """
+
+    if chunk_size is None:
+        yield read_gzip_json(file_path)
+        return
+
+    file_path = pathlib.Path(file_path)
+
+    if get_parser() == 'pandas':
+        if '.gz' in file_path.suffixes:
+            file = gzip.open(file_path, 'rt', encoding='UTF-8')
+        else:
+            file = open(file_path, 'rt', encoding="UTF-8")
+
+        with file, pd.read_json(file, lines=True, chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield chunk
+        return
+
+    if '.gz' in file_path.suffixes:
+        file = gzip.open(file_path, 'rb')
+    else:
+        file = open(file_path, 'rb')
+
+    schema = get_schema(file_path)
+    start = 0
+    with file:
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if not lines:
+                break
+            chunk = parse_lines(lines, schema, start)
+            start += len(chunk)
+            yield chunk
+
+def to_json_lines(data:pd.DataFrame, raw_columns:list) -> str:
+    """Converts dataframe to json lines, raw columns that are kept
+    as json text are written as json values, not as strings
+    Args:
+        data(pd.DataFrame): pandas dataframe with data to save
+        raw_columns(list): names of the raw columns
+    Returns:
+        json lines
+    """
+    # pandas writes an empty line for a dataframe without rows
+    if data.empty:
+        return ''
+    raw_columns = [col for col in data.columns if col in raw_columns]
+    if not raw_columns:
+        return data.to_json(orient='records', lines=True, index=False)
+
+    # json text is replaced with a placeholder, and put back in its place after conversion
+    is_text = {col: data[col].map(lambda value: isinstance(value, str)) for col in raw_columns}
+    raw = [[data[col].iat[i] for col in raw_columns if is_text[col].iat[i]] for i in range(len(data))]
+    data = data.assign(**{col: data[col].mask(is_text[col], RAW_PLACEHOLDER) for col in raw_columns})
+    placeholder = json.dumps(RAW_PLACEHOLDER)
+
+    lines = data.to_json(orient='records', lines=True, index=False).split('\n')
+    for i, values in enumerate(raw):
+        if values:
+            parts = lines[i].split(placeholder)
+            lines[i] = ''.join(part + value for part, value in zip(parts, values)) + parts[-1]
+    return '\n'.join(lines)
+
+def stage_gzip_json(path:str, is_candidate, update) -> tuple:
+    """Writes changed copy of json.gz file line by line, only lines selected by is_candidate
+    are parsed and passed to update, other lines are copied byte for byte.
+    The copy is a temporary file next to the file, it replaces the file
+    with commit_staged, so memory use doesn't depend on the size of the file
+    Args:
+        path(str): path to the json.gz file
+        is_candidate(function): takes line as bytes, True if it may have to be changed
+        update(function): takes parsed line, returns changed dict or None if nothing changed
+    Returns:
+        (path to the temporary file, number of changed lines), path is None if nothing changed
+    """
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    level = parallel_gzip.get_compression_level(path)
+    changed = 0
+    try:
+        with gzip.open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+            block = []
+            block_size = 0
+            for line in source:
+                if is_candidate(line):
+                    record = update(json.loads(line))
+                    if record is not None:
+                        ending = line[len(line.rstrip(b'\r\n')):]
+                        line = json.dumps(record, separators=(',', ':')).encode('UTF-8') + ending
+                        changed += 1
+                block.append(line)
+                block_size += len(line)
+
+                # compressed in blocks, the same way as write_gzip_json
+                if block_size >= cnf.compression_block_size:
+                    target.write(parallel_gzip.compress_block(b''.join(block), level))
+                    block = []
+                    block_size = 0
+            if block:
+                target.write(parallel_gzip.compress_block(b''.join(block), level))
+    except BaseException:
+        discard_staged(tmp_path)
+        raise
+    if not changed:
+        discard_staged(tmp_path)
+        return None, 0
+    return tmp_path, changed
+
+def rewrite_gzip_json(path:str, is_candidate, update) -> int:
+    """Rewrites json.gz file line by line, see stage_gzip_json
+    Args:
+        path(str): path to the json.gz file
+        is_candidate(function): takes line as bytes, True if it may have to be changed
+        update(function): takes parsed line, returns changed dict or None if nothing changed
+    Returns:
+        number of changed lines, the file isn't replaced if it's 0
+    """
+    tmp_path, changed = stage_gzip_json(path, is_candidate, update)
+    if tmp_path is not None:
+        commit_staged(path, tmp_path)
+    return changed
+
+def write_gzip_json(output_path, data):
+    """Writes data to json.gz file, blocks of the file
+    are compressed in parallel
+    Args:
+        output_path(str): path where to save the file
+        data(pd.DataFrame): pandas dataframe with data to save
+    """
+    output_path = pathlib.Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if '.gz' in output_path.suffixes:
+        text = to_json_lines(data, get_schema(output_path).get('raw', []))
+        compressed = parallel_gzip.compress(text.encode('UTF-8'), parallel_gzip.get_compression_level(output_path))
+        with open(output_path, 'wb') as f:
+            f.write(compressed)
+    else:
+        with open(output_path, 'wt') as f:
+            f.write(to_json_lines(data, get_schema(output_path).get('raw', [])))
+
+def append_gzip_json(output_path, data):
+    """Appends json.gz file
+    Args:
+        output_path(str): path where to save the file
+        data(pd.DataFrame): pandas dataframe with data to append
+    """
+    output_path = pathlib.Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    text = to_json_lines(data, get_schema(output_path).get('raw', []))
+    compressed = parallel_gzip.compress(text.encode('UTF-8'), parallel_gzip.get_compression_level(output_path))
+    with open(output_path, 'ab') as f:
+        f.write(compressed)
+
+def get_storage_path(path:str) -> pathlib.Path:
+    """Returns path where data is stored in the format set in config,
+    eg with parquet storage maps/customers_map.json.gz -> maps/customers_map.parquet
+    Args:
+        path(str): path to the file
+    Returns:
+        path with the extension of the storage format
+    """
+    path = pathlib.Path(path)
+    if cnf.storage_format == 'parquet' and path.suffix != '.parquet':
+        return path.with_name(path.name.split('.')[0] + '.parquet')
+    return path
+
+def get_parts(path:pathlib.Path) -> list:
+    """Returns files of a parquet dataset, oldest first.
+    Parquet files can't be appended, so each append
+    adds a new file to the dataset directory
+    Args:
+        path(pathlib.Path): path to the dataset directory
+    Returns:
+        list of paths to parquet files
+    """
+    if not path.is_dir():
+        return []
+    return sorted(path.glob('part-*.parquet'))
+
+def data_exists(path:str) -> bool:
+    """Checks if data was saved in a given path
+    Args:
+        path(str): path to the file
+    Returns:
+        True if the file exists
+    """
+    path = get_storage_path(path)
+    if cnf.storage_format == 'parquet':
+        return bool(get_parts(path))
+    return path.is_file()
+
+def apply_filters(df:pd.DataFrame, filters:list) -> pd.DataFrame:
+    """Keeps rows matching the filters, used for formats that can't
+    filter while reading. Filters are in the same form as for parquet,
+    list of (column, operator, value), all of them have to match
+    Args:
+        df(pd.DataFrame): data
+        filters(list): filters, operators '==', '!=', 'in' or 'not in'
+    Returns:
+        filtered dataframe
+    """
+    for col, op, val in filters:
+        if col not in df.columns:
+            return df.iloc[0:0]
+        if op in ['=', '==']:
+            df = df[df[col] == val]
+        elif op == '!=':
+            df = df[df[col] != val]
+        elif op == 'in':
+            df = df[df[col].isin(val)]
+        elif op == 'not in':
+            df = df[~df[col].isin(val)]
+        else:
+            raise ValueError(f"Filter operator {op} is not supported")
+    return df
+
+def read_data(path:str, columns:list=None, filters:list=None) -> pd.DataFrame:
+    """Loads data saved with write_data or append_data.
+    Parquet storage reads only given columns, and skips row groups
+    that can't match the filters
+    Args:
+        path(str): path to the file
+        columns(list): columns to read, all if None
+        filters(list): list of (column, operator, value), eg [('id', 'in', ids)]
+    Returns:
+        Pandas dataframe with data from the file
+    """
+    path = get_storage_path(path)
+
+    if cnf.storage_format == 'parquet':
+        return read_files(get_parts(path), columns, filters)
+    return read_file(path, columns, filters)
+
+def read_file(path:pathlib.Path, columns:list=None, filters:list=None) -> pd.DataFrame:
+    """Loads a single .parquet or json.gz file,
+    parquet files are read only for given columns and filters
+    Args:
+        path(pathlib.Path): path to the file
+        columns(list): columns to read, all if None
+        filters(list): list of (column, operator, value)
+    Returns:
+        Pandas dataframe with data from the file
+    """
+    path = pathlib.Path(path)
+
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        names = pq.read_schema(path).names
+        if filters and any(col not in names for col, _, _ in filters):
+            return pd.DataFrame(columns=columns)
+        if columns is not None:
+            columns = [col for col in columns if col in names]
+        return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+    df = read_gzip_json(path)
+    if filters:
+        df = apply_filters(df, filters)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+def read_files(paths:list, columns:list=None, filters:list=None) -> pd.DataFrame:
+    """Loads several .parquet or json.gz files into one dataframe
+    Args:
+        paths(list): paths to the files
+        columns(list): columns to read, all if None
+        filters(list): list of (column, operator, value)
+    Returns:
+        Pandas dataframe with data from all files
+    """
+    dfs = [read_file(path, columns, filters) for path in paths]
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(dfs, ignore_index=True)
+
+def write_file(path:pathlib.Path, data:pd.DataFrame):
+    """Saves data to a single .parquet or json.gz file
+    Args:
+        path(pathlib.Path): path where to save the file
+        data(pd.DataFrame): pandas dataframe with data to save
+    """
+    path = pathlib.Path(path)
+
+    if path.suffix != '.parquet':
+        write_gzip_json(path, data)
+        return
+
+    import pyarrow as pa
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        data.to_parquet(path, index=False, row_group_size=cnf.parquet_row_group_size)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # columns with mixed types, eg numbers with hashed values, are saved as strings
+        data = data.copy()
+        for col in data.columns[data.dtypes == object]:
+            if data[col].dropna().map(type).nunique() > 1:
+                data[col] = data[col].where(data[col].isna(), data[col].astype(str))
+        data.to_parquet(path, index=False, row_group_size=cnf.parquet_row_group_size)
+
+def write_parquet_part(path:pathlib.Path, data:pd.DataFrame):
+    """Saves data as a new file in a parquet dataset directory
+    Args:
+        path(pathlib.Path): path to the dataset directory
+        data(pd.DataFrame): pandas dataframe with data to save
+    """
+    write_file(path / f'part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet', data)
+
+def write_data(path:str, data:pd.DataFrame):
+    """Saves data in the storage format set in config,
+    replaces data that was saved in the path before
+    Args:
+        path(str): path where to save the file
+        data(pd.DataFrame): pandas dataframe with data to save
+    """
+    path = get_storage_path(path)
+
+    if cnf.storage_format == 'parquet':
+        old_parts = get_parts(path)
+        write_parquet_part(path, data)
+        for part in old_parts:
+            part.unlink()
+    else:
+        write_gzip_json(path, data)
+
+def stage_data(path:str, data:pd.DataFrame, tmp_path:pathlib.Path=None) -> pathlib.Path:
+    """Saves data in a temporary file (a directory of parts with parquet storage),
+    it replaces data saved in the path with commit_staged, until then readers see the old data
+    Args:
+        path(str): path where the data should be saved
+        data(pd.DataFrame): pandas dataframe with data to save
+        tmp_path(pathlib.Path): temporary file from the previous call, eg with the previous
+            chunk of the file, data is appended to it, a new one is created if None
+    Returns:
+        path to the temporary file
+    """
+    path = get_storage_path(path)
+    if tmp_path is not None:
+        # empty chunks add nothing to the data
+        if not data.empty:
+            if cnf.storage_format == 'parquet':
+                write_parquet_part(tmp_path, data)
+            else:
+                append_gzip_json(tmp_path, data)
+        return tmp_path
+
+    if cnf.storage_format == 'parquet':
+        # not matched by get_parts until it's committed
+        tmp_path = path / f'tmp-{uuid.uuid4().hex[:8]}'
+    else:
+        tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        if cnf.storage_format == 'parquet':
+            write_parquet_part(tmp_path, data)
+        else:
+            write_file(tmp_path, data)
+    except BaseException:
+        discard_staged(tmp_path)
+        raise
+    return tmp_path
+
+def commit_staged(path:str, tmp_path:pathlib.Path):
+    """Replaces data saved in the path with the temporary file
+    from stage_data or stage_gzip_json
+    Args:
+        path(str): path where the data is saved
+        tmp_path(pathlib.Path): path to the temporary file
+    """
+    path = get_storage_path(path)
+    if not tmp_path.is_dir():
+        os.replace(tmp_path, path)
+        return
+
+    # parts are moved into the dataset, and parts saved before are removed
+    old_parts = get_parts(path)
+    for part in get_parts(tmp_path):
+        os.replace(part, path / part.name)
+    tmp_path.rmdir()
+    for part in old_parts:
+        part.unlink()
+
+def discard_staged(tmp_path:pathlib.Path):
+    """Removes temporary file that won't be committed
+    Args:
+        tmp_path(pathlib.Path): path to the temporary file
+    """
+    if tmp_path.is_dir():
+        shutil.rmtree(tmp_path)
+    elif tmp_path.exists():
+        tmp_path.unlink()
+
+def append_data(path:str, data:pd.DataFrame):
+    """Appends data in the storage format set in config,
+    creates it if it doesn't exist
+    Args:
+        path(str): path where to save the file
+        data(pd.DataFrame): pandas dataframe with data to append
+    """
+    path = get_storage_path(path)
+
+    # empty chunks add nothing, the file is created by the first chunk
+    if data.empty and data_exists(path):
+        return
+    if cnf.storage_format == 'parquet':
+        write_parquet_part(path, data)
+    elif path.is_file():
+        append_gzip_json(path, data)
+    else:
+        write_gzip_json(path, data)
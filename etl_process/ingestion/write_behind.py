@@ -0,0 +1,68 @@
+import atexit
+import os
+import queue
+import threading
+import logging
+import config.config as cnf
+
+# writes waiting for the writer thread, created on first use
+write_queue = None
+write_queue_lock = threading.Lock()
+
+def get_queue() -> queue.Queue:
+    """Returns queue of writes, starts the writer thread on first use
+    Returns:
+        bounded queue, submit waits when it's full
+    """
+    global write_queue
+    with write_queue_lock:
+        if write_queue is None:
+            write_queue = queue.Queue(maxsize=cnf.pipeline_buffer_size)
+            threading.Thread(target=write, name='write-behind', daemon=True).start()
+            # writes still queued when the process ends are finished first
+            atexit.register(flush)
+        return write_queue
+
+def reset():
+    """Forgets the writer thread of the parent in a forked process,
+    threads aren't copied to it, so the next write starts a new one
+    """
+    global write_queue, write_queue_lock
+    write_queue = None
+    write_queue_lock = threading.Lock()
+
+# pools use spawn, but a process forked by other code starts its own writer
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset)
+
+def write():
+    while True:
+        func, args, done = write_queue.get()
+        try:
+            if func is not None:
+                func(*args)
+        except Exception as e:
+            logging.error(f"Error while writing {args[0] if args else ''}: {e}")
+        finally:
+            if done is not None:
+                done.set()
+            write_queue.task_done()
+
+def submit(func, *args):
+    """Runs function in the writer thread, writes are done
+    in the order they were submitted
+    Args:
+        func(function): function that writes data, eg write_data
+        args: arguments of the function, first one is used in error messages
+    """
+    get_queue().put((func, args, None))
+
+def flush():
+    """Waits until all writes submitted so far are done,
+    eg before erasure reads the output files
+    """
+    if write_queue is None:
+        return
+    done = threading.Event()
+    write_queue.put((None, (), done))
+    done.wait()
@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import pathlib
+import sys
+import threading
+import time
+import config.config as cnf
+import profiling
+from ingestion.file_lock import FileLock, get_lock_path
+from transformation.utils import get_file_name
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory isn't measured there
+    resource = None
+
+# prometheus metrics saved to metrics_path, name: (type, help)
+METRICS = {
+    'etl_stage_runs_total': ('counter', 'Number of times the stage ran'),
+    'etl_stage_seconds_total': ('counter', 'Wall time spent in the stage'),
+    'etl_stage_rows_in_total': ('counter', 'Rows passed to the stage'),
+    'etl_stage_rows_out_total': ('counter', 'Rows returned by the stage'),
+    'etl_stage_bytes_read_total': ('counter', 'Bytes of files read by the stage'),
+    'etl_stage_bytes_written_total': ('counter', 'Bytes of files written by the stage'),
+    'etl_stage_peak_memory_bytes': ('gauge', 'Highest peak memory of the process at the end of the stage'),
+    'etl_queue_peak_depth': ('gauge', 'Highest number of queued batches when a batch was added to the work queue'),
+}
+
+# totals of stages that weren't saved yet, eg {'etl_stage_runs_total{dataset="customers",stage="read"}': 3}
+totals = {}
+totals_lock = threading.Lock()
+
+# logger writing one json record per stage to metrics_log_path
+logger = None
+
+def get_logger() -> logging.Logger:
+    """Returns logger for stage records, creates it on first use
+    Returns:
+        logger
+    """
+    global logger
+    with totals_lock:
+        if logger is None:
+            logger = logging.getLogger('etl_metrics')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            log_path = pathlib.Path(cnf.metrics_log_path)
+            log_path.parent.mkdir(parents=True, exist_ok=True)
+            handler = logging.FileHandler(log_path)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+        return logger
+
+def get_size(path) -> int:
+    """Returns size of a file, or of all files in a directory (eg parquet parts)
+    Args:
+        path(str): path to the file or directory
+    Returns:
+        size in bytes, 0 if the path doesn't exist
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    if path.is_file():
+        return path.stat().st_size
+    return 0
+
+def get_peak_memory() -> int:
+    """Returns peak resident memory of the process
+    Returns:
+        size in bytes, None if it can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Stage:
+    """Measures one stage of processing a file: wall time, rows in and out,
+    bytes read and written and peak memory. Does nothing if metrics are disabled.
+    With profiling enabled, memory of the stage is profiled as well
+
+    with metrics.Stage('dedup', input_path) as stage:
+        df = t.remove_id_dups(df, ...)
+        stage.rows(rows_in, len(df))
+    """
+    def __init__(self, name:str, input_path:str, read_paths:list=None,
+                 write_paths:list=None, append:bool=False):
+        """
+        Args:
+            name(str): name of the stage, eg read, dedup, write
+            input_path(str): path of the file that is processed
+            read_paths(list): files read by the stage
+            write_paths(list): files or directories written by the stage
+            append(bool): if the stage appends write_paths (True), only the added bytes
+                are counted, or replaces them (False)
+        """
+        self.name = name
+        self.input_path = input_path
+        self.read_paths = read_paths or []
+        self.write_paths = write_paths or []
+        self.append = append
+        self.rows_in = None
+        self.rows_out = None
+        self.cancelled = False
+        self.profile = None
+
+    def rows(self, rows_in:int=None, rows_out:int=None):
+        """Sets number of rows the stage got and returned
+        Args:
+            rows_in(int): rows passed to the stage
+            rows_out(int): rows returned by the stage
+        """
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+
+    def memory(self, **frames):
+        """Records memory used by dataframes of the stage, only when profiling
+        Args:
+            frames: name=dataframe, eg df=df, quarantine=df_quarantine
+        """
+        if self.profile is not None:
+            self.profile.frames.update(profiling.get_frame_memory(frames))
+
+    def cancel(self):
+        """Stage isn't recorded, eg when there was nothing left to read"""
+        self.cancelled = True
+
+    def __enter__(self):
+        if cnf.metrics_enabled:
+            self.size_before = sum(get_size(path) for path in self.write_paths) if self.append else 0
+            self.start = time.perf_counter()
+        if cnf.profiling_enabled:
+            self.profile = profiling.StageProfile(self.name, self.input_path)
+            self.profile.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # failed stages are logged by the caller
+        if self.profile is not None and exc_type is None and not self.cancelled:
+            self.profile.stop()
+        if cnf.metrics_enabled and exc_type is None and not self.cancelled:
+            seconds = time.perf_counter() - self.start
+            record({
+                'stage': self.name,
+                'dataset': get_file_name(self.input_path),
+                'file': str(self.input_path),
+                'seconds': round(seconds, 6),
+                'rows_in': self.rows_in,
+                'rows_out': self.rows_out,
+                'bytes_read': sum(get_size(path) for path in self.read_paths),
+                'bytes_written': sum(get_size(path) for path in self.write_paths) - self.size_before,
+                'peak_memory_bytes': get_peak_memory(),
+            })
+        return False
+
+def measure_chunks(chunks, input_path:str):
+    """Measures reading of each chunk of a file as a 'read' stage,
+    bytes of the file are counted with the first chunk
+    Args:
+        chunks(generator): dataframes read from the file
+        input_path(str): path of the file that is read
+    Returns:
+        generator with the same dataframes
+    """
+    chunks = iter(chunks)
+    read_paths = [input_path]
+    while True:
+        with Stage('read', input_path, read_paths=read_paths) as stage:
+            df = next(chunks, None)
+            if df is None:
+                stage.cancel()
+            else:
+                stage.rows(rows_out=len(df))
+                stage.memory(df=df)
+        if df is None:
+            return
+        read_paths = None
+        yield df
+
+def record_wait(input_path:str, seconds:float, depth:int):
+    """Records time a batch waited in the work queue as a 'queue' stage,
+    labelled with the dataset of its first file
+    Args:
+        input_path(str): path of the first file of the batch
+        seconds(float): time the batch waited
+        depth(int): number of queued batches when it was added
+    """
+    if not cnf.metrics_enabled:
+        return
+    record({
+        'stage': 'queue',
+        'dataset': get_file_name(input_path),
+        'file': str(input_path),
+        'seconds': round(seconds, 6),
+        'rows_in': None,
+        'rows_out': None,
+        'bytes_read': None,
+        'bytes_written': None,
+        'peak_memory_bytes': None,
+        'queue_depth': depth,
+    })
+
+def get_key(name:str, values:dict) -> str:
+    """Returns prometheus name of the metric with labels
+    Args:
+        name(str): name of the metric
+        values(dict): stage record
+    Returns:
+        eg etl_stage_runs_total{dataset="customers",stage="read"}
+    """
+    return f'{name}{{dataset="{values["dataset"]}",stage="{values["stage"]}"}}'
+
+def load_totals(metrics_path:pathlib.Path) -> dict:
+    """Loads totals saved by this and other processes
+    Args:
+        metrics_path(pathlib.Path): path to the prometheus file
+    Returns:
+        dict with totals
+    """
+    saved = {}
+    if not metrics_path.is_file():
+        return saved
+    with open(metrics_path, 'rt') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            key, value = line.rsplit(' ', 1)
+            saved[key] = float(value)
+    return saved
+
+def record(values:dict):
+    """Writes stage record to the json log and adds it to the totals
+    Args:
+        values(dict): stage record
+    """
+    get_logger().info(json.dumps(values))
+
+    with totals_lock:
+        additions = {
+            'etl_stage_runs_total': 1,
+            'etl_stage_seconds_total': values['seconds'],
+            'etl_stage_rows_in_total': values['rows_in'],
+            'etl_stage_rows_out_total': values['rows_out'],
+            'etl_stage_bytes_read_total': values['bytes_read'],
+            'etl_stage_bytes_written_total': values['bytes_written'],
+        }
+        for name, value in additions.items():
+            if value is not None:
+                key = get_key(name, values)
+                totals[key] = totals.get(key, 0) + value
+        if values['peak_memory_bytes'] is not None:
+            key = get_key('etl_stage_peak_memory_bytes', values)
+            totals[key] = max(totals.get(key, 0), values['peak_memory_bytes'])
+        if values.get('queue_depth') is not None:
+            key = get_key('etl_queue_peak_depth', values)
+            totals[key] = max(totals.get(key, 0), values['queue_depth'])
+
+def export():
+    """Adds totals to the ones saved in metrics_path, in prometheus text format.
+    The file is locked, so processes don't overwrite each other's totals,
+    and replaced in one step so a scraper never reads half of it
+    """
+    if not cnf.metrics_enabled:
+        return
+    metrics_path = pathlib.Path(cnf.metrics_path)
+    with totals_lock, FileLock(get_lock_path(metrics_path)):
+        saved = load_totals(metrics_path)
+        for key, value in totals.items():
+            if METRICS[key.split('{')[0]][0] == 'gauge':
+                saved[key] = max(saved.get(key, 0), value)
+            else:
+                saved[key] = saved.get(key, 0) + value
+        totals.clear()
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            keys = sorted(key for key in saved if key.split('{')[0] == name)
+            if not keys:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(f'{key} {saved[key]}' for key in keys)
+
+        tmp_path = metrics_path.with_name(metrics_path.name + '.tmp')
+        with open(tmp_path, 'wt') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, metrics_path)
@@ -1,26 +1,77 @@
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-import time
-import subprocess
-import config.config as cnf
-import os
-
-class MyHandler(FileSystemEventHandler):
-    def on_created(self, event):
-        # run main.py with the new file path
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        subprocess.run(['python', os.path.join(script_dir, 'main.py'), event.src_path])
-
-folder_to_monitor = cnf.input_root
-
-event_handler = MyHandler()
-observer = Observer()
-observer.schedule(event_handler, folder_to_monitor, recursive=True)
-observer.start()
-
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    observer.stop()
-    observer.join()
\ No newline at end of file
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+import time
+import subprocess
+import config.config as cnf
+from config.configure_log import configure_log
+from scheduler import Scheduler
+import os
+
+class MyHandler(FileSystemEventHandler):
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.scheduler.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.scheduler.notify(event.src_path)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.scheduler.notify(event.src_path)
+
+    def on_moved(self, event):
+        # file written under a temporary name and renamed
+        if not event.is_directory:
+            self.scheduler.notify(event.dest_path)
+
+def run_main(paths:list, on_done, priority:int=None, block:bool=True, known_ids:dict=None) -> bool:
+    # run main.py with each file path, in the order given by the scheduler,
+    # files are processed right away so nothing is queued,
+    # each file runs in its own process, so known_ids can't be shared
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        for path in paths:
+            subprocess.run(['python', os.path.join(script_dir, 'main.py'), path])
+    finally:
+        on_done()
+    return True
+
+if __name__ == "__main__":
+
+    folder_to_monitor = cnf.input_root
+
+    configure_log(cnf.log_file_path)
+
+    if cnf.monitor_mode in ['workers', 'processes']:
+        from workers import WorkerPool, ProcessPool
+
+        if cnf.monitor_mode == 'workers':
+            pool = WorkerPool(cnf.worker_count, cnf.queue_size)
+        else:
+            pool = ProcessPool(cnf.worker_count, cnf.queue_size)
+        pool.start()
+        scheduler = Scheduler(pool.submit, cnf.settle_seconds)
+    else:
+        pool = None
+        scheduler = Scheduler(run_main, cnf.settle_seconds)
+    scheduler.start()
+    event_handler = MyHandler(scheduler)
+
+    observer = Observer()
+    observer.schedule(event_handler, folder_to_monitor, recursive=True)
+    observer.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        observer.stop()
+        observer.join()
+        # schedule files that are still settling, and finish files that are already queued
+        scheduler.stop()
+        if pool is not None:
+            pool.stop()
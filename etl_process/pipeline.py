@@ -0,0 +1,78 @@
+import queue
+import threading
+import pathlib
+import config.config as cnf
+from ingestion.read_write import read_gzip_json_chunks
+import ingestion.processed_files as processed_files
+from transformation.utils import get_file_name
+
+# files that are read ahead, erasure requests are read when they're processed
+PREFETCHED = ['customers', 'products', 'transactions']
+
+# marks the last chunk of a file in the buffer
+END = object()
+
+def read_ahead(paths:list, buffer:queue.Queue):
+    """Reads and decompresses files one by one and puts their chunks
+    into the buffer, waits while the buffer is full
+    Args:
+        paths(list): paths of the files
+        buffer(queue.Queue): bounded buffer shared with prefetch
+    """
+    for path in paths:
+        # files that process_file skips (eg processed before) aren't read
+        if get_file_name(path) not in PREFETCHED or not pathlib.Path(path).is_file() \
+                or processed_files.should_skip(processed_files.get_status(path)):
+            buffer.put(None)
+            continue
+        try:
+            for chunk in read_gzip_json_chunks(path, cnf.chunk_size):
+                buffer.put(chunk)
+            buffer.put(END)
+        except Exception as e:
+            # raised when the file is processed
+            buffer.put(e)
+
+def get_chunks(buffer:queue.Queue, chunk):
+    """Takes chunks of one file from the buffer
+    Args:
+        buffer(queue.Queue): bounded buffer filled by read_ahead
+        chunk(pd.DataFrame): first chunk of the file, already taken from the buffer
+    Returns:
+        generator with pandas dataframes
+    """
+    while chunk is not END:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+        chunk = buffer.get()
+
+def prefetch(paths:list, buffer_size:int):
+    """Reads files in a background thread, while the previous file
+    is transformed. At most buffer_size chunks (or whole files
+    when chunk_size isn't set) are waiting in memory
+    Args:
+        paths(list): paths of the files, in the order they're processed
+        buffer_size(int): max number of chunks read ahead
+    Returns:
+        generator with (path, chunks) for each file, chunks is None
+        for files that aren't read ahead (eg erasure requests)
+    """
+    buffer = queue.Queue(maxsize=buffer_size)
+    reader = threading.Thread(target=read_ahead, args=(paths, buffer), name='read-ahead', daemon=True)
+    reader.start()
+    for path in paths:
+        first = buffer.get()
+        if first is None:
+            yield path, None
+            continue
+
+        chunks = get_chunks(buffer, first)
+        yield path, chunks
+        # chunks left after an error, so the next file starts at its first chunk
+        try:
+            for _ in chunks:
+                pass
+        except Exception:
+            pass
+    reader.join()
@@ -0,0 +1,210 @@
+import json
+import linecache
+import logging
+import pathlib
+import sys
+import threading
+import time
+import tracemalloc
+import config.config as cnf
+from transformation.utils import get_file_name
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory isn't measured there
+    resource = None
+
+# stages profiled so far, per processed file, until its report is saved
+profiles = {}
+profiles_lock = threading.Lock()
+
+# allocations of these files aren't listed, they're made by the profiler itself
+IGNORED_FILES = [tracemalloc.__file__, linecache.__file__, '<frozen importlib._bootstrap>', '<unknown>']
+
+def read_status() -> dict:
+    """Reads memory of the process from /proc, available on linux only
+    Returns:
+        dict with eg VmRSS and VmHWM in bytes, empty if it can't be read
+    """
+    status = {}
+    try:
+        with open('/proc/self/status', 'rt') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ['VmRSS', 'VmHWM']:
+                    status[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return status
+
+def get_rss() -> tuple:
+    """Returns current and peak resident memory of the process.
+    Peak can be reset on linux only, elsewhere it's the peak since the process started
+    Returns:
+        (current, peak) in bytes, None if it can't be measured
+    """
+    status = read_status()
+    if status:
+        return status.get('VmRSS'), status.get('VmHWM')
+    if resource is None:
+        return None, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return None, peak if sys.platform == 'darwin' else peak * 1024
+
+def reset_peak_rss():
+    """Sets peak resident memory to the current one, so the next
+    peak is the peak of the stage, works on linux only
+    """
+    try:
+        with open('/proc/self/clear_refs', 'wt') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def get_frame_memory(frames:dict) -> dict:
+    """Returns memory used by dataframes, including strings in object columns
+    Args:
+        frames(dict): name: dataframe (or series)
+    Returns:
+        dict with name: size in bytes
+    """
+    memory = {}
+    for name, df in frames.items():
+        if df is None:
+            continue
+        usage = df.memory_usage(deep=True)
+        memory[name] = int(usage.sum() if hasattr(usage, 'sum') else usage)
+    return memory
+
+def get_top_allocations(snapshot:tracemalloc.Snapshot, start:tracemalloc.Snapshot, limit:int) -> list:
+    """Returns call sites that allocated most of the memory still held
+    at the end of the stage
+    Args:
+        snapshot(tracemalloc.Snapshot): allocations at the end of the stage
+        start(tracemalloc.Snapshot): allocations at the start of the stage
+        limit(int): number of call sites
+    Returns:
+        list of {'site': 'file.py:12', 'code': line of code, 'bytes': size, 'count': number of blocks}
+    """
+    top = []
+    for diff in snapshot.compare_to(start, 'lineno'):
+        if diff.size_diff <= 0 or len(top) == limit:
+            break
+        frame = diff.traceback[0]
+        if frame.filename in IGNORED_FILES:
+            continue
+        top.append({'site': f'{frame.filename}:{frame.lineno}',
+                    'code': linecache.getline(frame.filename, frame.lineno).strip(),
+                    'bytes': diff.size_diff, 'count': diff.count_diff})
+    return top
+
+class StageProfile:
+    """Memory of one stage of processing a file: resident memory before, after
+    and at the peak, python allocations (tracemalloc) and memory of dataframes.
+    Profiles of stages running at the same time in other threads overlap,
+    so worker_count 1 gives the clearest numbers
+    """
+    def __init__(self, name:str, input_path:str):
+        """
+        Args:
+            name(str): name of the stage, eg read, dedup, write
+            input_path(str): path of the file that is processed
+        """
+        self.name = name
+        self.input_path = input_path
+        self.frames = {}
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        reset_peak_rss()
+        tracemalloc.reset_peak()
+        self.rss_before, _ = get_rss()
+        self.traced_before, _ = tracemalloc.get_traced_memory()
+        self.snapshot = tracemalloc.take_snapshot() if cnf.profile_top_allocations else None
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        """Saves the profile with other stages of the file"""
+        seconds = time.perf_counter() - self.start_time
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        rss, peak_rss = get_rss()
+        top = []
+        if self.snapshot is not None:
+            top = get_top_allocations(tracemalloc.take_snapshot(), self.snapshot, cnf.profile_top_allocations)
+            self.snapshot = None
+
+        profile = {
+            'stage': self.name,
+            'seconds': round(seconds, 6),
+            'rss_before_bytes': self.rss_before,
+            'rss_after_bytes': rss,
+            'peak_rss_bytes': peak_rss,
+            'traced_growth_bytes': traced - self.traced_before,
+            'traced_peak_bytes': traced_peak - self.traced_before,
+            'dataframe_bytes': self.frames,
+            'top_allocations': top,
+        }
+        with profiles_lock:
+            profiles.setdefault(str(self.input_path), []).append(profile)
+
+def get_report_path(input_path:str) -> pathlib.Path:
+    """Returns path of the report of a file, eg input/2020/01/02/customers.json.gz
+    -> profiles/2020-01-02-customers.json, the report of the last run is kept
+    Args:
+        input_path(str): path of the processed file
+    Returns:
+        path in profile_dir
+    """
+    try:
+        relative_path = pathlib.Path(input_path).resolve().relative_to(pathlib.Path(cnf.input_root).resolve())
+    except ValueError:
+        relative_path = pathlib.Path(pathlib.Path(input_path).name)
+    name = '-'.join(relative_path.parent.parts + (get_file_name(input_path),))
+    return pathlib.Path(cnf.profile_dir) / f'{name}.json'
+
+def save_report(input_path:str) -> pathlib.Path:
+    """Saves profiles of all stages of a file as a json report, with the stage
+    of the highest peak and call sites that allocated most across all stages
+    Args:
+        input_path(str): path of the processed file
+    Returns:
+        path to the report, None if nothing was profiled
+    """
+    with profiles_lock:
+        stages = profiles.pop(str(input_path), None)
+    if not stages:
+        return None
+
+    peaks = [stage for stage in stages if stage['peak_rss_bytes'] is not None]
+    peak_stage = max(peaks, key=lambda stage: stage['peak_rss_bytes']) if peaks else None
+    sites = {}
+    for stage in stages:
+        for allocation in stage['top_allocations']:
+            site = sites.setdefault(allocation['site'], dict(allocation, bytes=0, count=0, stages=[]))
+            site['bytes'] += allocation['bytes']
+            site['count'] += allocation['count']
+            site['stages'].append(stage['stage'])
+    top = sorted(sites.values(), key=lambda site: site['bytes'], reverse=True)[:cnf.profile_top_allocations]
+
+    report = {
+        'file': str(input_path),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'peak_rss_bytes': peak_stage['peak_rss_bytes'] if peak_stage else None,
+        'peak_stage': peak_stage['stage'] if peak_stage else None,
+        'top_allocations': top,
+        'stages': stages,
+    }
+    report_path = get_report_path(input_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'wt') as f:
+        json.dump(report, f, indent=2)
+
+    if peak_stage:
+        logging.info(f"Peak memory {peak_stage['peak_rss_bytes'] / 2**20:.1f} MiB of {input_path} "
+                     f"in stage {peak_stage['stage']}, profile saved to {report_path}.")
+    for site in top[:3]:
+        logging.info(f"{site['bytes'] / 2**20:.1f} MiB allocated at {site['site']} ({site['code']}) in {site['stages']}.")
+    return report_path
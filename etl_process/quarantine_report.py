@@ -0,0 +1,40 @@
+import argparse
+import pandas as pd
+import config.config as cnf
+import ingestion.quarantine_store as quarantine_store
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Shows why rows were quarantined, per date directory. '
+                                                 'Only partition indexes are read, unless --rows is given')
+    parser.add_argument('dataset', choices=list(cnf.quarantine_paths), help='eg customers')
+    parser.add_argument('--start', help='first date directory, eg 2020/01/01')
+    parser.add_argument('--end', help='last date directory, eg 2020/12/31')
+    parser.add_argument('--reason', nargs='+', choices=quarantine_store.REASONS, help='only rows with these reasons')
+    parser.add_argument('--id', type=int, nargs='+', default=[], help='only partitions with these customer ids')
+    parser.add_argument('--email', nargs='+', default=[], help='only partitions with these emails')
+    parser.add_argument('--rows', action='store_true', help='print quarantined rows as well')
+    args = parser.parse_args()
+
+    partitions = quarantine_store.get_partitions(args.dataset, args.start, args.end)
+    if args.id or args.email:
+        partitions = quarantine_store.find_partitions(args.dataset, args.id, args.email, partitions)
+
+    for partition in partitions:
+        index = quarantine_store.read_index(args.dataset, partition)
+        reasons = {reason: count for reason, count in index['reasons'].items() if not args.reason or reason in args.reason}
+        if reasons:
+            print(partition, sum(reasons.values()), reasons)
+
+    if args.rows and partitions:
+        df = quarantine_store.read(args.dataset, partitions, args.reason)
+        col_name = quarantine_store.CUSTOMER_ID_COLUMNS.get(args.dataset)
+        if (args.id or args.email) and not df.empty:
+            mask = pd.Series(False, index=df.index)
+            if col_name in df.columns:
+                mask |= df[col_name].isin(args.id)
+            if 'email' in df.columns:
+                mask |= df['email'].isin(args.email)
+            df = df[mask]
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(df)
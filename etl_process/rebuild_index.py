@@ -0,0 +1,31 @@
+import sys
+import config.config as cnf
+import ingestion.id_index as id_index
+import ingestion.location_index as location_index
+import ingestion.quarantine_store as quarantine_store
+
+if __name__ == "__main__":
+
+    # --filters only recreates bloom filters from the id indexes
+    filters_only = '--filters' in sys.argv[1:]
+
+    # datasets to rebuild, all master files if none are given
+    file_names = [arg for arg in sys.argv[1:] if arg != '--filters'] or list(cnf.map_paths.keys())
+
+    for file_name in file_names:
+        if filters_only:
+            print('Rebuilding bloom filter:', cnf.map_paths[file_name])
+            id_index.build_filter(cnf.map_paths[file_name], cnf.unique_col[file_name])
+            print('Filter rebuilt')
+            continue
+        print('Rebuilding index:', cnf.map_paths[file_name])
+        id_index.build_index(cnf.map_paths[file_name], cnf.unique_col[file_name])
+        print('Index rebuilt')
+        if file_name == location_index.DATASET:
+            print('Rebuilding location index:', location_index.get_index_path())
+            location_index.build_index()
+            print('Index rebuilt')
+        if file_name in cnf.quarantine_paths:
+            print('Rebuilding quarantine indexes:', quarantine_store.get_store_path(file_name))
+            quarantine_store.build_indexes(file_name)
+            print('Indexes rebuilt')
@@ -0,0 +1,193 @@
+import pathlib
+import threading
+import logging
+import time
+from transformation.utils import get_file_name
+from work_queue import get_priority
+
+# order in which files of the same date are processed,
+# transactions are checked against customers and products,
+# erasure requests hash customers that arrived the same day
+DATASET_ORDER = ['customers', 'erasure-requests', 'products', 'transactions']
+
+def get_size(path:str) -> int:
+    """Returns size of the file
+    Args:
+        path(str): path to the file
+    Returns:
+        size in bytes, -1 if the file doesn't exist
+    """
+    try:
+        return pathlib.Path(path).stat().st_size
+    except OSError:
+        return -1
+
+def sort_batch(paths:list) -> list:
+    """Sorts files of one date in the order they have to be processed
+    Args:
+        paths(list): paths of the files
+    Returns:
+        sorted list of paths, files of unknown datasets last
+    """
+    def position(path):
+        file_name = get_file_name(path)
+        return DATASET_ORDER.index(file_name) if file_name in DATASET_ORDER else len(DATASET_ORDER)
+    return sorted(paths, key=position)
+
+def split_batch(paths:list) -> list:
+    """Splits sorted files of one date into batches by priority. The first batch
+    ends with the most urgent file, files it has to wait for go with it,
+    eg customers with erasure-requests, then products with transactions
+    Args:
+        paths(list): paths of the files, in the order they have to be processed
+    Returns:
+        list of (paths, priority), processed one after another
+    """
+    batches = []
+    while paths:
+        priorities = [get_priority([path]) for path in paths]
+        priority = min(priorities)
+        end = len(priorities) - priorities[::-1].index(priority)
+        batches.append((paths[:end], priority))
+        paths = paths[end:]
+    return batches
+
+class Scheduler:
+    """Collects files that arrive into date directories (partitions).
+    A partition is passed on once no event came and no file in it changed
+    its size for settle_seconds, so files are fully written and processed
+    in DATASET_ORDER. Its files are passed on in batches by priority,
+    each after the previous one is processed, so erasure requests
+    (with customers of the same date) are queued before transactions of older dates.
+    Ids saved by a batch are kept for the next batches of the date,
+    eg customers are passed to transactions without reading the master file.
+    Batches that don't fit in a full queue wait here and are passed on later
+    """
+    def __init__(self, submit, settle_seconds:float=0.5):
+        """
+        Args:
+            submit(function): takes list of paths, function that has to be called
+                when they are processed, priority, block=False and known_ids,
+                returns False if the batch can't be queued yet
+            settle_seconds(float): how long files of a partition have to stay unchanged
+        """
+        self.submit = submit
+        self.settle_seconds = settle_seconds
+        # partition: {path: [time of the last change, size]}
+        self.pending = {}
+        # partitions with files being processed, next files wait for them
+        self.running = set()
+        # partition: [(paths, priority), ...] batches that weren't passed on yet
+        self.batches = {}
+        # partitions with a batch passed on and not processed yet
+        self.submitted = set()
+        # partition: {dataset: ids} saved by batches of the partition that were processed
+        self.known_ids = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # wakes the scheduler when a batch is processed
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def notify(self, path:str):
+        """Records event for a file, eg created, modified or closed
+        Args:
+            path(str): path of the file
+        """
+        partition = str(pathlib.Path(path).parent)
+        with self.lock:
+            self.pending.setdefault(partition, {})[str(path)] = [time.monotonic(), get_size(path)]
+
+    def get_ready(self, force:bool=False) -> list:
+        """Moves settled partitions from pending to batches
+        Args:
+            force(bool): move all partitions that aren't running, settled or not
+        Returns:
+            list of (partition, paths), oldest date first
+        """
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for partition in sorted(self.pending):
+                if partition in self.running:
+                    continue
+                files = self.pending[partition]
+                settled = True
+                for path, change in files.items():
+                    size = get_size(path)
+                    if size != change[1]:
+                        change[0], change[1] = now, size
+                    if now - change[0] < self.settle_seconds:
+                        settled = False
+                if settled or force:
+                    del self.pending[partition]
+                    paths = sort_batch([path for path in files if get_size(path) >= 0])
+                    if paths:
+                        self.running.add(partition)
+                        self.batches[partition] = split_batch(paths)
+                        self.known_ids[partition] = {}
+                        ready.append((partition, paths))
+        return ready
+
+    def done(self, partition:str):
+        """Lets next batch of the partition be passed on,
+        or next files of the partition be scheduled
+        Args:
+            partition(str): date directory
+        """
+        with self.lock:
+            self.submitted.discard(partition)
+            if not self.batches.get(partition):
+                self.batches.pop(partition, None)
+                self.known_ids.pop(partition, None)
+                self.running.discard(partition)
+        self.wakeup.set()
+
+    def submit_batches(self):
+        """Passes on next batch of each partition, oldest date first,
+        batches that don't fit in the queue stay and are tried again
+        """
+        with self.lock:
+            partitions = [partition for partition in sorted(self.batches) if partition not in self.submitted]
+        for partition in partitions:
+            with self.lock:
+                paths, priority = self.batches[partition].pop(0)
+                self.submitted.add(partition)
+                known_ids = self.known_ids[partition]
+            # done may be called before submit returns
+            if not self.submit(paths, lambda partition=partition: self.done(partition), priority,
+                               block=False, known_ids=known_ids):
+                with self.lock:
+                    self.batches[partition].insert(0, (paths, priority))
+                    self.submitted.discard(partition)
+
+    def dispatch(self, force:bool=False):
+        for partition, paths in self.get_ready(force):
+            logging.info(f"Scheduling {len(paths)} files from {partition}.")
+        self.submit_batches()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.settle_seconds / 2)
+            self.wakeup.clear()
+            try:
+                self.dispatch()
+            except Exception as e:
+                logging.error(f"Error while scheduling files: {e}")
+
+    def stop(self):
+        """Stops checking partitions and passes on everything pending,
+        batches of partitions still running are passed on when they finish
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join()
+        while True:
+            self.dispatch(force=True)
+            with self.lock:
+                if not self.pending and not self.batches:
+                    break
+            time.sleep(self.settle_seconds / 2)
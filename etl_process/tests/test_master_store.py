@@ -0,0 +1,54 @@
+import pathlib
+import tempfile
+import unittest
+
+import pandas as pd
+
+import config.config as cnf
+import ingestion.master_store as master_store
+
+class TestRewrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.map_path = str(pathlib.Path(self.tmp_dir.name) / 'maps' / 'customers_map.json.gz')
+        self.config = {name: getattr(cnf, name) for name in ['compaction_min_segments']}
+        cnf.compaction_min_segments = 100
+        for day in ['01', '02', '03']:
+            source = f'out/2024/01/{day}/customers.json.gz'
+            master_store.append(self.map_path, pd.DataFrame({'id': [int(day)], 'email': [f'{day}@example.com'],
+                                                             'source_location': [source]}))
+
+    def tearDown(self):
+        for name, value in self.config.items():
+            setattr(cnf, name, value)
+        self.tmp_dir.cleanup()
+
+    def test_only_segments_from_sources_are_read(self):
+        read = []
+        def func(df):
+            read.extend(df['id'].tolist())
+            return df.assign(email='hashed'), True
+
+        rewritten = master_store.rewrite(self.map_path, func, ['out/2024/01/02/customers.json.gz'])
+
+        self.assertEqual(rewritten, 1)
+        self.assertEqual(read, [2])
+        df = master_store.read(self.map_path)
+        self.assertEqual(df.set_index('id')['email'].to_dict(),
+                         {1: '01@example.com', 2: 'hashed', 3: '03@example.com'})
+
+    def test_compacted_segment_keeps_sources(self):
+        master_store.compact(self.map_path)
+        read = []
+        def func(df):
+            read.extend(df['id'].tolist())
+            return df, False
+
+        master_store.rewrite(self.map_path, func, ['out/2024/01/03/customers.json.gz'])
+        master_store.rewrite(self.map_path, func, ['out/2024/01/04/customers.json.gz'])
+
+        self.assertEqual(sorted(read), [1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
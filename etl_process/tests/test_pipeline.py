@@ -0,0 +1,44 @@
+import pathlib
+import tempfile
+import unittest
+
+import config.config as cnf
+import benchmarks.generator as generator
+import ingestion.processed_files as processed_files
+from pipeline import prefetch
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp_dir.name)
+        self.config = {name: getattr(cnf, name) for name in ['processed_manifest_path', 'reprocess_changed_files']}
+        cnf.processed_manifest_path = str(root / 'maps' / 'processed_files.sqlite')
+        self.paths = {}
+        for status in ['new', 'processed', 'changed']:
+            path = root / 'in' / '2024' / '01' / status / 'customers.json.gz'
+            generator.write_json_gz(path, [{'id': 1}])
+            self.paths[status] = str(path)
+        processed_files.record(self.paths['processed'], [])
+        processed_files.record(self.paths['changed'], [])
+        generator.write_json_gz(self.paths['changed'], [{'id': 1}, {'id': 2}])
+
+    def tearDown(self):
+        for name, value in self.config.items():
+            setattr(cnf, name, value)
+        self.tmp_dir.cleanup()
+
+    def read(self) -> list:
+        """Returns statuses of the files that were read ahead"""
+        paths = {path: status for status, path in self.paths.items()}
+        return sorted(paths[path] for path, chunks in prefetch(list(paths), 2) if chunks is not None)
+
+    def test_skipped_files_are_not_read(self):
+        self.assertEqual(self.read(), ['new'])
+
+    def test_changed_files_are_read_if_reprocessed(self):
+        cnf.reprocess_changed_files = True
+        self.assertEqual(self.read(), ['changed', 'new'])
+
+if __name__ == '__main__':
+    unittest.main()
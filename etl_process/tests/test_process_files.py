@@ -0,0 +1,92 @@
+import pathlib
+import tempfile
+import unittest
+
+import config.config as cnf
+import benchmarks.generator as generator
+import ingestion.master_store as master_store
+import ingestion.quarantine_store as quarantine_store
+from ingestion.read_write import read_data
+from transformation import process_files
+from transformation.utils import get_output_path
+
+class TestChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp_dir.name)
+        self.config = {name: getattr(cnf, name) for name in
+                       ['input_root', 'output_root', 'map_paths', 'quarantine_paths', 'processed_manifest_path',
+                        'chunk_size', 'pipeline_enabled']}
+        cnf.input_root = str(root / 'in')
+        cnf.pipeline_enabled = False
+        self.use_root(root)
+
+    def use_root(self, root:pathlib.Path):
+        """Saves outputs, master and quarantine files under root"""
+        cnf.output_root = str(root / 'out')
+        cnf.map_paths = {name: str(root / 'maps' / f'{name}_map.json.gz') for name in self.config['map_paths']}
+        cnf.quarantine_paths = {name: str(root / 'quarantine' / f'{name}.json.gz') for name in self.config['quarantine_paths']}
+        cnf.processed_manifest_path = str(root / 'maps' / 'processed_files.sqlite')
+
+    def tearDown(self):
+        for name, value in self.config.items():
+            setattr(cnf, name, value)
+        self.tmp_dir.cleanup()
+
+    def write_customers(self, ids:list) -> str:
+        path = pathlib.Path(cnf.input_root) / '2024' / '01' / '01' / 'customers.json.gz'
+        generator.write_json_gz(path, [{'id': i, 'first_name': f'first {i}', 'last_name': f'last {i}',
+                                        'email': f'customer{i}@example.com'} for i in ids])
+        return str(path)
+
+    def test_duplicate_id_in_another_chunk(self):
+        # id 5 is in the first and in the third chunk
+        cnf.chunk_size = 50
+        input_path = self.write_customers(list(range(120)) + [5])
+
+        process_files.process_file(input_path)
+
+        df = read_data(get_output_path(input_path))
+        self.assertEqual(len(df), 120)
+        self.assertFalse(df['id'].duplicated().any())
+        master = master_store.read(cnf.map_paths['customers'])
+        self.assertEqual(sorted(master['id'].tolist()), list(range(120)))
+        df_quarantine = quarantine_store.read('customers')
+        self.assertEqual(df_quarantine['id'].tolist(), [5])
+        self.assertEqual(df_quarantine[quarantine_store.REASON_COLUMN].tolist(), [quarantine_store.DUPLICATE_ID])
+
+    def process(self, input_path:str, root:pathlib.Path, chunk_size:int=None) -> dict:
+        """Processes the file into root, returns its outputs sorted by id"""
+        self.use_root(root)
+        cnf.chunk_size = chunk_size
+        process_files.process_file(input_path)
+        file_name = 'customers'
+        col_name = cnf.unique_col[file_name]
+        df_quarantine = quarantine_store.read(file_name)
+        return {
+            'output': read_data(get_output_path(input_path)).sort_values(col_name).reset_index(drop=True),
+            'master': sorted(master_store.read(cnf.map_paths[file_name])[col_name].tolist()),
+            # missing ids are read as empty strings
+            'quarantine': sorted(zip(df_quarantine[col_name].astype(str).tolist(),
+                                     df_quarantine[quarantine_store.REASON_COLUMN].tolist())),
+        }
+
+    def test_chunks_match_whole_file(self):
+        # generator's duplicates are added at the end of the file, in another chunk than the first rows
+        paths = generator.generate_tree(cnf.input_root, row_count=500)
+        input_path = str(next(path for path in paths if path.name == 'customers.json.gz'))
+        ids = read_data(input_path)['id']
+        self.assertTrue(ids[ids.duplicated()].isin(ids[:100]).any())
+        root = pathlib.Path(self.tmp_dir.name)
+
+        whole = self.process(input_path, root / 'whole')
+        chunked = self.process(input_path, root / 'chunked', chunk_size=100)
+
+        self.assertTrue(any(reason == quarantine_store.DUPLICATE_ID for _, reason in whole['quarantine']))
+        self.assertTrue(chunked['output'].equals(whole['output']))
+        self.assertEqual(chunked['master'], whole['master'])
+        self.assertEqual(chunked['quarantine'], whole['quarantine'])
+
+if __name__ == '__main__':
+    unittest.main()
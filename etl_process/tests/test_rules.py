@@ -0,0 +1,56 @@
+import pathlib
+import tempfile
+import unittest
+
+import pandas as pd
+
+import config.config as cnf
+import benchmarks.generator as generator
+import ingestion.quarantine_store as quarantine_store
+from ingestion.read_write import read_gzip_json
+from transformation import rules
+import transformation.transformations as t
+
+class TestRules(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp_dir.name)
+        self.config = {name: getattr(cnf, name) for name in
+                       ['input_root', 'output_root', 'map_paths', 'quarantine_paths', 'processed_manifest_path']}
+        cnf.input_root = str(root / 'in')
+        cnf.output_root = str(root / 'out')
+        cnf.map_paths = {name: str(root / 'maps' / f'{name}_map.json.gz') for name in self.config['map_paths']}
+        cnf.quarantine_paths = {name: str(root / 'quarantine' / f'{name}.json.gz') for name in self.config['quarantine_paths']}
+        cnf.processed_manifest_path = str(root / 'maps' / 'processed_files.sqlite')
+
+    def tearDown(self):
+        for name, value in self.config.items():
+            setattr(cnf, name, value)
+        self.tmp_dir.cleanup()
+
+    def test_empty_positive_values_are_missing_fields(self):
+        # generator's default na_ratio empties price and popularity of some products
+        paths = generator.generate_tree(cnf.input_root)
+        input_path = str(next(path for path in paths if path.name == 'products.json.gz'))
+        df = read_gzip_json(input_path)
+        empty = df[['price', 'popularity']].isin(['']).any(axis=1) | df[['price', 'popularity']].isna().any(axis=1)
+        self.assertTrue(empty.any())
+
+        df_valid, df_quarantine = rules.apply_rules('products', input_path, df)
+
+        self.assertEqual(len(df_valid) + len(df_quarantine), len(df))
+        reasons = df_quarantine[quarantine_store.REASON_COLUMN]
+        self.assertTrue((reasons[empty[empty].index] == quarantine_store.MISSING_FIELDS).all())
+        self.assertFalse(empty[df_valid.index].any())
+
+class TestNonPositiveMask(unittest.TestCase):
+
+    def test_values_that_are_not_numbers(self):
+        df = pd.DataFrame({'price': [1.5, '', 'abc', None, '2', 0, -1, '3'],
+                           'popularity': [0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, '']})
+        self.assertEqual(t.non_positive_mask(df, ['price', 'popularity']).tolist(),
+                         [False, True, True, True, False, True, True, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,139 +1,219 @@
-import pandas as pd
-import hashlib
-
-def get_dict(filter_list:list, field_name:str, df_map:pd.DataFrame) -> dict:
-    """For a given list of ids/emails returns a dict
-    with file locations for each of them,
-    {cust_id1: location1,
-    cust_id2: location2, ...}
-    Args:
-        filter_list(list): values to filter
-        field_name(str): name of the id to filter by
-        df_map(pd.DataFrame): dataframe with customers ids/emails
-            and their file locations
-    Returns:
-        A dictionary with file locations for each id/email
-    """
-    # filter by field_name
-    df = df_map[df_map[field_name].isin(filter_list)]
-    # convert to dict
-    loc_dict = df[[field_name, 'source_location']].set_index(field_name).T.to_dict()
-    return loc_dict
-
-def get_locations(df_erasure:pd.DataFrame, df_map:pd.DataFrame, df_quarantine:pd.DataFrame) -> dict:
-    """For a given erasure request returns a dict
-    with file locations for each customer,
-    {'id': {cust_id1: location1, cust_id2: location2, ...},
-    'email': {email1: location1, email2: location2, ...}}
-    where key 'email' contains requests that contained only email address
-    Args:
-        df_erasure(pd.DataFrame): dataframe with erasure request
-        df_map(pd.DataFrame): dataframe with aggregated customers ids and emails,
-            and location of the file where they are saved
-        df_quarantine(pd.DataFrame): dataframe with quarantined rows
-    Returns:
-        A dictionary with file locations for each id/email
-    """
-    # requests only with a given email
-    df_email = df_erasure[df_erasure['customer-id'].isna()]
-    emails = df_email['email'].to_list()
-
-    # requests only with a given customer id
-    df_customer = df_erasure[df_erasure['email'].isna()]
-    ids = df_customer['customer-id'].to_list()
-
-    # requests with customer id and email populated
-    df_both = df_erasure[~df_erasure['customer-id'].isna() & ~df_erasure['email'].isna()]
-
-    # filter for the records where both id and email match
-    df_map = pd.concat([df_map, df_quarantine])
-    merged_df = pd.merge(df_map, df_both,
-                        left_on=['id','email'],
-                        right_on=['customer-id','email'],
-                        how='inner')
-    ids_both = merged_df['customer-id'].to_list()
-
-    # combine lists with customee ids
-    ids.extend(ids_both)
-
-    # save all in dict
-    dict_loc = {}
-    dict_loc['id'] = get_dict(ids, 'id', df_map)
-    dict_loc['email'] = get_dict(emails, 'email', df_map)
-
-    return dict_loc
-
-def hash_data(data:str):
-    """Hashes given data
-    Args:
-        data(str): data to hash
-    Returns:
-        hex representation of the hash
-    """
-    # data to bytes
-    if not isinstance(data, bytes):
-        data = str(data).encode()
-
-    # reate new hash object
-    hash_object = hashlib.sha256()
-    hash_object.update(data)
-
-    # return hex representation of the hash
-    return hash_object.hexdigest()
-
-def hash_per_id(row:list, id_field_name:str,
-                id_to_hash:str, hash_field_name:str):
-    """Hashes field only for a given id
-    Args:
-        row(list): row in a dataframe
-        id_field_name(str): name of the field that determines
-            if data should be hashed (customer id or email)
-        id_to_hash(str): value of id_field_name for each
-            data should be hashed
-        hash_field_name(str): field to hash
-    Returns:
-        Hashed value
-    """
-    if row[id_field_name] == id_to_hash:
-        return hash_data(row[hash_field_name])
-    else:
-        return row[hash_field_name]
-    
-def hash_df(df:pd.DataFrame, id_field_name:str, id_to_hash:str,
-            hash_field_name_list:list):
-    """Hashes fields only for a given id
-    Args:
-        df(pd.DataFrame): dataframe containing data
-            that needs to be hashed
-        id_field_name(str): name of the field that determines
-            if data should be hashed (customer id or email)
-        id_to_hash(str): value of id_field_name for each
-            data should be hashed
-        hash_field_name_list(str): list fields to hash
-    Returns:
-        Dataframe with hashed values
-    """
-    for hash_field_name in hash_field_name_list:
-        df[hash_field_name] = df.apply(lambda row: hash_per_id(row, id_field_name, id_to_hash, hash_field_name), axis=1)
-    return df
-
-def missed_requests(df_erasure:pd.DataFrame, dict_loc:dict):
-    """Some requests could have been missed,
-    for example if email wasn't consistent with id,
-    or it was repetitive request.
-    Finds missed request and prints a 'warning'
-    Args:
-        df_erasure(pd.DataFrame): data with requests
-        dict_loc(dict):dict with all request that will be processed
-    """
-    ids = df_erasure['customer-id'].to_list()
-
-    df_email = df_erasure[df_erasure['customer-id'].isna()]
-    emails = df_email['email'].to_list()
-
-    missed_ids = [id for id in ids if id not in dict_loc['id'].keys()]
-    missed_emails = [email for email in emails if email not in dict_loc['email'].keys()]
-    if missed_ids or missed_emails:
-        df_erasure = df_erasure[df_erasure['customer-id'].isin(missed_ids) | df_erasure['email'].isin(missed_emails)]
-        return f'Following erasure requests were not processed: {df_erasure.values.tolist()}'
-    return False
+import pandas as pd
+import hashlib
+import re
+import ingestion.location_index as location_index
+
+def get_locations(df_erasure:pd.DataFrame) -> dict:
+    """For a given erasure request returns a dict
+    with file locations for each customer, found in the location index,
+    {'id': {cust_id1: {'source_location': [location1, ...], 'master': True, 'quarantine': False}, ...},
+    'email': {email1: {'source_location': [location1, ...], 'master': True, 'quarantine': False}, ...}}
+    where key 'email' contains requests that contained only email address,
+    'master' and 'quarantine' tell if customer was found in the master or quarantine file
+    Args:
+        df_erasure(pd.DataFrame): dataframe with erasure request
+    Returns:
+        A dictionary with file locations for each id/email
+    """
+    # requests only with a given email
+    df_email = df_erasure[df_erasure['customer-id'].isna()]
+    emails = df_email['email'].to_list()
+
+    # requests only with a given customer id
+    df_customer = df_erasure[df_erasure['email'].isna()]
+    ids = df_customer['customer-id'].to_list()
+
+    # requests with customer id and email populated, both have to match
+    df_both = df_erasure[~df_erasure['customer-id'].isna() & ~df_erasure['email'].isna()]
+    pairs = list(zip(df_both['customer-id'].to_list(), df_both['email'].to_list()))
+
+    found = location_index.find(ids, emails, pairs)
+
+    # save all in dict
+    dict_loc = {'id': {}, 'email': {}}
+    for col_name in ['id', 'email']:
+        for id_email_val, location, quarantine in found[col_name]:
+            loc = dict_loc[col_name].setdefault(id_email_val, {'source_location': [], 'master': False, 'quarantine': False})
+            # quarantined rows aren't in the output files, their partitions are found by erasure
+            if not quarantine and location not in loc['source_location']:
+                loc['source_location'].append(location)
+            loc['quarantine' if quarantine else 'master'] = True
+
+    return dict_loc
+
+def hash_data(data:str):
+    """Hashes given data
+    Args:
+        data(str): data to hash
+    Returns:
+        hex representation of the hash
+    """
+    # data to bytes
+    if not isinstance(data, bytes):
+        data = str(data).encode()
+
+    # reate new hash object
+    hash_object = hashlib.sha256()
+    hash_object.update(data)
+
+    # return hex representation of the hash
+    return hash_object.hexdigest()
+
+def get_targets(dict_loc:dict) -> dict:
+    """Groups ids and emails from the erasure requests
+    by the file they were found in,
+    {location1: {'id': [cust_id1, ...], 'email': [email1, ...]}, ...}
+    so each file can be hashed in one pass
+    Args:
+        dict_loc(dict): dict with file locations for each id/email,
+            returned by get_locations
+    Returns:
+        A dictionary with ids and emails for each file location
+    """
+    targets = {}
+    for col_name in ['id', 'email']:
+        for id_email_val, loc in dict_loc[col_name].items():
+            # customer can be saved in more than one file
+            for location in loc['source_location']:
+                target = targets.setdefault(location, {'id': [], 'email': []})
+                target[col_name].append(id_email_val)
+    return targets
+
+def get_mask(df:pd.DataFrame, ids:list, emails:list,
+             id_field_name:str='id', email_field_name:str='email') -> pd.Series:
+    """Marks rows that belong to any of the given customers
+    Args:
+        df(pd.DataFrame): data with customers
+        ids(list): customer ids to find
+        emails(list): emails to find
+        id_field_name(str): name of the column with customer id
+        email_field_name(str): name of the column with email
+    Returns:
+        boolean series, True for rows that should be hashed
+    """
+    mask = pd.Series(False, index=df.index)
+    if id_field_name in df.columns:
+        mask |= df[id_field_name].isin(ids)
+    if email_field_name in df.columns:
+        mask |= df[email_field_name].isin(emails)
+    return mask
+
+def hash_masked(df:pd.DataFrame, mask:pd.Series, hash_field_name_list:list) -> pd.DataFrame:
+    """Hashes fields only in the rows selected by the mask
+    Args:
+        df(pd.DataFrame): dataframe containing data
+            that needs to be hashed
+        mask(pd.Series): boolean series, True for rows to hash
+        hash_field_name_list(list): list of fields to hash
+    Returns:
+        Dataframe with hashed values
+    """
+    if not mask.any():
+        return df
+    for hash_field_name in hash_field_name_list:
+        if hash_field_name in df.columns:
+            df[hash_field_name] = df[hash_field_name].astype(object)
+            df.loc[mask, hash_field_name] = df.loc[mask, hash_field_name].map(hash_data)
+    return df
+
+def hash_requests(df:pd.DataFrame, ids:list, emails:list,
+                  hash_field_name_list:list, id_field_name:str='id'):
+    """Hashes fields in the rows of the requested customers
+    Args:
+        df(pd.DataFrame): data with customers
+        ids(list): customer ids to hash
+        emails(list): emails to hash
+        hash_field_name_list(list): list of fields to hash
+        id_field_name(str): name of the column with customer id
+    Returns:
+        Dataframe with hashed values, and True if any row was hashed
+    """
+    mask = get_mask(df, ids, emails, id_field_name=id_field_name)
+    return hash_masked(df, mask, hash_field_name_list), bool(mask.any())
+
+def is_plain(value) -> bool:
+    """Checks if value is written the same way by every json writer,
+    eg emails without quotes, slashes and non ascii characters
+    Args:
+        value: id or email
+    Returns:
+        True if the value can be searched for in json text
+    """
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    return isinstance(value, str) and value != '' and all(' ' <= char <= '~' and char not in '"\\/' for char in value)
+
+def get_line_filter(ids:list, emails:list, id_field_name:str='id', email_field_name:str='email'):
+    """Returns function that finds json lines which may belong to the requested customers,
+    without parsing them. Lines without any of the ids or emails in the id or email field
+    are skipped, the rest is parsed and checked by hash_record
+    Args:
+        ids(list): customer ids to find
+        emails(list): emails to find
+        id_field_name(str): name of the field with customer id
+        email_field_name(str): name of the field with email
+    Returns:
+        function that takes line as bytes and returns True if it has to be parsed
+    """
+    ids = [int(i) if isinstance(i, float) and i.is_integer() else i for i in ids if pd.notna(i)]
+    emails = [email for email in emails if pd.notna(email)]
+    if not all(is_plain(value) for value in ids + emails):
+        # eg escaped characters, every line is parsed
+        return lambda line: True
+    if not ids and not emails:
+        return lambda line: False
+
+    # eg "id":12 (not "id":123), "id":"12" or "email":"a@b.com", with or without spaces
+    patterns = []
+    for field_name, values in [(id_field_name, ids), (email_field_name, emails)]:
+        for value in values:
+            if isinstance(value, int):
+                value = f'{value}(?![0-9])'
+            else:
+                value = '"' + re.escape(value) + '"'
+            patterns.append('"' + re.escape(field_name) + r'"\s*:\s*' + value)
+    pattern = re.compile('|'.join(patterns).encode('UTF-8'))
+    return lambda line: pattern.search(line) is not None
+
+def hash_record(record:dict, ids:set, emails:set, hash_field_name_list:list,
+                id_field_name:str='id', email_field_name:str='email'):
+    """Hashes fields of a single record (json line) if it belongs to the requested customers
+    Args:
+        record(dict): parsed json line
+        ids(set): customer ids to hash
+        emails(set): emails to hash
+        hash_field_name_list(list): list of fields to hash
+        id_field_name(str): name of the field with customer id
+        email_field_name(str): name of the field with email
+    Returns:
+        record with hashed values, None if it doesn't belong to any of the customers
+    """
+    if record.get(id_field_name) not in ids and record.get(email_field_name) not in emails:
+        return None
+    for hash_field_name in hash_field_name_list:
+        if hash_field_name in record:
+            record[hash_field_name] = hash_data(record[hash_field_name])
+    return record
+
+def missed_requests(df_erasure:pd.DataFrame, dict_loc:dict):
+    """Some requests could have been missed,
+    for example if email wasn't consistent with id,
+    or it was repetitive request.
+    Finds missed request and prints a 'warning'
+    Args:
+        df_erasure(pd.DataFrame): data with requests
+        dict_loc(dict):dict with all request that will be processed
+    """
+    ids = df_erasure['customer-id'].to_list()
+
+    df_email = df_erasure[df_erasure['customer-id'].isna()]
+    emails = df_email['email'].to_list()
+
+    missed_ids = [id for id in ids if id not in dict_loc['id'].keys()]
+    missed_emails = [email for email in emails if email not in dict_loc['email'].keys()]
+    if missed_ids or missed_emails:
+        df_erasure = df_erasure[df_erasure['customer-id'].isin(missed_ids) | df_erasure['email'].isin(missed_emails)]
+        return f'Following erasure requests were not processed: {df_erasure.values.tolist()}'
+    return False
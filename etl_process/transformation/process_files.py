@@ -1,211 +1,627 @@
-import pandas as pd
-from ingestion.read_write import read_gzip_json, write_gzip_json, append_gzip_json
-import transformation.transformations as t
-import config.config as cnf
-from transformation.utils import get_file_name, get_output_path
-import pathlib
-import transformation.erasure_functions as ef
-import logging
-
-def append_ids(input_path:str, data:pd.DataFrame, quarantine:bool=False):
-    """Appends master file with all ids,
-    and locations of the files in which they appeared
-    Args:
-        input_path(str): path of the file thta just arrived
-        data(pd.DataFrame): data from the file that just arrived
-        quarantine(bool): if appending quarantine file (True) or master file (False)
-    """
-    # get name of the file from path, eg customers
-    file_name = get_file_name(input_path)
-
-    # get path to the master file with ids and files locations
-    if quarantine:
-        map_path = pathlib.Path(cnf.quarantine_paths[file_name])
-    else:
-        map_path = pathlib.Path(cnf.map_paths[file_name])
-
-    # create df with eg customer_id, email, file_location for the current file
-    output_path = get_output_path(input_path)
-    if quarantine:
-        data = t.source_location_map(data, source=output_path)
-    else:
-        data = t.source_location_map(data, cnf.map_columns[file_name], output_path)
-
-    # append the master file
-    if map_path.is_file():
-        append_gzip_json(map_path, data)
-    else:
-        write_gzip_json(map_path, data)
-
-def process_data(file_name:str, input_path:str, output_path:str=None):
-    """Process customers, products or transformations files,
-    and saved them in different location
-    Args:
-        file_name(str): file name that arrived
-        input_path(str): path of the file thta just arrived
-        output__path(str): path where transformed file should be saved
-    """
-    try:
-        if output_path is None:
-            output_path = get_output_path(input_path)
-
-        # read data into pandas df
-        df = read_gzip_json(input_path)
-        row_count = len(df)
-        logging.info(f"Processing {input_path}, read in {row_count} rows.")
-
-        # remove rows where fields that should be populated are not
-        df, df_quarantine = t.remove_rows_with_na(df, cnf.not_empty_cols[file_name])
-        row_count_empty = len(df)
-        if row_count - row_count_empty:
-            logging.info(f"{row_count - row_count_empty} rows were missing data in {cnf.not_empty_cols[file_name]}.")
-
-        # remove rows with ids that already existed
-        df = t.remove_id_dups(df, cnf.map_paths[file_name], cnf.unique_col[file_name])
-        row_count_id_dups = len(df)
-        if row_count_empty - row_count_id_dups:
-            logging.info(f"{row_count_empty - row_count_id_dups} rows contained non unique id.")
-
-        # remove rows with negative values
-        if file_name == 'products':
-            df = t.keep_positive_vals(df, cnf.positive_col[file_name])
-            row_count_pos = len(df)
-            if row_count_id_dups - row_count_pos:
-                logging.info(f"{row_count_id_dups - row_count_pos} rows removed as contained negative values in {cnf.positive_col[file_name]}.")
-
-        # remove transactions where total cost doesn't match
-        if file_name == 'transactions':
-
-            # remove rows where total cost is wrong
-            df, df_q = t.total_cost_check(df)
-            row_count_cost = len(df)
-            if row_count_id_dups - row_count_cost:
-                logging.info(f"{row_count_id_dups - row_count_cost} rows removed as total cost didn't match.")
-
-            df_quarantine = pd.concat([df_quarantine, df_q])
-
-            # check if products or customers arrived at the same time,
-            # in this case they could be missing from master file, get them separately
-
-            current_path = pathlib.Path(input_path).parent
-
-            file_path = pathlib.Path(current_path, 'products.json.gz')
-            if file_path.is_file():
-                df = t.id_exists_check(df, 'sku', 'products', file_path)
-        
-            file_path = pathlib.Path(current_path, 'customers.json.gz')
-            if file_path.is_file():
-                df = t.id_exists_check(df, 'customer_id', 'customers', file_path)
-
-            row_count_ids = len(df)
-            if row_count_cost - row_count_ids:
-                logging.info(f"{row_count_cost - row_count_ids} rows had customer_id and sku that didn't match the rest of the dataset.")
-
-        row_count_final = len(df)
-        # append file with ids
-        append_ids(input_path, df)
-        logging.info(f"{row_count_final} rows appended to master file with ids.")
-
-        # append quarantine file
-        if not df_quarantine.empty:
-            append_ids(input_path, df_quarantine, quarantine=True)
-            logging.info(f"{len(df_quarantine)} rows appended to quarantine file.")
-
-        # save processed file
-        write_gzip_json(output_path, df)
-        logging.info(f"{row_count_final} rows written to {output_path}.")
-
-    except Exception as e:
-        logging.error(f"Error while processing {input_path}: {e}")
-
-def erasure(input_path:str, output_path:str=None):
-    """Hashes data of the customer from the erasure-requests file
-    Args:
-        input_path(str): path of the file thta just arrived
-        output__path(str): path where transformed file should be saved
-    """
-    try:
-        if output_path is None:
-            output_path = get_output_path(input_path)
-
-        df_erasure = read_gzip_json(input_path)
-
-        # remove rows where both fields are empty
-        df_erasure = df_erasure.dropna(how='all')
-        row_count = len(df_erasure)
-        logging.info(f"Processing {row_count} erasure requests.")
-
-        # load customer id master file
-        if pathlib.Path(cnf.map_paths['customers']).is_file():
-            map_path = pathlib.Path(cnf.map_paths['customers'])
-            customers_df = read_gzip_json(map_path)
-        else:
-            customers_df = pd.DataFrame()
-
-        # load customer quarantined file
-        quarantine_path = pathlib.Path(cnf.quarantine_paths['customers'])
-        quarantine_master_df = read_gzip_json(quarantine_path)
-
-        # dict with ids from erasure requests and file locations
-        dict_loc = ef.get_locations(df_erasure, customers_df, quarantine_master_df)
-
-        # hash per customer id, and then by email if only email was available
-        for col_name in ['id', 'email']:
-            for id_email_val, loc in dict_loc[col_name].items():
-                # read transformed file
-                df = read_gzip_json(loc['source_location'])
-        
-                # hash data
-                df = ef.hash_df(df, col_name, id_email_val, cnf.anonymisation)
-
-                # hash in map file
-                customers_df = ef.hash_df(customers_df, col_name, id_email_val, ['email'])
-
-                # hash in quarantine file
-                quarantine_master_df = ef.hash_df(quarantine_master_df, col_name, id_email_val, cnf.anonymisation)
-
-                # hash in erasure file
-                col_name_erasure = 'customer-id' if col_name == 'id' else col_name
-                df_erasure = ef.hash_df(df_erasure, col_name_erasure, id_email_val, ['email'])
-        
-                # save transformed customers.json.gz with hashed data
-                write_gzip_json(loc['source_location'], df)
-                logging.info(f"A request hashed in {loc['source_location']}.")
-
-        # save file with all customer ids, emails and file locations, with hashed data
-        write_gzip_json(map_path, customers_df)
-        logging.info(f"Requests hashed in {map_path}.")
-
-        # save quarantined records with hashed data
-        write_gzip_json(quarantine_path, quarantine_master_df)
-        logging.info(f"Requests hashed in {quarantine_path}.")
-
-        # save erasure request file, with hashed data
-        write_gzip_json(output_path, df_erasure)
-        logging.info(f"Requests hashed in {output_path}.")
-
-        # log missed request, eg in case email didn't match id or it was a repetitive request
-        missed = ef.missed_requests(df_erasure, dict_loc)
-        if missed:
-            logging.warning(missed)
-
-    except Exception as e:
-        logging.error(f"Error while processing {input_path}: {e}")
-
-def process_file(input_path:str, output_path:str=None):
-    """Based on the name of the file that arrived,
-    transforms data or does erasure request
-    Args:
-        input_path(str): path of the file thta just arrived
-        output__path(str): path where transformed file should be saved
-    """
-    if output_path is None:
-        output_path = get_output_path(input_path)
-
-    # get file name - 'customers', 'transactions' etc
-    file_name = get_file_name(input_path)
-
-    if file_name in ['customers', 'products', 'transactions']:
-        process_data(file_name, input_path, output_path)
-    elif file_name == 'erasure-requests':
-        erasure(input_path, output_path)
\ No newline at end of file
+import pandas as pd
+from ingestion.read_write import read_gzip_json, read_gzip_json_chunks, read_data, write_data, append_data, get_storage_path, \
+    stage_gzip_json, stage_data, commit_staged, discard_staged
+import transformation.transformations as t
+import transformation.rules as rules
+import config.config as cnf
+from transformation.utils import get_file_name, get_output_path, get_line_items_path
+import pathlib
+import functools
+import transformation.erasure_functions as ef
+import ingestion.id_index as id_index
+import ingestion.master_store as master_store
+import ingestion.location_index as location_index
+import ingestion.quarantine_store as quarantine_store
+import ingestion.write_behind as write_behind
+import ingestion.processed_files as processed_files
+from ingestion.append_batch import AppendBatch
+import logging
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
+from config.configure_log import configure_process, get_settings
+import metrics
+import profiling
+
+# pool hashing transformed files during erasure, created on first use
+erasure_executor = None
+erasure_executor_lock = threading.Lock()
+
+def append_ids(input_path:str, data:pd.DataFrame, quarantine:bool=False, batch=None):
+    """Appends master file with all ids,
+    and locations of the files in which they appeared
+    Args:
+        input_path(str): path of the file thta just arrived
+        data(pd.DataFrame): data from the file that just arrived
+        quarantine(bool): if appending quarantine file (True) or master file (False)
+        batch(AppendBatch): if given, rows are added to the batch
+            and appended when it's flushed
+    """
+    # get name of the file from path, eg customers
+    file_name = get_file_name(input_path)
+
+    # create df with eg customer_id, email, file_location for the current file
+    output_path = get_output_path(input_path)
+    if quarantine:
+        data = t.source_location_map(data, source=output_path)
+    else:
+        data = t.source_location_map(data, cnf.map_columns[file_name], output_path)
+
+    if batch is not None:
+        batch.add(file_name, input_path, data, quarantine)
+    else:
+        write_ids(file_name, input_path, data, quarantine, id_index.get_owner(input_path))
+
+def write_ids(file_name:str, input_path:str, data:pd.DataFrame, quarantine:bool=False, owner:str=None):
+    """Appends rows with ids and file locations to the master file, or quarantined
+    rows to the partition of the date they arrived
+    Args:
+        file_name(str): file name that arrived, eg customers
+        input_path(str): path of the file the rows are from
+        data(pd.DataFrame): rows created by append_ids
+        quarantine(bool): if appending quarantine file (True) or master file (False)
+        owner(str): reservations of this owner are removed, as the ids are saved
+    """
+    # append the quarantine partition, it's shared with other workers and processes
+    if quarantine:
+        partition = quarantine_store.get_partition(input_path)
+        write_paths = [quarantine_store.get_partition_path(file_name, partition)]
+        with metrics.Stage('quarantine_append', input_path, write_paths=write_paths, append=True) as stage:
+            with location_index.keep_in_sync(file_name, data, quarantine=True):
+                quarantine_store.append(file_name, partition, data)
+            stage.rows(len(data), len(data))
+    else:
+        # append the master file, new ids are added to the index as well
+        map_path = pathlib.Path(cnf.map_paths[file_name])
+        col_name = cnf.unique_col[file_name]
+        with metrics.Stage('master_append', input_path, write_paths=[master_store.get_store_path(map_path)], append=True) as stage:
+            with id_index.keep_in_sync(map_path, col_name, data[col_name].tolist(), owner), \
+                 location_index.keep_in_sync(file_name, data):
+                master_store.append(map_path, data)
+            stage.rows(len(data), len(data))
+
+def flush_batch(batch):
+    """Appends rows collected in the batch, one append
+    of each master and quarantine file
+    Args:
+        batch(AppendBatch): collected rows
+    """
+    for file_name, quarantine, input_path, data in batch.take():
+        write_ids(file_name, input_path, data, quarantine)
+        logging.info(f"{len(data)} rows appended to {'quarantine' if quarantine else 'master'} file of {file_name}.")
+
+    # files are recorded as processed once their ids are saved,
+    # it may run in the writer thread, so it's recorded right away
+    for input_path, outputs in batch.take_processed():
+        processed_files.record(input_path, outputs)
+
+def transform_data(file_name:str, input_path:str, df:pd.DataFrame, known_ids:dict=None, context:dict=None):
+    """Quarantines rows that are missing data, have ids that already existed,
+    or fail checks specific for the dataset, with the reason of each row
+    Args:
+        file_name(str): file name that arrived
+        input_path(str): path of the file thta just arrived
+        df(pd.DataFrame): data from the file, or a chunk of it
+        known_ids(dict): ids saved from files processed just before, per dataset,
+            eg {'customers': {1, 2}}, used to check transactions and as existing ids
+        context(dict): context of the rules, eg with products flattened by the rules
+    Returns:
+        dataframe with rows that passed all checks,
+        and dataframe with quarantined rows
+    """
+    return rules.apply_rules(file_name, input_path, df, known_ids, context)
+
+def has_line_items(file_name:str) -> bool:
+    """Checks if line items are saved for the dataset
+    Args:
+        file_name(str): file name that arrived
+    Returns:
+        True for transactions with line_items_enabled set
+    """
+    return cnf.line_items_enabled and file_name == 'transactions'
+
+def get_line_items(input_path:str, df:pd.DataFrame, context:dict) -> pd.DataFrame:
+    """Flattens purchases of transactions that passed all checks into line items,
+    products flattened by the rules are reused, so purchases are parsed once
+    Args:
+        input_path(str): path of the file thta just arrived
+        df(pd.DataFrame): transactions that passed all checks
+        context(dict): context of the rules
+    Returns:
+        dataframe with one row per product bought
+    """
+    with metrics.Stage('line_items', input_path) as stage:
+        items = t.line_items(df, rules.get_items(df, context))
+        stage.rows(len(df), len(items))
+    return items
+
+def run_write(func, *args):
+    """Runs function that writes data, with pipeline enabled in the writer thread,
+    in the order it was submitted
+    Args:
+        func(function): function that writes data, eg write_output
+        args: arguments of the function
+    """
+    if cnf.pipeline_enabled:
+        write_behind.submit(func, *args)
+    else:
+        func(*args)
+
+def write_output(output_path:str, input_path:str, df:pd.DataFrame, staged:dict):
+    """Saves processed data to a temporary file, next chunks are appended to it,
+    the output is replaced with it by commit_outputs once the whole file is processed
+    Args:
+        output_path(str): path where transformed file should be saved
+        input_path(str): path of the file thta just arrived
+        df(pd.DataFrame): processed data
+        staged(dict): temporary files of the outputs of the file, {output path: temporary file},
+            None for outputs whose chunk failed
+    """
+    append = output_path in staged
+    # a chunk before failed, the output won't be saved
+    if append and staged[output_path] is None:
+        return
+    with metrics.Stage('write', input_path, write_paths=[output_path], append=append) as stage:
+        try:
+            staged[output_path] = stage_data(output_path, df, staged.get(output_path))
+        except BaseException:
+            if staged.get(output_path) is not None:
+                discard_staged(staged[output_path])
+            staged[output_path] = None
+            raise
+        stage.rows(len(df), len(df))
+        stage.memory(df=df)
+    logging.info(f"{len(df)} rows written to {output_path}.")
+
+def discard_outputs(staged:dict):
+    """Removes temporary files of the outputs of a file
+    Args:
+        staged(dict): temporary files from write_output
+    """
+    for tmp_path in staged.values():
+        if tmp_path is not None:
+            discard_staged(tmp_path)
+
+def commit_outputs(input_path:str, staged:dict) -> bool:
+    """Replaces outputs of a file with the temporary files its chunks were written to.
+    If writing any chunk failed, no output is replaced, so the file is saved whole or not at all
+    Args:
+        input_path(str): path of the file thta just arrived
+        staged(dict): temporary files from write_output
+    Returns:
+        True if the outputs were replaced
+    """
+    if None in staged.values():
+        discard_outputs(staged)
+        logging.error(f"Outputs of {input_path} weren't saved, writing some of its rows failed.")
+        return False
+    for output_path, tmp_path in staged.items():
+        commit_staged(output_path, tmp_path)
+    return True
+
+def save_data(input_path:str, output_path:str, df:pd.DataFrame,
+              df_quarantine:pd.DataFrame, staged:dict, known_ids:dict=None, batch=None,
+              items:pd.DataFrame=None):
+    """Appends master and quarantine files and saves processed data
+    Args:
+        input_path(str): path of the file thta just arrived
+        output_path(str): path where transformed file should be saved
+        df(pd.DataFrame): processed data
+        df_quarantine(pd.DataFrame): quarantined rows
+        staged(dict): temporary files of the outputs, see write_output
+        known_ids(dict): ids saved per dataset, new ids are added to it
+        batch(AppendBatch): if given, master and quarantine rows are collected in it
+        items(pd.DataFrame): line items of the processed data, saved next to it if given
+    """
+    row_count_final = len(df)
+    # append file with ids
+    append_ids(input_path, df, batch=batch)
+    logging.info(f"{row_count_final} rows appended to master file with ids.")
+
+    # share saved ids with files processed next, eg transactions
+    if known_ids is not None:
+        file_name = get_file_name(input_path)
+        known_ids.setdefault(file_name, set()).update(df[cnf.unique_col[file_name]].tolist())
+
+    # append quarantine file
+    if not df_quarantine.empty:
+        append_ids(input_path, df_quarantine, quarantine=True, batch=batch)
+        logging.info(f"{len(df_quarantine)} rows appended to quarantine partition {quarantine_store.get_partition(input_path)}.")
+
+    # save processed file, with pipeline enabled it's compressed and written
+    # in the writer thread while the next file is transformed
+    run_write(write_output, output_path, input_path, df, staged)
+    if items is not None:
+        run_write(write_output, get_line_items_path(output_path), input_path, items, staged)
+
+def process_data(file_name:str, input_path:str, output_path:str=None, known_ids:dict=None, chunks=None, batch=None):
+    """Process customers, products or transformations files,
+    and saved them in different location.
+    If chunk_size is set in config, file is read and processed
+    in chunks of that many rows, so memory doesn't grow with the file size.
+    Outputs are written to temporary files and replaced once all chunks are processed
+    Args:
+        file_name(str): file name that arrived
+        input_path(str): path of the file thta just arrived
+        output__path(str): path where transformed file should be saved
+        known_ids(dict): ids saved from files processed just before, per dataset,
+            ids saved from this file are added to it
+        chunks(generator): dataframes already being read from the file, eg by the pipeline,
+            the file is read here if not given
+        batch(AppendBatch): if given, master and quarantine rows are collected in it,
+            otherwise they're appended once the outputs are saved
+    Returns:
+        paths of the files written, None if processing failed
+    """
+    # temporary files of the outputs, see write_output
+    staged = {}
+    # rows for master and quarantine files are saved together with the outputs
+    flush = batch is None
+    if flush:
+        batch = AppendBatch(0)
+    committing = False
+    try:
+        if output_path is None:
+            output_path = get_output_path(input_path)
+        outputs = [get_storage_path(output_path)]
+        line_items = has_line_items(file_name)
+        if line_items:
+            outputs.append(get_storage_path(get_line_items_path(output_path)))
+
+        # read data into pandas df, whole file or in chunks
+        if chunks is None:
+            chunks = read_gzip_json_chunks(input_path, cnf.chunk_size)
+        chunks = metrics.measure_chunks(chunks, input_path)
+
+        chunk_count = 0
+        for df in chunks:
+            logging.info(f"Processing {input_path}, read in {len(df)} rows.")
+            context = {}
+            df, df_quarantine = transform_data(file_name, input_path, df, known_ids, context)
+            # flat line items from the purchases already parsed by the rules
+            items = get_line_items(input_path, df, context) if line_items else None
+            save_data(input_path, output_path, df, df_quarantine, staged, known_ids=known_ids,
+                      batch=batch, items=items)
+            chunk_count += 1
+            # ids of quarantined rows aren't saved, other files can use them right away,
+            # except duplicates, their ids belong to rows that are saved or to other files
+            reserved = df_quarantine[df_quarantine[quarantine_store.REASON_COLUMN] != quarantine_store.DUPLICATE_ID]
+            if flush and not reserved.empty:
+                col_name = cnf.unique_col[file_name]
+                id_index.release_ids(cnf.map_paths[file_name], col_name, id_index.get_owner(input_path),
+                                     reserved[col_name].dropna().unique().tolist())
+            quarantine_path = quarantine_store.get_partition_path(file_name, quarantine_store.get_partition(input_path))
+            if not df_quarantine.empty and quarantine_path not in outputs:
+                outputs.append(quarantine_path)
+
+        # file without any rows
+        if chunk_count == 0:
+            run_write(write_output, output_path, input_path, pd.DataFrame(), staged)
+            if line_items:
+                run_write(write_output, get_line_items_path(output_path), input_path, pd.DataFrame(), staged)
+
+        # outputs are replaced once all chunks are written, then master and quarantine files are appended
+        batch.add_processed(input_path, outputs)
+        run_write(commit_data, input_path, file_name, staged, batch, flush, id_index.get_owner(input_path))
+        committing = flush
+        return outputs
+
+    except Exception as e:
+        logging.error(f"Error while processing {input_path}: {e}")
+        # chunks written so far are removed, after writes that are still queued
+        run_write(discard_outputs, staged)
+
+    finally:
+        # ids of rows that weren't saved can be used by other files,
+        # ids that are being saved are released by commit_data
+        try:
+            if not committing:
+                id_index.release_ids(cnf.map_paths[file_name], cnf.unique_col[file_name], id_index.get_owner(input_path))
+        except Exception as e:
+            logging.error(f"Error while releasing ids of {input_path}: {e}")
+
+def commit_data(input_path:str, file_name:str, staged:dict, batch, flush:bool, owner:str):
+    """Saves processed file once all of its chunks are written: replaces its outputs,
+    then appends master and quarantine files with its rows and records it as processed.
+    If writing failed, none of it is saved, so the file can be processed again
+    Args:
+        input_path(str): path of the file thta just arrived
+        file_name(str): file name that arrived
+        staged(dict): temporary files from write_output
+        batch(AppendBatch): rows of the file, or of many files (backfill)
+        flush(bool): append the rows now (True), or when the batch is flushed (False)
+        owner(str): owner of the ids reserved while processing the file, from get_owner
+            (it runs in the writer thread, which isn't the owner)
+    """
+    try:
+        if not commit_outputs(input_path, staged):
+            batch.fail(input_path)
+            return
+        if flush:
+            flush_batch(batch)
+    finally:
+        # reserved ids are released once they're in the index
+        if flush:
+            id_index.release_ids(cnf.map_paths[file_name], cnf.unique_col[file_name], owner)
+
+def stage_hash_file(location:str, ids:list, emails:list) -> tuple:
+    """Writes copy of a transformed or quarantine file with data of the given customers hashed,
+    the file is replaced with commit_staged
+    Args:
+        location(str): path to the file
+        ids(list): customer ids to hash
+        emails(list): emails to hash
+    Returns:
+        (path to the copy, number of rows in the file, or of changed rows for json.gz files),
+        path is None if nothing changed
+    """
+    if '.gz' in get_storage_path(location).suffixes:
+        # json.gz files are streamed, only lines of the requested customers are parsed and changed
+        return stage_gzip_json(location, ef.get_line_filter(ids, emails),
+                               functools.partial(ef.hash_record, ids=set(ids), emails=set(emails),
+                                                 hash_field_name_list=cnf.anonymisation))
+    df, _ = ef.hash_requests(read_data(location), ids, emails, cnf.anonymisation)
+    return stage_data(location, df), len(df)
+
+def hash_file(location:str, ids:list, emails:list) -> int:
+    """Hashes data of the given customers in a transformed or quarantine file
+    Args:
+        location(str): path to the file
+        ids(list): customer ids to hash
+        emails(list): emails to hash
+    Returns:
+        number of rows in the file, or of changed rows for json.gz files
+    """
+    tmp_path, rows = stage_hash_file(location, ids, emails)
+    if tmp_path is not None:
+        commit_staged(location, tmp_path)
+    return rows
+
+def get_erasure_executor():
+    """Returns pool hashing transformed files, set by erasure_pool in config.
+    It's started with the first erasure request and kept for the next ones,
+    processes are spawned, as forking a process whose threads hold locks
+    (eg workers or the writer thread) can deadlock the new processes
+    Returns:
+        ThreadPoolExecutor or ProcessPoolExecutor
+    """
+    global erasure_executor
+    with erasure_executor_lock:
+        if erasure_executor is None:
+            if cnf.erasure_pool == 'processes':
+                erasure_executor = ProcessPoolExecutor(max_workers=cnf.erasure_workers,
+                                                       mp_context=multiprocessing.get_context('spawn'),
+                                                       initializer=configure_process, initargs=(get_settings(),))
+            else:
+                erasure_executor = ThreadPoolExecutor(max_workers=cnf.erasure_workers, thread_name_prefix='erasure')
+            # stopped when the process ends, if it wasn't stopped before
+            atexit.register(shutdown_erasure_executor)
+        return erasure_executor
+
+def shutdown_erasure_executor():
+    """Stops pool hashing transformed files, eg when workers stop,
+    next erasure request starts a new one
+    """
+    global erasure_executor
+    with erasure_executor_lock:
+        executor, erasure_executor = erasure_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def hash_files(targets:dict) -> dict:
+    """Hashes requests in transformed files in parallel. Changed files are written
+    as temporary copies, they replace the files only if all files were hashed,
+    otherwise all copies are removed and no file is changed
+    Args:
+        targets(dict): {location: {'id': ids, 'email': emails}}
+    Returns:
+        dict {location: number of hashed rows}
+    """
+    if not targets:
+        return {}
+    staged = {}
+    failed = []
+    try:
+        executor = get_erasure_executor()
+        try:
+            futures = {location: executor.submit(stage_hash_file, location, target['id'], target['email'])
+                       for location, target in targets.items()}
+        except BrokenExecutor:
+            # a process of the pool died, eg out of memory, the next request starts a new pool
+            shutdown_erasure_executor()
+            raise
+        for location, future in futures.items():
+            try:
+                staged[location] = future.result()
+            except Exception as e:
+                failed.append(location)
+                logging.error(f"Error while hashing requests in {location}: {e}")
+                if isinstance(e, BrokenExecutor):
+                    shutdown_erasure_executor()
+        if failed:
+            raise RuntimeError(f"Requests weren't hashed in {len(failed)} of {len(targets)} files, no file was changed.")
+    except BaseException:
+        for tmp_path, _ in staged.values():
+            if tmp_path is not None:
+                discard_staged(tmp_path)
+        raise
+
+    for location, (tmp_path, _) in staged.items():
+        if tmp_path is not None:
+            commit_staged(location, tmp_path)
+    return {location: rows for location, (_, rows) in staged.items()}
+
+def erasure(input_path:str, output_path:str=None):
+    """Hashes data of the customer from the erasure-requests file
+    Args:
+        input_path(str): path of the file thta just arrived
+        output__path(str): path where transformed file should be saved
+    Returns:
+        paths of the files written, None if processing failed
+    """
+    try:
+        if output_path is None:
+            output_path = get_output_path(input_path)
+        outputs = [get_storage_path(output_path)]
+
+        # transformed files that are still being written have to be saved before they're hashed
+        write_behind.flush()
+
+        with metrics.Stage('read', input_path, read_paths=[input_path]) as stage:
+            df_erasure = read_gzip_json(input_path)
+
+            # remove rows where both fields are empty
+            df_erasure = df_erasure.dropna(how='all')
+            row_count = len(df_erasure)
+            stage.rows(rows_out=row_count)
+            stage.memory(requests=df_erasure)
+        logging.info(f"Processing {row_count} erasure requests.")
+
+        map_path = pathlib.Path(cnf.map_paths['customers'])
+
+        # dict with ids from erasure requests and file locations, looked up in the location index
+        with metrics.Stage('locate', input_path) as stage:
+            dict_loc = ef.get_locations(df_erasure)
+
+            # all ids and emails to hash, and the same grouped by transformed file
+            ids = list(dict_loc['id'].keys())
+            emails = list(dict_loc['email'].keys())
+            targets = ef.get_targets(dict_loc)
+            found = [loc for col_name in ['id', 'email'] for loc in dict_loc[col_name].values()]
+            stage.rows(row_count, len(ids) + len(emails))
+
+        # hash each transformed file once for all requests found in it, files are hashed in parallel
+        # and master, quarantine and erasure files are changed only if all of them were hashed
+        with metrics.Stage('hash_outputs', input_path, read_paths=list(targets), write_paths=list(targets)) as stage:
+            hashed = hash_files(targets)
+            for location in hashed:
+                outputs.append(get_storage_path(location))
+                logging.info(f"Requests hashed in {location}.")
+            rows = sum(hashed.values())
+            stage.rows(rows, rows)
+
+        # master and quarantine files are hashed together with the index,
+        # files without any requested customer aren't rewritten
+        with location_index.hashing(ids, emails):
+            if any(loc['master'] for loc in found):
+                # only segments with rows from the files the customers were found in are read,
+                # and only those with requested customers are rewritten
+                sources = [location for loc in found if loc['master'] for location in loc['source_location']]
+                if any(pd.isna(location) for location in sources):
+                    sources = None
+                with metrics.Stage('hash_master', input_path):
+                    rewritten = master_store.rewrite(map_path, functools.partial(ef.hash_requests, ids=ids, emails=emails,
+                                                                                 hash_field_name_list=['email']),
+                                                     sources)
+                logging.info(f"Requests hashed in {rewritten} segments of {map_path}.")
+                outputs.append(master_store.get_store_path(map_path))
+
+            # save quarantined records with hashed data, only partitions
+            # with requested customers in their index are rewritten
+            if any(loc['quarantine'] for loc in found):
+                with metrics.Stage('hash_quarantine', input_path):
+                    rewritten = quarantine_store.rewrite('customers', ids, emails,
+                                                         functools.partial(hash_file, ids=ids, emails=emails))
+                logging.info(f"Requests hashed in {len(rewritten)} partitions of {quarantine_store.get_store_path('customers')}.")
+                outputs.extend(rewritten)
+
+        # save erasure request file, with hashed data
+        with metrics.Stage('write', input_path, write_paths=[output_path]) as stage:
+            df_erasure, _ = ef.hash_requests(df_erasure, ids, emails, ['email'], id_field_name='customer-id')
+            write_data(output_path, df_erasure)
+            stage.rows(row_count, len(df_erasure))
+        logging.info(f"Requests hashed in {output_path}.")
+
+        # log missed request, eg in case email didn't match id or it was a repetitive request
+        missed = ef.missed_requests(df_erasure, dict_loc)
+        if missed:
+            logging.warning(missed)
+
+        return outputs
+
+    except Exception as e:
+        logging.error(f"Error while processing {input_path}: {e}")
+
+def record_processed(input_path:str, outputs:list):
+    """Saves file in the manifest of processed files, with pipeline enabled
+    it's saved in the writer thread once the transformed file is written
+    Args:
+        input_path(str): path of the file that was processed
+        outputs(list): paths of the files written while processing it
+    """
+    if cnf.pipeline_enabled:
+        write_behind.submit(processed_files.record, input_path, outputs)
+    else:
+        processed_files.record(input_path, outputs)
+
+def is_skipped(input_path:str) -> bool:
+    """Checks the manifest of processed files, files processed before are skipped,
+    changed files are processed again only if reprocess_changed_files is set
+    Args:
+        input_path(str): path of the file thta just arrived
+    Returns:
+        True if the file shouldn't be processed
+    """
+    status = processed_files.get_status(input_path)
+    skipped = processed_files.should_skip(status)
+    if status == 'processed':
+        logging.info(f"{input_path} was already processed, skipped.")
+    elif status == 'changed':
+        outputs = processed_files.get_outputs(input_path)
+        if skipped:
+            logging.warning(f"{input_path} changed since it was processed, skipped. "
+                            f"Set reprocess_changed_files to process it again, it wrote {outputs}.")
+        else:
+            logging.warning(f"{input_path} changed since it was processed, processing it again, it wrote {outputs}.")
+    return skipped
+
+def process_file(input_path:str, output_path:str=None, known_ids:dict=None, chunks=None, batch=None):
+    """Based on the name of the file that arrived,
+    transforms data or does erasure request
+    Args:
+        input_path(str): path of the file thta just arrived
+        output__path(str): path where transformed file should be saved
+        known_ids(dict): ids saved from files processed just before, per dataset,
+            eg customers and products of the same date, shared with transactions
+        chunks(generator): dataframes already being read from the file, eg by the pipeline
+        batch(AppendBatch): if given, master and quarantine rows are collected in it,
+            it's flushed before erasure requests are processed
+    """
+    if output_path is None:
+        output_path = get_output_path(input_path)
+
+    # get file name - 'customers', 'transactions' etc
+    file_name = get_file_name(input_path)
+
+    if is_skipped(input_path):
+        return
+
+    outputs = None
+    if file_name in ['customers', 'products', 'transactions']:
+        outputs = process_data(file_name, input_path, output_path, known_ids, chunks, batch)
+    elif file_name == 'erasure-requests':
+        # customers collected in the batch have to be saved before they're hashed
+        if batch is not None:
+            write_behind.flush()
+            flush_batch(batch)
+        outputs = erasure(input_path, output_path)
+
+    # files that failed are processed again next time,
+    # other files are recorded once their rows are saved, see commit_data
+    if outputs is not None and file_name == 'erasure-requests':
+        record_processed(input_path, outputs)
+
+    # save totals of all stages for the metrics scraper
+    try:
+        metrics.export()
+    except Exception as e:
+        logging.error(f"Error while saving metrics: {e}")
+
+    # save memory profile of the file, once it's written by the writer thread
+    if cnf.profiling_enabled:
+        try:
+            write_behind.flush()
+            profiling.save_report(input_path)
+        except Exception as e:
+            logging.error(f"Error while saving memory profile: {e}")
\ No newline at end of file
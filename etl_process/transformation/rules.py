@@ -0,0 +1,123 @@
+import functools
+import logging
+import pandas as pd
+import config.config as cnf
+import transformation.transformations as t
+import ingestion.id_index as id_index
+import ingestion.quarantine_store as quarantine_store
+import metrics
+
+class Rule:
+    """Check that rows of a dataset have to pass, rows that fail it
+    are quarantined with its reason code
+    """
+    def __init__(self, reason:str, description:str, check):
+        """
+        Args:
+            reason(str): reason code of quarantined rows, one of quarantine_store.REASONS
+            description(str): what failed, used in the log
+            check(function): takes data, rows that passed previous rules and the context,
+                returns boolean series, True for rows that fail
+        """
+        self.reason = reason
+        self.description = description
+        self.check = check
+
+def get_items(df:pd.DataFrame, context:dict) -> pd.DataFrame:
+    """Returns products of all transactions, flattened once for all rules
+    Args:
+        df(pd.DataFrame): transactions data
+        context(dict): context of the rules
+    Returns:
+        dataframe from flatten_purchases
+    """
+    if 'items' not in context:
+        context['items'] = t.flatten_purchases(df)
+    return context['items']
+
+def check_missing(df:pd.DataFrame, valid:pd.Series, context:dict, col_list:list) -> pd.Series:
+    """Rows with missing data in col_list"""
+    return t.missing_mask(df, col_list)
+
+def check_duplicate(df:pd.DataFrame, valid:pd.Series, context:dict, file_name:str) -> pd.Series:
+    """Rows with ids that already exist, new ids of valid rows are reserved for the file"""
+    return t.duplicate_mask(df, cnf.map_paths[file_name], cnf.unique_col[file_name], context['owner'],
+                            context['known_ids'].get(file_name), valid)
+
+def check_positive(df:pd.DataFrame, valid:pd.Series, context:dict, col_names:list) -> pd.Series:
+    """Rows with values not greater than 0 in col_names"""
+    return t.non_positive_mask(df, col_names)
+
+def check_total_cost(df:pd.DataFrame, valid:pd.Series, context:dict) -> pd.Series:
+    """Transactions where total cost doesn't match the products"""
+    return t.cost_mismatch_mask(df, get_items(df, context))
+
+def check_reference(df:pd.DataFrame, valid:pd.Series, context:dict, source_col:str, file_name:str) -> pd.Series:
+    """Rows with ids in source_col that don't exist in the dataset file_name"""
+    items = get_items(df, context) if source_col not in df.columns else None
+    return t.unknown_reference_mask(df, source_col, file_name, items, context['known_ids'].get(file_name), valid)
+
+def get_rules(file_name:str) -> list:
+    """Compiles rules of a dataset from config, in the order they're checked:
+    not_empty_cols, unique_col, positive_col, total_cost_check and reference_cols.
+    A row that fails several rules gets the reason of the first one
+    Args:
+        file_name(str): dataset, eg customers
+    Returns:
+        list of rules
+    """
+    rules = []
+    if cnf.not_empty_cols.get(file_name):
+        col_list = cnf.not_empty_cols[file_name]
+        rules.append(Rule(quarantine_store.MISSING_FIELDS, f'were missing data in {col_list}',
+                          functools.partial(check_missing, col_list=col_list)))
+    if file_name in cnf.unique_col:
+        rules.append(Rule(quarantine_store.DUPLICATE_ID, 'contained non unique id',
+                          functools.partial(check_duplicate, file_name=file_name)))
+    if cnf.positive_col.get(file_name):
+        col_names = cnf.positive_col[file_name]
+        rules.append(Rule(quarantine_store.NON_POSITIVE_VALUE, f'contained values not greater than 0 in {col_names}',
+                          functools.partial(check_positive, col_names=col_names)))
+    if file_name in cnf.total_cost_check:
+        rules.append(Rule(quarantine_store.COST_MISMATCH, "total cost didn't match", check_total_cost))
+    for source_col, reference in cnf.reference_cols.get(file_name, {}).items():
+        rules.append(Rule(quarantine_store.UNKNOWN_REFERENCE, f"had {source_col} that didn't exist in {reference}",
+                          functools.partial(check_reference, source_col=source_col, file_name=reference)))
+    return rules
+
+def apply_rules(file_name:str, input_path:str, df:pd.DataFrame, known_ids:dict=None, context:dict=None):
+    """Checks all rows against the rules of the dataset. Each rule only marks rows
+    that fail it, the data is split into valid and quarantined rows once at the end
+    Args:
+        file_name(str): file name that arrived
+        input_path(str): path of the file thta just arrived
+        df(pd.DataFrame): data from the file, or a chunk of it
+        known_ids(dict): ids saved from files processed just before, per dataset,
+            eg {'customers': {1, 2}}, used to check references and as existing ids
+        context(dict): if given, it's used as the context of the rules, eg to reuse
+            products flattened by the rules ('items') after they're applied
+    Returns:
+        dataframe with rows that passed all rules,
+        and dataframe with quarantined rows and their reason
+    """
+    valid = pd.Series(True, index=df.index)
+    reasons = pd.Series(None, index=df.index, dtype=object)
+    context = {} if context is None else context
+    context.update(owner=id_index.get_owner(input_path), known_ids=known_ids or {})
+
+    for rule in get_rules(file_name):
+        with metrics.Stage(rule.reason, input_path) as stage:
+            rows_in = int(valid.sum())
+            failed = rule.check(df, valid, context) & valid
+            reasons[failed] = rule.reason
+            valid &= ~failed
+            stage.rows(rows_in, rows_in - int(failed.sum()))
+        if failed.any():
+            logging.info(f"{int(failed.sum())} rows {rule.description}.")
+
+    with metrics.Stage('split', input_path) as stage:
+        df_quarantine = df[~valid].assign(**{quarantine_store.REASON_COLUMN: reasons[~valid]})
+        df = df[valid]
+        stage.rows(len(valid), len(df))
+        stage.memory(df=df, quarantine=df_quarantine, items=context.get('items'))
+    return df, df_quarantine
@@ -1,184 +1,253 @@
-import pathlib
-from ingestion.read_write import read_gzip_json
-import config.config as cnf
-import pandas as pd
-
-pd.options.mode.chained_assignment = None
-
-def remove_rows_with_na(df:pd.DataFrame, col_list:list):
-    """Removes rows where some data
-    in a given column list is not populated
-    Args:
-        df(pd.Dataframe): data
-        col_list(list): columns that has to be populated
-    Returns:
-        pandas dataframe with removed columns
-    """
-    for col in col_list:
-        df[col] = df[col].replace('', None)
-
-    df_quarantine = df[df[col_list].isna().any(axis=1)]
-    df = df.dropna(subset=col_list)
-    return df, df_quarantine
-
-def source_location_map(df:pd.DataFrame, col_list:list=None, source:str=''):
-    """Creates a dataframe that contains only ids (eg customer_id and email)
-    and location of the output file (eg transformed/2020/01/02/customer.json.gz)
-    Args:
-        df(pd.Dataframe): data
-        col_list(list): columns to save
-        source(str): location of the output file
-    Returns:
-        dataframe with map between id and location to the output file
-    """
-    if col_list != None:
-        df = df[col_list]
-    df['source_location'] = source
-    return df
-
-def keep_unique_ids(source_df:pd.DataFrame, map_df:pd.DataFrame, col_name:str):
-    """Checks if ids with the file that arrived are unique within
-    the whole dataset, removes rows if not
-    Args:
-        source_df(pd.DataFrame): dataframe containing data that just arrived
-        map_df(pd.DataFrame): dataframe with aggregated ids
-        col_name(str): name of the column containing unique id
-    Returns:
-        dataframe with removed rows where id wasn't unique
-    """
-    source_df = source_df.drop_duplicates(subset=col_name)
-    return source_df[~source_df[col_name].isin(map_df[col_name])]
-
-def remove_id_dups(df:pd.DataFrame, map_path:str, col_name:str):
-    """Checks if ids with the file that arrived are unique within
-    the whole dataset, removes rows if not
-    Args:
-        df(pd.DataFrame): dataframe containing data that just arrived
-        map_path(str): path to file with aggregated ids
-        col_name(str): name of the column containing unique id
-    Returns:
-        dataframe with removed rows where id wasn't unique
-    """
-    # check if aggregated file exists and compare ids
-    map_path = pathlib.Path(map_path)
-    if map_path.is_file():
-        map_df = read_gzip_json(map_path)
-        df = keep_unique_ids(df, map_df, col_name)
-    return df
-
-def get_ids(file_path:str, col_name:str):
-    """Returns list of all ids in a file
-    Args:
-        file_path(str): path to the file
-        col_name(str): name of the column with id
-    Returns:
-        List of all ids
-    """
-    df = read_gzip_json(file_path)
-    return df[col_name].tolist()
-    
-def get_sku_ids(purchases:dict):
-    """From a given dict with purchases,
-    returns list of all product sku numbers
-    Args:
-        purchases(dict): dict with all purchases for a transaction
-    Returns:
-        list of all products
-    """
-    sku_list = []
-    for product in purchases['products']:
-        sku_list.append(product['sku'])
-    return sku_list
-
-def id_exists_check(source_df:pd.DataFrame, source_col:str,
-                    file_name:str, file_path:str):
-    """Checks if customer ids and sku numbers in a transactions file
-    exists within the whole dataset. Removes rows from trasactions
-    if customer id or sku number wasn't found.
-    Args:
-        source_df(pd.DataFrame): dataframe containing transactions
-            that just arrived
-        source_col(str): name column containing customer id or sku
-            in transactions data
-        file_name(str): customers or products
-        file_path(str): path to customer or products file that arrived
-            at the same time as transactions
-    Returns:
-        Dataframe with the rows removed
-    """
-    # name of the id for either customers or products dataset
-    id_name = cnf.unique_col[file_name]
-
-    # ids that arrived at the same time and may be missing from the master file
-    additional_ids = get_ids(file_path, id_name)
-
-    # ids from the master file
-    map_path = pathlib.Path(cnf.map_paths[file_name])
-    map_df = read_gzip_json(map_path)
-    existing_ids = map_df[id_name].to_list()
-
-    # combine lists with ids
-    existing_ids.extend(additional_ids)
-
-    # remove rows that contain unknown customer id or sku number
-    if source_col == 'sku':
-        source_df['sku_ids'] = source_df['purchases'].apply(lambda x: get_sku_ids(x))
-        source_df['check'] = source_df['sku_ids'].apply(lambda x: all(sku in existing_ids for sku in x))
-        source_df = source_df[source_df['check']]
-        source_df = source_df.drop(['check', 'sku_ids'], axis=1)  
-    elif source_col == 'customer_id':
-        source_df = source_df[source_df[source_col].isin(existing_ids)]
-
-    return source_df
-
-def keep_positive_vals(df:pd.DataFrame, col_names:list):
-    """Remove rows where values in the specified columns
-    are 0 or less
-    Args:
-        df(pd.Dataframe): data that just arrived
-        col_names(list): names of the columns
-            that should contain positive values
-    Returns:
-        dataframe with removed rows
-    """
-    for col in col_names:
-        df = df[df[col] > 0]
-    return df
-
-def get_total_cost(purchases:dict):
-    """Calculates total cost of the purchases
-    Args:
-        purchases(dict): dictionary with purchases
-    Returns:
-        calculated total cost
-    """
-    total_cost = 0
-    for product in purchases['products']:
-        total = float(product['total'])
-        total_cost += total
-    return round(total_cost, 2)
-
-def total_cost_check(df:pd.DataFrame):
-    """Removes rows where total cost doesn't match
-    calculated total cost
-    Args:
-        df(pd.Dataframe): transactions data
-    Returns:
-        dataframe with transactions where total cost matches
-        calculated total
-    """
-    # calculated total cost
-    df['total_calculated'] = df['purchases'].apply(lambda x: get_total_cost(x))
-
-    # get given total cost from the dict
-    df['total_cost'] = df['purchases'].apply(lambda x: float(x['total_cost']))
-
-    # compare calculated total cost with the one in the data
-    df = df[df['total_calculated']==df['total_cost']]
-    df_q = df[df['total_calculated']!=df['total_cost']]
-
-    # rmeove not needed columns
-    df = df.drop(['total_calculated', 'total_cost'], axis=1)
-    df_q = df_q.drop(['total_calculated', 'total_cost'], axis=1)
-
-    return df, df_q
\ No newline at end of file
+import ingestion.id_index as id_index
+import config.config as cnf
+import pandas as pd
+
+def missing_mask(df:pd.DataFrame, col_list:list) -> pd.Series:
+    """Marks rows where some data in a given column list
+    is not populated, empty strings count as missing
+    Args:
+        df(pd.Dataframe): data
+        col_list(list): columns that has to be populated
+    Returns:
+        boolean series, True for rows with missing data
+    """
+    cols = df[col_list]
+    return (cols.isna() | cols.eq('')).any(axis=1)
+
+def remove_rows_with_na(df:pd.DataFrame, col_list:list):
+    """Removes rows where some data
+    in a given column list is not populated
+    Args:
+        df(pd.Dataframe): data
+        col_list(list): columns that has to be populated
+    Returns:
+        pandas dataframe with removed columns, and dataframe with the removed rows
+    """
+    mask = missing_mask(df, col_list)
+    return df[~mask], df[mask]
+
+def source_location_map(df:pd.DataFrame, col_list:list=None, source:str=''):
+    """Creates a dataframe that contains only ids (eg customer_id and email)
+    and location of the output file (eg transformed/2020/01/02/customer.json.gz)
+    Args:
+        df(pd.Dataframe): data
+        col_list(list): columns to save
+        source(str): location of the output file
+    Returns:
+        dataframe with map between id and location to the output file
+    """
+    if col_list != None:
+        df = df[col_list]
+    return df.assign(source_location=source)
+
+def duplicate_mask(df:pd.DataFrame, map_path:str, col_name:str, owner:str=None,
+                   known_ids:set=None, valid:pd.Series=None) -> pd.Series:
+    """Marks rows with ids that already exist within the whole dataset,
+    or that appeared earlier in the file that arrived.
+    Ids are looked up in the index kept next to the master file,
+    so the master file itself is not loaded
+    Args:
+        df(pd.DataFrame): dataframe containing data that just arrived
+        map_path(str): path to file with aggregated ids
+        col_name(str): name of the column containing unique id
+        owner(str): if given, new ids are reserved for the owner, ids reserved
+            by other workers are marked as well
+        known_ids(set): ids already saved, eg by files processed before,
+            they aren't looked up in the index
+        valid(pd.Series): rows that passed previous checks, only their ids are
+            looked up and reserved, all rows if None
+    Returns:
+        boolean series, True for rows where id isn't unique
+    """
+    values = df[col_name] if valid is None else df.loc[valid, col_name]
+    ids = values.dropna().unique().tolist()
+    known_ids = known_ids or set()
+    existing_ids = {i for i in ids if i in known_ids}
+    ids = [i for i in ids if i not in known_ids]
+    if owner is None:
+        existing_ids |= id_index.existing_ids(map_path, col_name, ids)
+    else:
+        existing_ids |= set(ids) - id_index.reserve_ids(map_path, col_name, ids, owner)
+
+    # first row of each id is kept, later rows are duplicates
+    repeated = values.duplicated().reindex(df.index, fill_value=False)
+    return repeated | df[col_name].isin(existing_ids)
+
+def remove_id_dups(df:pd.DataFrame, map_path:str, col_name:str, owner:str=None, known_ids:set=None):
+    """Checks if ids with the file that arrived are unique within
+    the whole dataset, removes rows if not
+    Args:
+        df(pd.DataFrame): dataframe containing data that just arrived
+        map_path(str): path to file with aggregated ids
+        col_name(str): name of the column containing unique id
+        owner(str): if given, new ids are reserved for the owner, ids reserved
+            by other workers are removed as well
+        known_ids(set): ids already saved, eg by files processed before,
+            they aren't looked up in the index
+    Returns:
+        dataframe with removed rows where id wasn't unique
+    """
+    return df[~duplicate_mask(df, map_path, col_name, owner, known_ids)]
+
+def flatten_purchases(df:pd.DataFrame) -> pd.DataFrame:
+    """Explodes products from the nested purchases column
+    into a dataframe with one row per product,
+    index of each row is the index of its transaction
+    Args:
+        df(pd.DataFrame): transactions data
+    Returns:
+        dataframe with products bought in each transaction (eg sku, quantity, total)
+    """
+    products = df['purchases'].str.get('products').explode().dropna()
+    if products.empty:
+        return pd.DataFrame(columns=['sku', 'total'])
+    items = pd.DataFrame(products.tolist(), index=products.index)
+    items['total'] = pd.to_numeric(items['total'], errors='coerce')
+    return items
+
+def line_items(df:pd.DataFrame, items:pd.DataFrame=None) -> pd.DataFrame:
+    """Creates flat line items of transactions, one row per product bought,
+    so they can be read without parsing the nested purchases
+    Args:
+        df(pd.DataFrame): transactions data
+        items(pd.DataFrame): products from flatten_purchases, they may include
+            products of other rows (eg quarantined), flattened here if not given
+    Returns:
+        dataframe with transaction_id, customer_id, sku, quantity, total and date
+    """
+    if items is None:
+        items = flatten_purchases(df)
+    items = items[items.index.isin(df.index)].reindex(columns=['sku', 'quantity', 'total'])
+    transactions = df.loc[items.index].reset_index(drop=True)
+    items = items.reset_index(drop=True)
+    return pd.DataFrame({
+        'transaction_id': transactions['transaction_id'],
+        'customer_id': transactions['customer_id'],
+        'sku': items['sku'],
+        'quantity': items['quantity'],
+        'total': items['total'],
+        # date part of the transaction time, eg 2020-01-02
+        'date': transactions['transaction_time'].astype('string').str[:10],
+    })
+
+def unknown_reference_mask(source_df:pd.DataFrame, source_col:str, file_name:str,
+                           items:pd.DataFrame=None, known_ids:set=None, valid:pd.Series=None) -> pd.Series:
+    """Marks rows with ids that don't exist within the whole dataset they refer to,
+    eg customer ids and sku numbers in a transactions file
+    Args:
+        source_df(pd.DataFrame): dataframe containing transactions
+            that just arrived
+        source_col(str): name column containing customer id, or sku
+            in products of purchases if it isn't a column of the data
+        file_name(str): customers or products
+        items(pd.DataFrame): products from flatten_purchases,
+            flattened here if needed and not given
+        known_ids(set): ids of customers or products that were just processed,
+            eg from the same date directory, they don't have to be looked up
+        valid(pd.Series): rows that passed previous checks, only their ids are
+            looked up, all rows if None
+    Returns:
+        boolean series, True for rows with unknown customer id or sku number
+    """
+    # name of the id for either customers or products dataset
+    id_name = cnf.unique_col[file_name]
+
+    # ids that are checked, eg all sku numbers in the transactions,
+    # index of each value is the index of its row
+    if source_col in source_df.columns:
+        values = source_df[source_col]
+    else:
+        if items is None:
+            items = flatten_purchases(source_df)
+        values = items[source_col]
+    if valid is not None:
+        values = values[values.index.isin(source_df.index[valid])]
+
+    # ids found in the master file, only ids that weren't just processed are looked up
+    known_ids = known_ids or set()
+    lookup = [value for value in values.dropna().unique().tolist() if value not in known_ids]
+    existing_ids = id_index.existing_ids(cnf.map_paths[file_name], id_name, lookup)
+    found = values.isin(existing_ids) | values.isin(known_ids)
+    return pd.Series(source_df.index.isin(values.index[~found]), index=source_df.index)
+
+def id_exists_check(source_df:pd.DataFrame, source_col:str, file_name:str,
+                    items:pd.DataFrame=None, known_ids:set=None):
+    """Checks if customer ids and sku numbers in a transactions file
+    exists within the whole dataset. Removes rows from trasactions
+    if customer id or sku number wasn't found.
+    Args:
+        source_df(pd.DataFrame): dataframe containing transactions
+            that just arrived
+        source_col(str): name column containing customer id or sku
+            in transactions data
+        file_name(str): customers or products
+        items(pd.DataFrame): products from flatten_purchases,
+            flattened here if not given
+        known_ids(set): ids of customers or products that were just processed,
+            eg from the same date directory, they don't have to be looked up
+    Returns:
+        Dataframe with the rows removed
+    """
+    return source_df[~unknown_reference_mask(source_df, source_col, file_name, items, known_ids)]
+
+def non_positive_mask(df:pd.DataFrame, col_names:list) -> pd.Series:
+    """Marks rows where values in the specified columns
+    are 0 or less, missing, or not numbers (eg empty strings)
+    Args:
+        df(pd.Dataframe): data that just arrived
+        col_names(list): names of the columns
+            that should contain positive values
+    Returns:
+        boolean series, True for rows with values that aren't positive
+    """
+    values = df[col_names].apply(pd.to_numeric, errors='coerce')
+    return ~(values > 0).all(axis=1)
+
+def keep_positive_vals(df:pd.DataFrame, col_names:list):
+    """Remove rows where values in the specified columns
+    are 0 or less
+    Args:
+        df(pd.Dataframe): data that just arrived
+        col_names(list): names of the columns
+            that should contain positive values
+    Returns:
+        dataframe with removed rows
+    """
+    return df[~non_positive_mask(df, col_names)]
+
+def cost_mismatch_mask(df:pd.DataFrame, items:pd.DataFrame=None) -> pd.Series:
+    """Marks rows where total cost doesn't match
+    calculated total cost
+    Args:
+        df(pd.Dataframe): transactions data
+        items(pd.DataFrame): products from flatten_purchases,
+            flattened here if not given
+    Returns:
+        boolean series, True for transactions where total cost doesn't match
+    """
+    if items is None:
+        items = flatten_purchases(df)
+
+    # calculated total cost, transactions without products cost 0
+    total_calculated = items['total'].groupby(level=0).sum().round(2)
+    total_calculated = total_calculated.reindex(df.index, fill_value=0)
+
+    # get given total cost from the dict, costs that aren't numbers don't match
+    total_cost = pd.to_numeric(df['purchases'].str.get('total_cost'), errors='coerce')
+
+    # compare calculated total cost with the one in the data
+    return ~(total_calculated == total_cost)
+
+def total_cost_check(df:pd.DataFrame, items:pd.DataFrame=None):
+    """Removes rows where total cost doesn't match
+    calculated total cost
+    Args:
+        df(pd.Dataframe): transactions data
+        items(pd.DataFrame): products from flatten_purchases,
+            flattened here if not given
+    Returns:
+        dataframe with transactions where total cost matches
+        calculated total, and dataframe with the removed transactions
+    """
+    mask = cost_mismatch_mask(df, items)
+    return df[~mask], df[mask]
\ No newline at end of file
@@ -0,0 +1,70 @@
+import heapq
+import itertools
+import threading
+import time
+import config.config as cnf
+from transformation.utils import get_file_name
+
+# priority of the item that stops a worker, taken after everything else
+STOP_PRIORITY = float('inf')
+
+def get_priority(paths:list) -> int:
+    """Returns priority of a batch from the datasets of its files,
+    eg erasure-requests 0, the lowest number of its files
+    Args:
+        paths(list): paths of the files
+    Returns:
+        priority, lower is processed first
+    """
+    return min(cnf.file_priority.get(get_file_name(path), cnf.file_priority['default']) for path in paths)
+
+class WorkQueue:
+    """Bounded priority queue of batches of files. Batches with a lower priority
+    are taken first, batches with the same priority in the order they came.
+    When the queue is full, batches wait until a worker takes one (backpressure),
+    except urgent ones (priority 0 or lower, eg erasure requests)
+    which are queued anyway, so they never wait behind bulk loads
+    """
+    def __init__(self, maxsize:int):
+        """
+        Args:
+            maxsize(int): max number of queued batches, 0 for no limit
+        """
+        self.maxsize = maxsize
+        # (priority, number, time it was queued, queue depth, item)
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def is_full(self) -> bool:
+        return 0 < self.maxsize <= len(self.heap)
+
+    def put(self, item, priority:float, block:bool=True) -> bool:
+        """Adds item to the queue
+        Args:
+            item: eg (paths, on_done)
+            priority(float): lower is taken first
+            block(bool): wait while the queue is full (True), or return False (False)
+        Returns:
+            True if the item was queued
+        """
+        with self.condition:
+            while priority > 0 and priority != STOP_PRIORITY and self.is_full():
+                if not block:
+                    return False
+                self.condition.wait()
+            heapq.heappush(self.heap, (priority, next(self.counter), time.monotonic(), len(self.heap) + 1, item))
+            self.condition.notify_all()
+        return True
+
+    def get(self) -> tuple:
+        """Takes item with the lowest priority, waits until there is one
+        Returns:
+            (item, seconds it waited in the queue, number of queued items when it was added)
+        """
+        with self.condition:
+            while not self.heap:
+                self.condition.wait()
+            _, _, queued, depth, item = heapq.heappop(self.heap)
+            self.condition.notify_all()
+        return item, time.monotonic() - queued, depth
@@ -0,0 +1,195 @@
+import threading
+import contextlib
+import logging
+import pathlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import config.config as cnf
+from config.configure_log import configure_process, get_settings
+import ingestion.write_behind as write_behind
+import metrics
+from ingestion.file_lock import FileLock
+from pipeline import prefetch
+from transformation.process_files import process_file, shutdown_erasure_executor
+from transformation.utils import get_file_name
+from work_queue import WorkQueue, get_priority, STOP_PRIORITY
+
+# master files used while processing each file, and how they're locked.
+# 'shared' - files of different dates are processed at the same time,
+# unique ids are reserved in the id index so they're accepted only once,
+# 'exclusive' - nothing else uses the dataset, eg erasure rewrites customers files
+DATASET_LOCKS = {
+    'customers': {'customers': 'shared'},
+    'products': {'products': 'shared'},
+    'transactions': {'customers': 'shared', 'products': 'shared', 'transactions': 'shared'},
+    'erasure-requests': {'customers': 'exclusive'},
+}
+
+def get_dataset_lock_path(dataset:str) -> pathlib.Path:
+    """Returns path of the lock file of a dataset, next to its master file,
+    eg maps/customers.lock
+    Args:
+        dataset(str): eg customers
+    Returns:
+        path to the lock file
+    """
+    return pathlib.Path(cnf.map_paths[dataset]).with_name(f'{dataset}.lock')
+
+def lock_datasets(file_name:str) -> contextlib.ExitStack:
+    """Locks master files used while processing a file, for other threads
+    and processes, always in the same order so workers can't deadlock
+    Args:
+        file_name(str): file name that arrived, eg customers
+    Returns:
+        locks, released when closed
+    """
+    stack = contextlib.ExitStack()
+    try:
+        for dataset, mode in sorted(DATASET_LOCKS.get(file_name, {}).items()):
+            stack.enter_context(FileLock(get_dataset_lock_path(dataset), shared=mode == 'shared'))
+    except BaseException:
+        stack.close()
+        raise
+    return stack
+
+def process_batch(paths:list, known_ids:dict=None) -> dict:
+    """Processes batch of files one by one, ids saved from each file
+    are passed to the next ones, eg customers to transactions.
+    With pipeline enabled the next file is read while the current one is transformed.
+    Errors are logged so the worker keeps running
+    Args:
+        paths(list): paths of the files that just arrived
+        known_ids(dict): ids saved from earlier batches of the same date, per dataset,
+            ids saved from the files are added to it
+    Returns:
+        known_ids with ids saved from the files
+    """
+    known_ids = {} if known_ids is None else known_ids
+    if cnf.pipeline_enabled:
+        batch = prefetch(paths, cnf.pipeline_buffer_size)
+    else:
+        batch = ((path, None) for path in paths)
+    for path, chunks in batch:
+        try:
+            if not pathlib.Path(path).is_file():
+                continue
+            file_name = get_file_name(path)
+            locks = lock_datasets(file_name)
+            try:
+                logging.info(f"Worker {threading.current_thread().name} processing {path}.")
+                process_file(path, known_ids=known_ids, chunks=chunks)
+            finally:
+                if cnf.pipeline_enabled:
+                    # released once transformed files are written, so erasure can't see them half written
+                    write_behind.submit(locks.close)
+                else:
+                    locks.close()
+        except Exception as e:
+            logging.error(f"Error while processing {path}: {e}")
+    return known_ids
+
+def process_batch_in_process(paths:list, known_ids:dict=None) -> dict:
+    """Processes batch of files in a worker process, waits until
+    all files are written, as the process may be stopped after it
+    Args:
+        paths(list): paths of the files that just arrived
+        known_ids(dict): ids saved from earlier batches of the same date, per dataset
+    Returns:
+        known_ids with ids saved from the files, sent back to the main process
+    """
+    known_ids = process_batch(paths, known_ids)
+    write_behind.flush()
+    return known_ids
+
+class WorkerPool:
+    """Resident worker threads processing batches of files from a bounded priority queue,
+    pandas, config and log handlers are loaded once for all files
+    """
+    def __init__(self, worker_count:int, queue_size:int):
+        self.file_queue = WorkQueue(queue_size)
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(worker_count)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, paths:list, on_done=None, priority:int=None, block:bool=True, known_ids:dict=None) -> bool:
+        """Adds batch of files to the queue, batches with lower priority are processed first
+        Args:
+            paths(list): paths of the files, processed in this order
+            on_done(function): called when the batch is processed
+            priority(int): priority of the batch, from file_priority of its files if None
+            block(bool): wait if the queue is full (True), or return False (False),
+                batches with priority 0 are queued anyway
+            known_ids(dict): ids saved from earlier batches of the same date, per dataset,
+                eg customers for transactions, ids saved from the files are added to it
+        Returns:
+            True if the batch was queued
+        """
+        if priority is None:
+            priority = get_priority(paths)
+        return self.file_queue.put((paths, on_done, known_ids), priority, block)
+
+    def stop(self):
+        """Lets workers finish files that are already queued and stops them"""
+        for _ in self.threads:
+            self.file_queue.put(None, STOP_PRIORITY)
+        for thread in self.threads:
+            thread.join()
+        write_behind.flush()
+        shutdown_erasure_executor()
+
+    def run_batch(self, paths:list, known_ids:dict=None):
+        process_batch(paths, known_ids)
+
+    def work(self):
+        while True:
+            batch, seconds, depth = self.file_queue.get()
+            if batch is None:
+                break
+            paths, on_done, known_ids = batch
+            logging.info(f"Batch of {len(paths)} files from {pathlib.Path(paths[0]).parent} waited "
+                         f"{seconds:.2f}s in the queue, queue depth was {depth}.")
+            metrics.record_wait(paths[0], seconds, depth)
+            try:
+                self.run_batch(paths, known_ids)
+            finally:
+                if on_done is not None:
+                    on_done()
+
+class ProcessPool(WorkerPool):
+    """Worker processes processing batches of files, so batches of different
+    dates use all cores. Master and quarantine files are locked with file locks
+    and unique ids are reserved in the id index, so processes can share them.
+    Batches are taken from the priority queue by a thread for each process.
+    Processes are spawned, forking a process whose threads hold locks
+    (eg the scheduler, workers or the writer thread) can deadlock the new processes
+    """
+    def __init__(self, worker_count:int, queue_size:int):
+        super().__init__(worker_count, queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=configure_process, initargs=(get_settings(),))
+
+    def run_batch(self, paths:list, known_ids:dict=None):
+        """Sends batch of files to a worker process and waits until it's processed
+        Args:
+            paths(list): paths of the files, processed in this order
+            known_ids(dict): ids saved from earlier batches of the same date, per dataset,
+                updated with ids the process sends back
+        """
+        try:
+            ids = self.executor.submit(process_batch_in_process, paths, known_ids).result()
+            if known_ids is not None:
+                known_ids.update(ids)
+        except Exception as e:
+            logging.error(f"Error while processing {paths}: {e}")
+        # queue metrics are recorded in this process
+        try:
+            metrics.export()
+        except Exception as e:
+            logging.error(f"Error while saving metrics: {e}")
+
+    def stop(self):
+        """Lets processes finish batches that are already queued and stops them"""
+        super().stop()
+        self.executor.shutdown(wait=True)